@@ -1,14 +1,52 @@
 #!/bin/bash
+set -e
 
-# Create directories for Python packages and pip cache
-mkdir -p /data/python-packages
-mkdir -p /data/pip-cache
-export PYTHONPATH=/data/python-packages:$PYTHONPATH
+# Module dependencies live on the data volume and are installed again only
+# when requirements.lock changes, so restarts and new workers start Synapse
+# at once. If /data/wheelhouse holds wheels for the locked packages they are
+# installed from there without network access; build it with
+#
+#   pip download --only-binary=:all: --no-deps -d data/wheelhouse -r config/requirements.lock
+PACKAGES_DIR=/data/python-packages
+LOCKFILE=/config/requirements.lock
+WHEELHOUSE=${WHEELHOUSE:-/data/wheelhouse}
+
+export PYTHONPATH=$PACKAGES_DIR:$PYTHONPATH
 export PIP_CACHE_DIR=/data/pip-cache
+export PIP_DISABLE_PIP_VERSION_CHECK=1
+
+install_dependencies() {
+    local wanted
+    wanted=$(sha256sum "$LOCKFILE" | cut -d' ' -f1)
+    if [ "$(cat "$PACKAGES_DIR/.lock-sha256" 2>/dev/null)" = "$wanted" ]; then
+        return
+    fi
+
+    echo "Installing module dependencies from $LOCKFILE"
+    # Install next to the current packages and swap, so that a failed
+    # install leaves the previous set in place
+    local staging="$PACKAGES_DIR.new"
+    rm -rf "$staging"
+    if compgen -G "$WHEELHOUSE/*.whl" > /dev/null; then
+        pip install --no-index --find-links "$WHEELHOUSE" --no-deps --target "$staging" -r "$LOCKFILE"
+    else
+        pip install --no-deps --target "$staging" -r "$LOCKFILE"
+    fi
+    echo "$wanted" > "$staging/.lock-sha256"
+    rm -rf "$PACKAGES_DIR.old"
+    if [ -d "$PACKAGES_DIR" ]; then
+        mv "$PACKAGES_DIR" "$PACKAGES_DIR.old"
+    fi
+    mv "$staging" "$PACKAGES_DIR"
+    rm -rf "$PACKAGES_DIR.old"
+}
 
-# Install dependencies in the user-writable directory
-pip install --target=/data/python-packages firebase-admin
-pip install --target=/data/python-packages requests
+# Containers sharing /data take turns; the first one installs, the others
+# find the packages up to date
+(
+    flock 9
+    install_dependencies
+) 9> /data/.python-packages.lock
 
 # Start Synapse
-exec /start.py 
\ No newline at end of file
+exec /start.py
@@ -2,6 +2,13 @@
 Firebase authentication module for Matrix Synapse
 """
 
-from .firebase_auth import FirebaseAuthProvider, create_module
+__all__ = ['FirebaseAuthProvider', 'create_module']
 
-__all__ = ['FirebaseAuthProvider', 'create_module'] 
\ No newline at end of file
+
+def __getattr__(name):
+    # Imported on first use, so that loading TextMasker or a rule-engine
+    # worker process from this package doesn't load the auth provider too
+    if name in __all__:
+        from . import firebase_auth
+        return getattr(firebase_auth, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
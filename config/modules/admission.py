@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+
+class AdmissionController:
+    """Decide which messages may be masked by the API.
+
+    A message is admitted if fewer than ``max_concurrent`` API maskings are
+    in progress and its sender's token bucket (refilled at ``sender_rate``
+    per second, up to ``sender_burst``) has a token left. Buckets are kept
+    for the ``max_senders`` most recently seen senders.
+
+    Messages that are not admitted are meant to be masked by the rules
+    instead, so overload degrades masking quality rather than latency.
+    """
+
+    SENDER_RATE = "sender_rate"
+    CONCURRENCY = "concurrency"
+
+    def __init__(
+        self,
+        max_concurrent: int = 50,
+        sender_rate: float = 5,
+        sender_burst: float = 20,
+        max_senders: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrent = max_concurrent
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.max_senders = max_senders
+        self._clock = clock
+        # sender -> (tokens, last refill time)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._in_flight = 0
+
+        self.admitted = 0
+        self.shed: Dict[str, int] = {self.SENDER_RATE: 0, self.CONCURRENCY: 0}
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def try_acquire(self, sender: str) -> Optional[str]:
+        """Admit a message from ``sender``.
+
+        Returns None if it was admitted, in which case :meth:`release` must be
+        called once it is done, or the reason it was shed.
+        """
+        if self._in_flight >= self.max_concurrent:
+            self.shed[self.CONCURRENCY] += 1
+            return self.CONCURRENCY
+
+        now = self._clock()
+        tokens, last = self._buckets.pop(sender, (self.sender_burst, now))
+        tokens = min(self.sender_burst, tokens + (now - last) * self.sender_rate)
+        if tokens < 1:
+            self._store(sender, tokens, now)
+            self.shed[self.SENDER_RATE] += 1
+            return self.SENDER_RATE
+
+        self._store(sender, tokens - 1, now)
+        self._in_flight += 1
+        self.admitted += 1
+        return None
+
+    def release(self) -> None:
+        self._in_flight -= 1
+
+    def _store(self, sender: str, tokens: float, now: float) -> None:
+        self._buckets[sender] = (tokens, now)
+        while len(self._buckets) > self.max_senders:
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self._in_flight,
+            "senders": len(self._buckets),
+            "admitted": self.admitted,
+            "shed_sender_rate": self.shed[self.SENDER_RATE],
+            "shed_concurrency": self.shed[self.CONCURRENCY],
+        }
@@ -0,0 +1,83 @@
+import logging
+from typing import List, Optional, Tuple
+
+from synapse.logging.context import make_deferred_yieldable
+from synapse.module_api import ModuleApi
+from twisted.internet import defer
+
+from .masking_client import MaskingApiClient
+
+logger = logging.getLogger(__name__)
+
+
+class MaskingBatcher:
+    """Coalesce concurrent masking requests into batched API calls.
+
+    Texts submitted through :meth:`mask` are held for at most ``window``
+    seconds, or until ``max_items`` are waiting, then sent together to the
+    batch endpoint. Each caller gets back its own result, or the error that
+    failed the batch.
+    """
+
+    def __init__(
+        self,
+        api: ModuleApi,
+        client: MaskingApiClient,
+        batch_url: str,
+        window: float = 0.01,
+        max_items: int = 32,
+        reactor=None,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._api = api
+        self.client = client
+        self.batch_url = batch_url
+        self.window = window
+        self.max_items = max_items
+        self._pending: List[Tuple[str, Optional[float], defer.Deferred]] = []
+        self._flush_call = None
+
+        self.batches_sent = 0
+        self.items_sent = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def mask(self, text: str, timeout: Optional[float] = None) -> str:
+        """Queue ``text`` for the next batch and wait for its masked result."""
+        d = defer.Deferred()
+        self._pending.append((text, timeout, d))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._flush_call is None:
+            self._flush_call = self._reactor.callLater(self.window, self._flush)
+        return await make_deferred_yieldable(d)
+
+    def _flush(self) -> None:
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self._api.run_as_background_process("text_masker_batch", self._send, batch)
+
+    async def _send(self, batch: List[Tuple[str, Optional[float], defer.Deferred]]) -> None:
+        texts = [text for text, _, _ in batch]
+        timeouts = [timeout for _, timeout, _ in batch if timeout is not None]
+        self.batches_sent += 1
+        self.items_sent += len(batch)
+        try:
+            results = await self.client.mask_batch(
+                self.batch_url, texts, timeout=max(timeouts) if timeouts else None
+            )
+        except Exception as e:
+            logger.debug("Batch of %d failed: %s", len(batch), e)
+            for _, _, d in batch:
+                d.errback(e)
+            return
+        for (_, _, d), result in zip(batch, results):
+            d.callback(result)
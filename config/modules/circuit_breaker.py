@@ -0,0 +1,154 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with a latency-derived timeout.
+
+    While closed, every request is allowed and its outcome recorded over a
+    sliding window. Once at least ``min_requests`` outcomes are in the window
+    and the failure rate reaches ``failure_threshold``, the circuit opens and
+    :meth:`allow_request` refuses everything for ``reset_timeout`` seconds.
+    After that a single half-open probe is let through: success closes the
+    circuit, failure opens it again.
+
+    :meth:`current_timeout` returns the p99 of recent latencies times
+    ``timeout_multiplier``, clamped to ``[min_timeout, max_timeout]``.
+    Timed-out requests count as samples at the timeout they hit, so the
+    timeout grows when the service slows down instead of failing every
+    request. Until ``min_latency_samples`` samples have been seen, and for
+    the half-open probe, it returns ``max_timeout``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: float = 0.5,
+        window_size: int = 20,
+        min_requests: int = 5,
+        reset_timeout: float = 30,
+        latency_window: int = 200,
+        min_latency_samples: int = 20,
+        timeout_multiplier: float = 1.5,
+        min_timeout: float = 0.2,
+        max_timeout: float = 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.min_latency_samples = min_latency_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._clock = clock
+
+        self._state = self.CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=latency_window)
+        self._timeout: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent to the protected service now."""
+        if self._state == self.CLOSED:
+            return True
+        if self._state == self.OPEN:
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            logger.info("Circuit half-open, sending a probe request")
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def open_remaining(self) -> float:
+        """Seconds until an open circuit lets a probe through; 0 if not open."""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def trip(self, duration: float) -> None:
+        """Open a closed circuit for ``duration`` seconds, e.g. because another process opened it."""
+        if self._state != self.CLOSED:
+            return
+        logger.warning("Opening circuit for %.1fs on request", duration)
+        self._open()
+        self._opened_at -= self.reset_timeout - duration
+
+    def record_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._timeout = None
+        if self._state == self.HALF_OPEN:
+            logger.info("Probe succeeded, closing circuit")
+            self._close()
+            return
+        self._record_outcome(True)
+
+    def record_failure(self, timeout: Optional[float] = None) -> None:
+        """Record a failed request; ``timeout`` is the timeout it hit, if it timed out."""
+        if timeout is not None:
+            self._latencies.append(timeout)
+            self._timeout = None
+        if self._state == self.HALF_OPEN:
+            logger.warning("Probe failed, re-opening circuit")
+            self._open()
+            return
+        self._record_outcome(False)
+        if (
+            self._state == self.CLOSED
+            and len(self._outcomes) >= self.min_requests
+            and self._failures / len(self._outcomes) >= self.failure_threshold
+        ):
+            logger.warning(
+                "Failure rate %d/%d reached threshold, opening circuit for %ss",
+                self._failures, len(self._outcomes), self.reset_timeout,
+            )
+            self._open()
+
+    def current_timeout(self) -> float:
+        """Timeout to use for the next request, derived from observed p99 latency."""
+        if self._state != self.CLOSED:
+            return self.max_timeout
+        if self._timeout is None:
+            if len(self._latencies) < self.min_latency_samples:
+                self._timeout = self.max_timeout
+            else:
+                ordered = sorted(self._latencies)
+                p99 = ordered[math.ceil(0.99 * len(ordered)) - 1]
+                self._timeout = min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+        return self._timeout
+
+    def _record_outcome(self, success: bool) -> None:
+        if len(self._outcomes) == self._outcomes.maxlen and not self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(success)
+        if not success:
+            self._failures += 1
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._probe_in_flight = False
+
+    def _close(self) -> None:
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+        self._probe_in_flight = False
@@ -0,0 +1,172 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from synapse.api.errors import AuthError, NotFoundError, SynapseError
+from synapse.http.servlet import parse_integer
+from synapse.module_api import DirectServeJsonResource, ModuleApi
+
+from .tracing import SlowCallLog
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Statistical profiler for one thread, run for a fixed window on demand.
+
+    A background thread reads the target thread's stack every ``interval``
+    seconds. Nothing runs outside a window, and during one the target only
+    pays for the GIL switches, so it is safe to use on a live homeserver.
+    The result lists the functions seen most often and the stacks in the
+    collapsed format that flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._deadline = 0.0
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, thread_id: Optional[int] = None) -> bool:
+        """Profile ``thread_id`` (by default the calling thread) for ``seconds``.
+
+        Returns False if a profile is already running.
+        """
+        if self.running:
+            return False
+        seconds = min(seconds, self.max_seconds)
+        self._deadline = time.monotonic() + seconds
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(thread_id or threading.get_ident(),),
+            name="masking-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+        return True
+
+    def _run(self, thread_id: int) -> None:
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.time()
+        start = time.monotonic()
+        while time.monotonic() < self._deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stacks[tuple(stack)] += 1
+            samples += 1
+            time.sleep(self.interval)
+        self.last_result = self._summarize(stacks, samples, started, time.monotonic() - start)
+        logger.info(f"Sampling profiler finished with {samples} samples")
+
+    def _summarize(self, stacks: Counter, samples: int, started: float, elapsed: float) -> Dict[str, Any]:
+        own: Counter = Counter()
+        total: Counter = Counter()
+        collapsed: Counter = Counter()
+        for stack, count in stacks.items():
+            names = [_frame_name(code) for code in reversed(stack)]
+            own[names[-1]] += count
+            for name in set(names):
+                total[name] += count
+            collapsed[";".join(names)] += count
+        return {
+            "started_ts": int(started * 1000),
+            "seconds": round(elapsed, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "top": [
+                {"function": name, "self": count, "total": total[name]}
+                for name, count in own.most_common(50)
+            ],
+            "stacks": [f"{stack} {count}" for stack, count in collapsed.most_common(500)],
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "remaining_seconds": round(max(0.0, self._deadline - time.monotonic()), 3) if self.running else 0,
+            "last_result": self.last_result,
+        }
+
+
+# Profiles sample the reactor thread, so there is one profiler per process
+profiler = SamplingProfiler()
+
+
+class DiagnosticsResource(DirectServeJsonResource):
+    """Admin-only view of a module's slow calls, and control of the profiler.
+
+        GET    <path>[/slow]?limit=N   slowest recorded calls, slowest first
+        DELETE <path>/slow             forget the recorded calls
+        GET    <path>/profile          profiler state and the last profile
+        POST   <path>/profile?seconds=N  profile the reactor thread for N seconds
+
+    Requests need the access token of a server admin.
+    """
+
+    isLeaf = True
+
+    def __init__(self, api: ModuleApi, slow_calls: SlowCallLog, sampling_profiler: SamplingProfiler = profiler):
+        super().__init__()
+        self.api = api
+        self.slow_calls = slow_calls
+        self.profiler = sampling_profiler
+
+    async def _require_admin(self, request) -> str:
+        requester = await self.api.get_user_by_req(request)
+        user_id = requester.user.to_string()
+        if not await self.api.is_user_admin(user_id):
+            raise AuthError(403, "You are not a server admin")
+        return user_id
+
+    @staticmethod
+    def _section(request) -> str:
+        return b"/".join(segment for segment in request.postpath if segment).decode('ascii', 'replace')
+
+    async def _async_render_GET(self, request) -> Tuple[int, Dict[str, Any]]:
+        await self._require_admin(request)
+        section = self._section(request)
+        if section in ("", "slow"):
+            limit = parse_integer(request, "limit")
+            return 200, {"stats": self.slow_calls.stats(), "slow_calls": self.slow_calls.records(limit)}
+        if section == "profile":
+            return 200, self.profiler.status()
+        raise NotFoundError()
+
+    async def _async_render_DELETE(self, request) -> Tuple[int, Dict[str, Any]]:
+        user_id = await self._require_admin(request)
+        if self._section(request) != "slow":
+            raise NotFoundError()
+        self.slow_calls.clear()
+        logger.info(f"Slow call log cleared by {user_id}")
+        return 200, {}
+
+    async def _async_render_POST(self, request) -> Tuple[int, Dict[str, Any]]:
+        user_id = await self._require_admin(request)
+        if self._section(request) != "profile":
+            raise NotFoundError()
+        seconds = parse_integer(request, "seconds", default=10)
+        if not 0 < seconds <= self.profiler.max_seconds:
+            raise SynapseError(400, f"seconds must be between 1 and {self.profiler.max_seconds:g}")
+        if not self.profiler.start(seconds):
+            raise SynapseError(409, "A profile is already running")
+        logger.info(f"Sampling profiler started by {user_id} for {seconds}s")
+        return 200, self.profiler.status()
@@ -0,0 +1,101 @@
+from typing import Any, Dict, NamedTuple
+
+# Masking keeps up to this many characters at either end of a span, such as
+# the "+91 " and the last four digits of a phone number
+KEPT_CHARS = 4
+
+
+class EditWindow(NamedTuple):
+    """Region of an edited text that has to be masked again.
+
+    ``new[start:new_end]`` replaced ``old[start:old_end]``; the rest of both
+    texts is identical. ``changed`` is the size of the actual change, before
+    the window was widened for context.
+    """
+
+    start: int
+    new_end: int
+    old_end: int
+    changed: int
+
+
+def is_edit(content: Dict[str, Any]) -> bool:
+    relates_to = content.get("m.relates_to")
+    return (
+        isinstance(relates_to, dict)
+        and relates_to.get("rel_type") == "m.replace"
+        and isinstance(content.get("m.new_content"), dict)
+    )
+
+
+def _common_prefix(a: str, b: str, limit: int) -> int:
+    # Binary search on slice comparisons, which run in C
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _word_start(text: str, pos: int) -> int:
+    """Start of the whitespace-delimited token containing ``text[pos - 1]``."""
+    return max(text.rfind(' ', 0, pos), text.rfind('\n', 0, pos)) + 1
+
+
+def _word_end(text: str, pos: int) -> int:
+    """End of the whitespace-delimited token containing ``text[pos]``."""
+    ends = [i for i in (text.find(' ', pos), text.find('\n', pos)) if i != -1]
+    return min(ends) if ends else len(text)
+
+
+def _near_masked(old: str, old_masked: str, pos: int) -> bool:
+    """Whether a span masked in ``old_masked`` may run across ``pos``."""
+    lo, hi = max(0, pos - KEPT_CHARS), min(len(old), pos + KEPT_CHARS)
+    return old_masked[lo:hi] != old[lo:hi]
+
+
+def diff_window(old: str, new: str, old_masked: str, margin: int = 32) -> EditWindow:
+    """Find the part of ``new`` that must be masked again after editing ``old``.
+
+    ``old_masked`` is the masked form of ``old`` and must have the same
+    length. The changed region is widened by ``margin`` characters, out to
+    whitespace, and further until neither edge is within ``KEPT_CHARS`` of a
+    character masked in ``old_masked``, so a term or number across its edges
+    is seen whole even where masking kept its first or last characters.
+    """
+    if old == new:
+        return EditWindow(len(new), len(new), len(old), 0)
+
+    prefix = _common_prefix(old, new, min(len(old), len(new)))
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    changed = max(len(new) - suffix - prefix, len(old) - suffix - prefix)
+
+    start = _word_start(new, max(0, prefix - margin))
+    while start > 0 and _near_masked(old, old_masked, start):
+        start = _word_start(new, start - 1)
+
+    new_end = _word_end(new, min(len(new), len(new) - suffix + margin))
+    old_end = len(old) - (len(new) - new_end)
+    while new_end < len(new) and _near_masked(old, old_masked, old_end):
+        new_end = _word_end(new, new_end + 1)
+        old_end = len(old) - (len(new) - new_end)
+    return EditWindow(start, new_end, old_end, changed)
+
+
+def splice(old_masked: str, window: EditWindow, masked_window: str) -> str:
+    """Put the masked window back between the unchanged parts of ``old_masked``."""
+    return old_masked[:window.start] + masked_window + old_masked[window.old_end:]
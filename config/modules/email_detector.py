@@ -0,0 +1,97 @@
+"""
+Linear-time email address detection.
+
+Replaces the backtracking email regex with a scan anchored on '@'. For each
+'@' the local part is the run of ``[a-zA-Z0-9._%+-]`` characters right before
+it, or a quoted string of at most ``MAX_QUOTED_LOCAL`` characters ending
+right before it. The domain is the run of ``[a-zA-Z0-9.-]`` characters right
+after it, cut after the letters that follow its last '.' with at least two
+letters after it, or a bracketed IPv4 address followed by such a TLD.
+
+These are the spans the regex found, except that an address inside a quoted
+local part ('"a@b.com"@c.com') is reported on its own. Its cost grew with the square of the
+input, because every start position inside a long local part rescanned the
+whole domain. Here the runs around two different '@' never overlap, '@'
+being in neither set, so each character is visited a bounded number of
+times.
+"""
+
+import re
+import string
+from typing import List, Optional, Tuple
+
+LOCAL_CHARS = frozenset(string.ascii_letters + string.digits + '._%+-')
+DOMAIN_CHARS = frozenset(string.ascii_letters + string.digits + '.-')
+LETTERS = frozenset(string.ascii_letters)
+# RFC 5321 limits the local part to 64 characters; the quotes come on top
+MAX_QUOTED_LOCAL = 66
+
+# Neither pattern can backtrack, and both are matched at a fixed position
+_QUOTED_LOCAL = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_BRACKETED_DOMAIN = re.compile(r'\[(?:[0-9]{1,3}\.){3}[0-9]{1,3}\]\.[a-zA-Z]{2,}')
+_DOMAIN_RUN = re.compile(r'[a-zA-Z0-9.-]*')
+
+
+def find_email_spans(text: str) -> List[Tuple[int, int]]:
+    """Return the (start, end) of every email address in ``text``, in order."""
+    spans = []
+    # A match can't start inside the previous one
+    last = 0
+    at = text.find('@')
+    while at != -1:
+        start = _local_start(text, at, last)
+        end = None if start is None else _domain_end(text, at)
+        if end is None:
+            at = text.find('@', at + 1)
+            continue
+        spans.append((start, end))
+        last = end
+        at = text.find('@', end)
+    return spans
+
+
+def _local_start(text: str, at: int, lo: int) -> Optional[int]:
+    """Start of the local part ending at ``at``, not before ``lo``, or None."""
+    i = at
+    while i > lo and text[i - 1] in LOCAL_CHARS:
+        i -= 1
+    if i < at:
+        return i
+    if i - 1 <= lo or text[i - 1] != '"':
+        return None
+    # The leftmost opening quote whose string closes right before '@'. A
+    # quote without a backslash in front always closes a string, so none
+    # before the last such quote can be the one
+    lo = max(lo, at - MAX_QUOTED_LOCAL)
+    quote = text.rfind('"', lo, at - 1)
+    while quote > lo and text[quote - 1] == '\\':
+        earlier = text.rfind('"', lo, quote)
+        if earlier == -1:
+            break
+        quote = earlier
+    while quote != -1:
+        m = _QUOTED_LOCAL.match(text, quote, at)
+        if m is not None and m.end() == at:
+            return quote
+        quote = text.find('"', quote + 1, at - 1)
+    return None
+
+
+def _domain_end(text: str, at: int) -> Optional[int]:
+    """End of the domain starting after ``at``, or None."""
+    start = at + 1
+    if text.startswith('[', start):
+        m = _BRACKETED_DOMAIN.match(text, start)
+        return None if m is None else m.end()
+    run_end = _DOMAIN_RUN.match(text, start).end()
+    # The TLD follows the last '.' that has two letters after it and at
+    # least one domain character before it
+    dot = text.rfind('.', start + 1, run_end - 2)
+    while dot != -1:
+        if text[dot + 1] in LETTERS and text[dot + 2] in LETTERS:
+            end = dot + 3
+            while end < run_end and text[end] in LETTERS:
+                end += 1
+            return end
+        dot = text.rfind('.', start + 1, dot)
+    return None
@@ -1,21 +1,35 @@
+import json
 import logging
-from typing import Optional, Tuple, Callable, Awaitable, Any
+from typing import Dict, List, Optional, Tuple, Callable, Awaitable, Any
 
-import firebase_admin
-from firebase_admin import auth, credentials
+from synapse.logging.context import make_deferred_yieldable
 from synapse.module_api import ModuleApi, LoginResponse, JsonDict
-import jwt
-# Configure logger to show all levels
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from . import metrics
+from .diagnostics import DiagnosticsResource
+from .result_cache import ResultCache
+from .token_verifier import GOOGLE_KEYS_URL, ExpiredTokenError, FirebaseTokenVerifier, TokenVerificationError
+from .tracing import SlowCallLog, stage
+
+# Levels and handlers come from Synapse's log config; per-login logging is at DEBUG
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-# Add a handler if none exists
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+
+def service_account_project_id(path: str) -> str:
+    """Read the project ID from a service account key file.
+
+    Verifying ID tokens only needs the project ID, so the file is read
+    directly rather than through the Firebase Admin SDK, which is slow to
+    import and not needed at login.
+    """
+    with open(path) as f:
+        info = json.load(f)
+    if info.get("type") != "service_account" or not info.get("project_id"):
+        raise ValueError(f"{path} is not a service account key file with a project_id")
+    return info["project_id"]
+
 
 class FirebaseAuthProvider:
     def __init__(self, config: dict, account_handler: ModuleApi = None):
@@ -36,15 +50,50 @@ class FirebaseAuthProvider:
             
         logger.debug(f"Using service account path: {service_account_path}")
         try:
-            creds = credentials.Certificate(service_account_path)
-            logger.debug(f"Service account project_id: {creds.project_id}")
-            
-            try:
-                app = firebase_admin.get_app()
-                logger.info(f"Firebase Admin SDK already initialized with project: {app.project_id}")
-            except ValueError:
-                app = firebase_admin.initialize_app(creds)
-                logger.info(f"Firebase Admin SDK initialized with project: {app.project_id}")
+            project_id = service_account_project_id(service_account_path)
+            logger.info(f"Using Firebase project: {project_id}")
+
+            # ID tokens are verified locally against Google's cached public keys
+            # instead of a network round trip per login
+            verification_config = config.get("token_verification", {})
+            self.token_verifier = FirebaseTokenVerifier(
+                self.api,
+                project_id=verification_config.get("project_id", project_id),
+                keys_url=verification_config.get("keys_url", GOOGLE_KEYS_URL),
+                keys_file=verification_config.get("keys_file"),
+                leeway=verification_config.get("leeway", 60),
+                refresh_margin=verification_config.get("refresh_margin", 300),
+                min_refresh_interval=verification_config.get("min_refresh_interval", 60),
+                cache_max_entries=verification_config.get("cache_max_entries", 10000),
+                fetch_timeout=verification_config.get("fetch_timeout", 10),
+            )
+            self.token_verifier.start()
+
+            # Users known to exist (or not) so that repeat logins skip the
+            # database; concurrent logins for one user share a single
+            # existence check and registration
+            user_cache_config = config.get("user_cache", {})
+            self.known_users = ResultCache(
+                max_entries=user_cache_config.get("max_entries", 100000),
+                ttl=user_cache_config.get("ttl", 3600),
+            )
+            self.unknown_user_ttl = user_cache_config.get("negative_ttl", 30)
+            self._user_waiters: Dict[str, List[defer.Deferred]] = {}
+
+            # Slowest recent logins with per-stage timings, behind an
+            # admin-only endpoint that can also start the profiler
+            diagnostics_config = config.get("diagnostics", {})
+            if self.api and diagnostics_config.get("enabled", True):
+                self.slow_calls = SlowCallLog(
+                    capacity=diagnostics_config.get("capacity", 100),
+                    threshold=diagnostics_config.get("slow_threshold_ms", 250) / 1000,
+                )
+                self.api.register_web_resource(
+                    diagnostics_config.get("path", "/_synapse/client/firebase_auth/diagnostics"),
+                    DiagnosticsResource(self.api, self.slow_calls),
+                )
+            else:
+                self.slow_calls = None
 
             # Register our Firebase token authentication checker
             if self.api:
@@ -66,69 +115,138 @@ class FirebaseAuthProvider:
         login_dict: JsonDict,
         request: Optional[Any] = None,
     ) -> Optional[Tuple[str, Optional[Callable[[LoginResponse], Awaitable[None]]]]]:
-        logger.debug(f"Received auth request - type: {login_type}, username: {username}, login_dict: {login_dict}")
+        trace = self.slow_calls.start("check_firebase_auth") if self.slow_calls is not None else None
+        result = None
+        try:
+            with metrics.auth_check_seconds.time():
+                result = await self._check_firebase_auth(username, login_type, login_dict, request)
+            return result
+        finally:
+            if trace is not None:
+                self.slow_calls.finish(trace, login_type=login_type, user_id=result[0] if result else None)
+
+    async def _check_firebase_auth(
+        self,
+        username: str,
+        login_type: str,
+        login_dict: JsonDict,
+        request: Optional[Any] = None,
+    ) -> Optional[Tuple[str, Optional[Callable[[LoginResponse], Awaitable[None]]]]]:
+        # login_dict holds the token, so it is never logged
+        logger.debug("Received auth request - type: %s, username: %s", login_type, username)
         
         if login_type != "m.login.firebase":
             logger.warning(f"Unexpected login type: {login_type}")
+            metrics.auth_outcomes_counter.labels("wrong_login_type").inc()
             return None
 
         token = login_dict.get("token")
         if not token:
             logger.warning("Missing Firebase token in login request")
+            metrics.auth_outcomes_counter.labels("missing_token").inc()
             return None
 
         try:
-            # Get the Firebase app instance
-            app = firebase_admin.get_app()
-            logger.debug(f"Using Firebase app with project ID: {app.project_id}")
-            
-            # Verify the token with Firebase Admin SDK
-            logger.debug("Attempting to verify token with Firebase Admin SDK")
-            # decoded_token = auth.verify_id_token(token)
-            # Only for testing purpose
-            decoded_token = jwt.decode(token, options={"verify_signature": False})
-            firebase_uid = decoded_token['user_id']
-            logger.debug(f"Token verified successfully for Firebase UID: {firebase_uid}")
+            # Verify the token signature and claims against the cached public keys
+            with stage("verify"):
+                decoded_token = await self.token_verifier.verify(token)
+            firebase_uid = decoded_token['sub']
             
             # Create Matrix user ID with a prefix to avoid numeric-only usernames
             matrix_localpart = f"firebase_{firebase_uid}"
             matrix_user = f"@{matrix_localpart}:{self.api.server_name}"
-            logger.debug(f"Generated Matrix user ID: {matrix_user}")
+            logger.debug("Token verified for Firebase UID %s, Matrix user %s", firebase_uid, matrix_user)
             
             # Verify the user exists or create them
-            if not await self.api.check_user_exists(matrix_user):
-                logger.info(f"Creating new Matrix user: {matrix_user}")
-                try:
-                    await self.api.register_user(
-                        localpart=matrix_localpart,
-                        displayname=None,
-                        emails=[],
-                        admin=False
-                    )
-                    logger.info(f"New Matrix user created: {matrix_user}")
-                except Exception as e:
-                    logger.error(f"Failed to register user: {e}")
-                    logger.debug("Registration error details:", exc_info=True)
-                    return None
+            try:
+                with stage("user"):
+                    await self._ensure_user(matrix_localpart, matrix_user)
+            except Exception as e:
+                logger.error(f"Failed to register user: {e}")
+                logger.debug("Registration error details:", exc_info=True)
+                metrics.auth_outcomes_counter.labels("registration_failed").inc()
+                return None
             
-            logger.info(f"Firebase authentication successful for user: {matrix_user}")
+            logger.debug("Firebase authentication successful for user: %s", matrix_user)
+            metrics.auth_outcomes_counter.labels("success").inc()
             return (matrix_user, None)
             
-        except auth.InvalidIdTokenError as e:
-            logger.error(f"Invalid Firebase token: {str(e)}")
-            logger.debug("Token verification failed - full error:", exc_info=True)
-            return None
-        except auth.ExpiredIdTokenError:
+        except ExpiredTokenError:
             logger.error("Firebase token has expired")
+            metrics.auth_outcomes_counter.labels("expired_token").inc()
             return None
-        except auth.RevokedIdTokenError:
-            logger.error("Firebase token has been revoked")
+        except TokenVerificationError as e:
+            logger.error(f"Invalid Firebase token: {str(e)}")
+            logger.debug("Token verification failed - full error:", exc_info=True)
+            metrics.auth_outcomes_counter.labels("invalid_token").inc()
             return None
         except Exception as e:
             logger.error(f"Firebase authentication failed: {str(e)}")
             logger.debug("Unexpected error during authentication:", exc_info=True)
+            metrics.auth_outcomes_counter.labels("error").inc()
             return None
 
+    async def _ensure_user(self, localpart: str, user_id: str) -> None:
+        """Make sure ``user_id`` exists, registering it if needed.
+
+        Raises whatever ``register_user`` raised if registration failed.
+        """
+        if self.known_users.get(user_id):
+            metrics.auth_user_lookups_counter.labels("cached").inc()
+            return
+
+        d = defer.Deferred()
+        waiters = self._user_waiters.get(user_id)
+        if waiters is not None:
+            metrics.auth_user_lookups_counter.labels("shared").inc()
+            waiters.append(d)
+        else:
+            self._user_waiters[user_id] = [d]
+            self.api.run_as_background_process("firebase_auth_ensure_user", self._lookup_user, localpart, user_id)
+        await make_deferred_yieldable(d)
+
+    async def _lookup_user(self, localpart: str, user_id: str) -> None:
+        # Runs as a background process, which swallows errors, so the
+        # outcome is handed to the waiters here
+        try:
+            await self._check_or_register(localpart, user_id)
+        except Exception:
+            self._user_lookup_done(Failure(), user_id)
+        else:
+            self._user_lookup_done(None, user_id)
+
+    async def _check_or_register(self, localpart: str, user_id: str) -> None:
+        # A recent miss means the user is still missing, unless someone else
+        # registered it, which register_user will report
+        if self.known_users.get(user_id) is None:
+            metrics.auth_user_lookups_counter.labels("database").inc()
+            if await self.api.check_user_exists(user_id):
+                self.known_users.set(user_id, True)
+                return
+            self.known_users.set(user_id, False, ttl=self.unknown_user_ttl)
+
+        logger.info(f"Creating new Matrix user: {user_id}")
+        try:
+            await self.api.register_user(
+                localpart=localpart,
+                displayname=None,
+                emails=[],
+                admin=False
+            )
+        except Exception as e:
+            # Registered since the miss was cached, e.g. by another worker
+            if getattr(e, "errcode", None) == "M_USER_IN_USE":
+                self.known_users.set(user_id, True)
+                return
+            raise
+        self.known_users.set(user_id, True)
+        logger.info(f"New Matrix user created: {user_id}")
+        metrics.auth_outcomes_counter.labels("registered").inc()
+
+    def _user_lookup_done(self, result, user_id: str) -> None:
+        for d in self._user_waiters.pop(user_id):
+            d.callback(result)
+
 def create_module(config: dict, api: ModuleApi) -> FirebaseAuthProvider:
     """Create and return a FirebaseAuthProvider instance.
     
@@ -0,0 +1,203 @@
+import html
+import re
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+from .rule_engine import Span, _MASKERS
+
+HTML_FORMAT = "org.matrix.custom.html"
+
+# A tag name after '<', and a run of attribute text up to a quote or the end of the tag
+_TAG_NAME = re.compile(r'(/?)([a-zA-Z][a-zA-Z0-9-]*)')
+_ATTRIBUTE_RUN = re.compile(r'[^>"\']*')
+_ENTITY = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);?')
+# One attribute of a tag: its name and, after '=', a quoted or bare value
+_ATTRIBUTE = re.compile(r'[\s/]*([^\s"\'>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+)))?')
+
+# Elements that don't break up words; any other tag separates the text around it
+_INLINE_TAGS = frozenset((
+    "a", "abbr", "b", "bdi", "bdo", "cite", "code", "del", "dfn", "em", "font", "i", "ins", "kbd",
+    "mark", "q", "s", "samp", "small", "span", "strike", "strong", "sub", "sup", "u", "var",
+))
+
+# Segment kinds: text copied from the source, a decoded character reference,
+# and a separator that stands for markup
+_SOURCE, _REFERENCE, _SEPARATOR = 0, 1, 2
+
+
+class FormattedBody:
+    """An HTML ``formatted_body`` tokenized once for masking.
+
+    ``text`` holds the text nodes and ``href`` values of the document with
+    character references decoded, block-level tags replaced by newlines and
+    each ``href`` on a line of its own, so that one rule-engine scan covers
+    the whole message. :meth:`apply` maps the spans found in ``text`` back
+    onto the markup, leaving tags untouched, without building a DOM.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self._pieces: List[str] = []
+        self._length = 0
+        # Parallel arrays, one entry per segment of ``text``
+        self._starts: List[int] = []
+        self._kinds: List[int] = []
+        self._source_starts: List[int] = []
+        self._source_ends: List[int] = []
+        self._tokenize()
+        self.text = ''.join(self._pieces)
+        del self._pieces
+
+    def _add(self, piece: str, kind: int, source_start: int, source_end: int) -> None:
+        self._starts.append(self._length)
+        self._kinds.append(kind)
+        self._source_starts.append(source_start)
+        self._source_ends.append(source_end)
+        self._pieces.append(piece)
+        self._length += len(piece)
+
+    def _add_text(self, start: int, end: int) -> None:
+        """Add raw text, decoding any character references in it."""
+        source = self.source
+        for m in _ENTITY.finditer(source, start, end):
+            self._add_reference(m.start(), m.end(), start)
+            start = m.end()
+        if start < end:
+            self._add(source[start:end], _SOURCE, start, end)
+
+    def _add_reference(self, start: int, end: int, text_start: int) -> None:
+        source = self.source
+        if text_start < start:
+            self._add(source[text_start:start], _SOURCE, text_start, start)
+        decoded = html.unescape(source[start:end])
+        if decoded == source[start:end]:
+            self._add(decoded, _SOURCE, start, end)
+        else:
+            self._add(decoded, _REFERENCE, start, end)
+
+    def _tag_end(self, start: int) -> int:
+        """End of the tag whose attributes start at ``start``, or -1 if it never closes.
+
+        Quoted attribute values may contain '>'. Each character is looked at
+        once, so the scan stays linear however the markup is broken.
+        """
+        source = self.source
+        i = start
+        while True:
+            i = _ATTRIBUTE_RUN.match(source, i).end()
+            if i == len(source):
+                return -1
+            if source[i] == '>':
+                return i
+            i = source.find(source[i], i + 1)
+            if i == -1:
+                return -1
+            i += 1
+
+    def _href(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """Source range of the first ``href`` value among the attributes in ``[start, end)``.
+
+        Attributes are read in order, so an ``href=`` inside another
+        attribute's quoted value is not taken for the real one.
+        """
+        source = self.source
+        i = start
+        while i < end:
+            m = _ATTRIBUTE.match(source, i, end)
+            if m is None:
+                # A stray quote or '=': skip it, a quote with its whole string
+                if source[i] in '"\'':
+                    close = source.find(source[i], i + 1, end)
+                    i = end if close == -1 else close + 1
+                else:
+                    i += 1
+                continue
+            if m.group(1).lower() == "href":
+                group = next((g for g in (2, 3, 4) if m.group(g) is not None), None)
+                return None if group is None else (m.start(group), m.end(group))
+            i = m.end()
+        return None
+
+    def _tokenize(self) -> None:
+        source = self.source
+        last = 0
+        i = source.find('<')
+        while i != -1:
+            if source.startswith('<!--', i):
+                end = source.find('-->', i + 4)
+                if end == -1:
+                    break
+                self._add_text(last, i)
+                last = i = end + 3
+                i = source.find('<', i)
+                continue
+            name = _TAG_NAME.match(source, i + 1)
+            if name is None:
+                i = source.find('<', i + 1)
+                continue
+            end = self._tag_end(name.end())
+            if end == -1:
+                # An unterminated tag: the rest is masked as text, which
+                # also keeps the scan from restarting at every later '<'
+                break
+            self._add_text(last, i)
+            last = end + 1
+
+            tag = name.group(2).lower()
+            if tag not in _INLINE_TAGS:
+                self._add('\n', _SEPARATOR, i, i)
+            if tag == "a" and not name.group(1):
+                href = self._href(name.end(), end)
+                if href is not None:
+                    self._add('\n', _SEPARATOR, i, i)
+                    self._add_text(*href)
+                    self._add('\n', _SEPARATOR, i, i)
+            i = source.find('<', last)
+        self._add_text(last, len(source))
+
+    def _segment_end(self, i: int) -> int:
+        return self._starts[i + 1] if i + 1 < len(self._starts) else len(self.text)
+
+    def apply(self, spans: List[Span]) -> str:
+        """Mask the markup with ordered, disjoint spans found in ``text``."""
+        if not spans:
+            return self.source
+
+        # (source start, source end, replacement), in source order
+        edits: List[Tuple[int, int, str]] = []
+        starts, kinds = self._starts, self._kinds
+        for start, end, category in spans:
+            masked = _MASKERS[category](self.text[start:end])
+            # Maskers keep the length, except for very short email local
+            # parts; then the whole replacement goes into the first segment
+            aligned = len(masked) == end - start
+            first = True
+            i = bisect_right(starts, start) - 1
+            while i < len(starts) and starts[i] < end:
+                kind = kinds[i]
+                if kind != _SEPARATOR:
+                    lo = max(start, starts[i])
+                    hi = min(end, self._segment_end(i))
+                    if aligned:
+                        piece = masked[lo - start:hi - start]
+                    else:
+                        piece = masked if first else ''
+                    first = False
+                    if kind == _SOURCE:
+                        offset = self._source_starts[i] - starts[i]
+                        edits.append((lo + offset, hi + offset, piece))
+                    elif piece != self.text[lo:hi]:
+                        # A reference is replaced whole; kept characters are re-escaped
+                        seg_start, seg_end = starts[i], self._segment_end(i)
+                        decoded = self.text[seg_start:lo] + piece + self.text[hi:seg_end]
+                        edits.append((self._source_starts[i], self._source_ends[i], html.escape(decoded)))
+                i += 1
+
+        parts = []
+        last = 0
+        for start, end, piece in edits:
+            parts.append(self.source[last:start])
+            parts.append(piece)
+            last = end
+        parts.append(self.source[last:])
+        return ''.join(parts)
@@ -0,0 +1,191 @@
+"""
+Compiled moderation lexicon.
+
+A lexicon file holds a prebuilt WordMatcher automaton as flat arrays of
+32-bit integers, so it can be memory-mapped instead of rebuilt: loading is
+constant time, and every process that maps the same file shares one copy of
+it through the page cache. Files are built with scripts/compile_lexicon.py.
+
+Layout (native byte order, all offsets 4-byte aligned):
+
+    header      magic, byte-order marker, version, flags, node, edge and
+                word-blob sizes, SHA-256 fingerprint of the word list
+    edge_start  node_count + 1   first edge of each node
+    edge_char   edge_count       code point of each edge, sorted per node
+    edge_target edge_count       node each edge leads to
+    fail        node_count       failure link
+    term_len    node_count       length of the term ending at the node, or 0
+    dict_link   node_count       next node on the failure chain ending a term
+    words       UTF-8, newline separated
+"""
+
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Tuple
+
+from .word_matcher import WordMatcher, fold_case
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MXLEXCON"
+VERSION = 2
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=8sIIIIII32s")
+
+# Terms were normalized at compile time and text must be normalized to match
+FLAG_NORMALIZE = 1
+
+
+class LexiconError(Exception):
+    """The lexicon file is missing, truncated or in an unknown format."""
+
+
+def _u32(values: Iterable[int]) -> bytes:
+    return array('I', values).tobytes()
+
+
+def compile_lexicon(words: Iterable[str], path: str, normalize: bool = False) -> WordMatcher:
+    """Build the automaton for ``words`` and write it to ``path``.
+
+    ``normalize`` builds an obfuscation-resistant matcher, as WordMatcher does.
+
+    The file is written next to ``path`` and renamed over it, so processes
+    that have the old file mapped keep a consistent copy until they reload.
+    Returns the in-memory matcher that was serialised.
+    """
+    matcher = WordMatcher(words, normalize=normalize)
+    goto = matcher._goto
+
+    edge_start = [0]
+    edge_char: List[int] = []
+    edge_target: List[int] = []
+    for edges in goto:
+        for c in sorted(edges, key=ord):
+            edge_char.append(ord(c))
+            edge_target.append(edges[c])
+        edge_start.append(len(edge_char))
+
+    words_blob = '\n'.join(matcher.words).encode('utf-8')
+    flags = FLAG_NORMALIZE if normalize else 0
+    header = HEADER.pack(
+        MAGIC, BYTE_ORDER_MARK, VERSION, flags, len(goto), len(edge_char), len(words_blob),
+        bytes.fromhex(matcher.fingerprint),
+    )
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for values in (edge_start, edge_char, edge_target, matcher._fail, matcher._term_len, matcher._dict_link):
+            f.write(_u32(values))
+        f.write(words_blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info("Compiled %d terms (%d nodes) into %s", len(matcher), len(goto), path)
+    return matcher
+
+
+class LexiconMatcher:
+    """WordMatcher backed by a memory-mapped lexicon file.
+
+    Matches exactly like the WordMatcher the file was compiled from. Edges
+    are looked up by binary search in the mapped arrays rather than in
+    per-node dicts, so nothing proportional to the lexicon size is held in
+    Python objects.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER.size:
+                raise LexiconError(f"{path} is too short to be a lexicon")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Identifies the file version this matcher was loaded from
+        self.stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        magic, bom, version, flags, nodes, edges, words_bytes, fingerprint = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise LexiconError(f"{path} is not a lexicon file")
+        if bom != BYTE_ORDER_MARK:
+            raise LexiconError(f"{path} was compiled on a machine with a different byte order")
+        if version != VERSION:
+            raise LexiconError(f"{path} has lexicon version {version}, expected {VERSION}")
+        expected = HEADER.size + 4 * (1 + nodes + 2 * edges + 3 * nodes) + words_bytes
+        if stat.st_size != expected:
+            raise LexiconError(f"{path} is {stat.st_size} bytes, expected {expected}")
+
+        self.normalize = bool(flags & FLAG_NORMALIZE)
+        self.fingerprint = fingerprint.hex()
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+
+        def take(count: int) -> memoryview:
+            nonlocal offset
+            part = view[offset:offset + 4 * count].cast('I')
+            offset += 4 * count
+            return part
+
+        self._edge_start = take(nodes + 1)
+        self._edge_char = take(edges)
+        self._edge_target = take(edges)
+        self._fail = take(nodes)
+        self._term_len = take(nodes)
+        self._dict_link = take(nodes)
+        self._words_offset = offset
+        self._words_bytes = words_bytes
+        self._count = self._mmap[offset:offset + words_bytes].count(b'\n') + 1 if words_bytes else 0
+        logger.debug("Mapped lexicon %s with %d terms and %d nodes", path, self._count, nodes)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def words(self) -> List[str]:
+        """The terms in the lexicon, decoded from the file on each access."""
+        if not self._words_bytes:
+            return []
+        blob = self._mmap[self._words_offset:self._words_offset + self._words_bytes]
+        return blob.decode('utf-8').split('\n')
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int]]:
+        """Yield the (start, end) of every term occurrence, boundaries unchecked."""
+        edge_start, edge_char, edge_target = self._edge_start, self._edge_char, self._edge_target
+        fail, term_len, dict_link = self._fail, self._term_len, self._dict_link
+        node = 0
+        for i, c in enumerate(fold_case(text)):
+            code = ord(c)
+            while True:
+                hi = edge_start[node + 1]
+                j = bisect_left(edge_char, code, edge_start[node], hi)
+                if j < hi and edge_char[j] == code:
+                    node = edge_target[j]
+                    break
+                if not node:
+                    break
+                node = fail[node]
+            out = node if term_len[node] else dict_link[node]
+            while out:
+                yield i + 1 - term_len[out], i + 1
+                out = dict_link[out]
+
+    def find_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Return the word-bounded, non-overlapping matches in ``text``."""
+        return WordMatcher.find_spans(self, text)
+
+    def mask(self, text: str, mask_char: str = '*') -> str:
+        """Replace every matched term with ``mask_char`` of the same length."""
+        return WordMatcher.mask(self, text, mask_char)
+
+
+def lexicon_changed(matcher: LexiconMatcher) -> bool:
+    """Whether the file at ``matcher.path`` is no longer the one it mapped."""
+    try:
+        stat = os.stat(matcher.path)
+    except OSError:
+        return False
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns) != matcher.stat_key
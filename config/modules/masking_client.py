@@ -0,0 +1,153 @@
+import json
+import logging
+import uuid
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from synapse.logging.context import make_deferred_yieldable
+from twisted.internet import defer
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+logger = logging.getLogger(__name__)
+
+
+class MaskingApiError(Exception):
+    """The masking API could not be reached or returned an error."""
+
+
+class MaskingApiTimeout(MaskingApiError):
+    """The masking API did not answer before the request deadline."""
+
+
+def encode_multipart(fields: dict) -> Tuple[bytes, bytes]:
+    """Encode plain form fields as multipart/form-data.
+
+    Returns the body and the matching Content-Type header value.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f'{value}\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n')
+    body = ''.join(parts).encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'.encode('ascii')
+
+
+class MaskingApiClient:
+    """Non-blocking client for the external masking API.
+
+    Requests go through a Twisted agent with a persistent connection pool, so
+    the reactor is never blocked while waiting on the API. At most
+    ``max_in_flight`` requests are outstanding at once; further callers wait
+    for a slot, and that wait counts towards their deadline.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float = 10,
+        max_in_flight: int = 10,
+        pool_size: Optional[int] = None,
+        pool_idle_timeout: float = 60,
+        reactor=None,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.url = url
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = pool_size or max_in_flight
+        self._pool.cachedConnectionTimeout = pool_idle_timeout
+        self._agent = Agent(reactor, connectTimeout=timeout, pool=self._pool)
+        self._semaphore = defer.DeferredSemaphore(max_in_flight)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests currently holding a slot."""
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests queued for a slot."""
+        return len(self._semaphore.waiting)
+
+    async def mask(self, text: str, timeout: Optional[float] = None) -> str:
+        """Send ``text`` to the masking API and return its response body.
+
+        Raises:
+            MaskingApiTimeout: if no response arrived within the deadline
+            MaskingApiError: on connection errors or a non-200 response
+        """
+        body, content_type = encode_multipart({'query': text})
+        return await self._request(self.url, body, content_type, timeout)
+
+    async def mask_batch(self, url: str, texts: List[str], timeout: Optional[float] = None) -> List[str]:
+        """Mask several texts with one request to the batch endpoint at ``url``.
+
+        The endpoint takes ``{"queries": [...]}`` and answers with
+        ``{"results": [...]}`` in the same order.
+
+        Raises:
+            MaskingApiTimeout: if no response arrived within the deadline
+            MaskingApiError: on connection errors, a non-200 response or a
+                malformed body
+        """
+        body = json.dumps({'queries': texts}).encode('utf-8')
+        content = await self._request(url, body, b'application/json', timeout)
+        try:
+            results = json.loads(content)['results']
+        except (ValueError, KeyError, TypeError) as e:
+            raise MaskingApiError(f"Malformed batch response from {url}: {e}") from e
+        if not isinstance(results, list) or len(results) != len(texts):
+            raise MaskingApiError(f"Batch response from {url} does not match the {len(texts)} queries sent")
+        return results
+
+    async def _request(self, url: str, body: bytes, content_type: bytes, timeout: Optional[float]) -> str:
+        deadline = self.timeout if timeout is None else timeout
+        headers = Headers({
+            b'Accept': [b'*/*'],
+            b'User-Agent': [b'Matrix-Synapse/1.0'],
+            b'Content-Type': [content_type],
+        })
+
+        d = self._semaphore.run(lambda: defer.ensureDeferred(self._post(url, body, headers)))
+        # Cancelling a request surfaces as whatever the agent raises at that
+        # point, so any outcome after the deadline is reported as a timeout
+        d.addTimeout(deadline, self._reactor, onTimeoutCancel=self._on_timeout)
+        try:
+            code, content = await make_deferred_yieldable(d)
+        except MaskingApiTimeout:
+            raise
+        except Exception as e:
+            raise MaskingApiError(f"Failed to connect to masking API at {url}: {e}") from e
+
+        if code != 200:
+            raise MaskingApiError(f"API request failed with status {code}. Response: {content[:200]}")
+        return content
+
+    def _on_timeout(self, result, timeout: float):
+        raise MaskingApiTimeout(f"No response from {self.url} within {timeout} seconds")
+
+    async def _post(self, url: str, body: bytes, headers: Headers) -> Tuple[int, str]:
+        self._in_flight += 1
+        try:
+            response = await self._agent.request(
+                b'POST', url.encode('ascii'), headers, FileBodyProducer(BytesIO(body))
+            )
+            content = await readBody(response)
+            return response.code, content.decode('utf-8', errors='replace')
+        finally:
+            self._in_flight -= 1
+
+    def close(self) -> defer.Deferred:
+        """Drop all idle pooled connections."""
+        return self._pool.closeCachedConnections()
@@ -0,0 +1,127 @@
+"""
+Prometheus metrics for the TextMasker and FirebaseAuthProvider modules.
+
+The metrics are registered in Synapse's registry, so they are served on the
+homeserver's metrics listener alongside Synapse's own.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+from synapse.metrics import REGISTRY
+
+# From 0.5 ms (rule-based masking of a chat line) to 10 s (the API timeout)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# TextMasker
+
+on_event_seconds = Histogram(
+    "synapse_text_masker_on_event_seconds",
+    "Time spent in TextMasker.on_event",
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+api_request_seconds = Histogram(
+    "synapse_text_masker_api_request_seconds",
+    "Time spent waiting on the masking API, including queueing for a slot",
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+rules_seconds = Histogram(
+    "synapse_text_masker_rules_seconds",
+    "Time spent in rule-based masking",
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+api_requests_counter = Counter(
+    "synapse_text_masker_api_requests",
+    "Masking API requests by outcome (success, timeout, error)",
+    labelnames=["outcome"],
+    registry=REGISTRY,
+)
+
+fallbacks_counter = Counter(
+    "synapse_text_masker_fallbacks",
+    "Messages masked by rules instead of the API, by reason (circuit_open, shed, api_failure, api_unchanged, error)",
+    labelnames=["reason"],
+    registry=REGISTRY,
+)
+
+masks_applied_counter = Counter(
+    "synapse_text_masker_masks_applied",
+    "Spans masked by the rule engine, by category",
+    labelnames=["category"],
+    registry=REGISTRY,
+)
+
+shed_counter = Counter(
+    "synapse_text_masker_shed",
+    "Messages refused API masking by admission control, by reason (sender_rate, concurrency)",
+    labelnames=["reason"],
+    registry=REGISTRY,
+)
+
+cache_lookups_counter = Counter(
+    "synapse_text_masker_cache_lookups",
+    "Lookups in the masked-result cache (hit, miss, shared_hit, shared_miss, shared_wait_hit, shared_wait_miss)",
+    labelnames=["result"],
+    registry=REGISTRY,
+)
+
+shared_cache_errors_counter = Counter(
+    "synapse_text_masker_shared_cache_errors",
+    "Failed or timed-out operations on the cache shared between workers (timeout, error)",
+    labelnames=["kind"],
+    registry=REGISTRY,
+)
+
+room_policy_skips_counter = Counter(
+    "synapse_text_masker_room_policy_skips",
+    "Events let through unmasked because their room is exempt from masking",
+    registry=REGISTRY,
+)
+
+edits_counter = Counter(
+    "synapse_text_masker_edits",
+    "Message edits by how they were masked (unchanged, incremental, full)",
+    labelnames=["mode"],
+    registry=REGISTRY,
+)
+
+post_send_backlog = Gauge(
+    "synapse_text_masker_post_send_backlog",
+    "Accepted messages waiting for deferred (post-send) API masking",
+    registry=REGISTRY,
+)
+
+post_send_counter = Counter(
+    "synapse_text_masker_post_send",
+    "Deferred masking outcomes (unchanged, edited, redacted, inline_queue_full, failed)",
+    labelnames=["outcome"],
+    registry=REGISTRY,
+)
+
+# FirebaseAuthProvider
+
+auth_check_seconds = Histogram(
+    "synapse_firebase_auth_check_seconds",
+    "Time spent in FirebaseAuthProvider.check_firebase_auth",
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+auth_outcomes_counter = Counter(
+    "synapse_firebase_auth_outcomes",
+    "Firebase login attempts by outcome (success, registered, registration_failed, "
+    "invalid_token, expired_token, missing_token, wrong_login_type, error)",
+    labelnames=["outcome"],
+    registry=REGISTRY,
+)
+
+auth_user_lookups_counter = Counter(
+    "synapse_firebase_auth_user_lookups",
+    "How logins found out whether their user exists (cached, database, shared with a concurrent login)",
+    labelnames=["source"],
+    registry=REGISTRY,
+)
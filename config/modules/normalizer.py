@@ -0,0 +1,130 @@
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+# Characters that stand in for ASCII letters: fullwidth forms, Cyrillic and
+# Greek look-alikes and accented Latin letters. Every entry maps one
+# character to one character, so str.translate keeps offsets intact.
+_LOOKALIKES = {
+    # Cyrillic
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p',
+    'с': 'c', 'т': 't', 'у': 'y', 'х': 'x', 'ѕ': 's', 'і': 'i', 'ї': 'i', 'ј': 'j', 'ԁ': 'd',
+    'ԛ': 'q', 'ԝ': 'w', 'ո': 'n', 'ս': 'u',
+    'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H', 'О': 'O', 'Р': 'P', 'С': 'C',
+    'Т': 'T', 'У': 'Y', 'Х': 'X', 'Ѕ': 'S', 'І': 'I', 'Ј': 'J',
+    # Greek
+    'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p',
+    'τ': 't', 'υ': 'u', 'χ': 'x', 'ω': 'w',
+    'Α': 'A', 'Β': 'B', 'Ε': 'E', 'Η': 'H', 'Ι': 'I', 'Κ': 'K', 'Μ': 'M', 'Ν': 'N', 'Ο': 'O',
+    'Ρ': 'P', 'Τ': 'T', 'Υ': 'Y', 'Χ': 'X', 'Ζ': 'Z',
+}
+
+
+def _build_lookalike_table() -> Dict[int, str]:
+    table = {ord(c): ascii_c for c, ascii_c in _LOOKALIKES.items()}
+    # Fullwidth ASCII
+    for code in range(0xFF01, 0xFF5F):
+        table[code] = chr(code - 0xFEE0)
+    # Latin letters with diacritics, reduced to their base letter
+    for code in range(0xC0, 0x250):
+        base = unicodedata.normalize('NFKD', chr(code))[0]
+        if base != chr(code) and base.isascii() and base.isalpha():
+            table[code] = base
+    return table
+
+
+LOOKALIKE_TABLE = _build_lookalike_table()
+
+# Leetspeak substitutions, applied to runs of these characters next to a letter
+LEET = {'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '@': 'a', '$': 's', '!': 'i'}
+_LEET_TABLE = str.maketrans(LEET)
+_LEET_CHAR = re.compile(r'[0-9@$!]')
+# Each run is matched once and its neighbours checked in Python: lookarounds
+# on both sides made the regex retry from every character of a long run
+_LEET_RUN = re.compile(r'[0-9@$!]+')
+
+# Zero-width and soft-hyphen characters, dropped wherever they appear
+_INVISIBLE = '\u00ad\u200b\u200c\u200d\u2060\ufeff'
+# Single letters separated by punctuation or spaces ("f.u.c.k", "f u c k"),
+# at least three of them; the separators are dropped. Look-alikes have been
+# mapped to ASCII by then, so only ASCII letters are considered, which keeps
+# the scan cheap.
+_SEPARATOR = rf'[ \t.\-_*~,+/\\{_INVISIBLE}]'
+_SPACED = rf'(?<![a-zA-Z0-9])[a-zA-Z](?={_SEPARATOR})(?:{_SEPARATOR}{{1,3}}[a-zA-Z](?![a-zA-Z0-9])){{2,}}'
+_HIDDEN_ASCII = re.compile(_SPACED)
+_HIDDEN = re.compile(rf'[{_INVISIBLE}]|{_SPACED}')
+
+
+def _is_ascii_letter(c: str) -> bool:
+    return c.isascii() and c.isalpha()
+
+
+def _replace_leet_runs(text: str) -> str:
+    """Turn runs of leetspeak characters next to a letter into letters."""
+    parts = []
+    last = 0
+    for m in _LEET_RUN.finditer(text):
+        start, end = m.span()
+        letter_before = start > 0 and _is_ascii_letter(text[start - 1])
+        letter_after = end < len(text) and _is_ascii_letter(text[end])
+        if not (letter_before or letter_after):
+            continue
+        run = m.group()
+        kept = ''
+        # Trailing "!" not followed by a letter is punctuation ("shit!")
+        if run[-1] == '!' and not letter_after:
+            stripped = run.rstrip('!')
+            run, kept = stripped, run[len(stripped):]
+        parts.append(text[last:start])
+        parts.append(run.translate(_LEET_TABLE) + kept)
+        last = end
+    if not parts:
+        return text
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+def normalize(text: str) -> Tuple[str, Optional[List[int]]]:
+    """Undo common obfuscations of words in one pass over ``text``.
+
+    Look-alike characters become their ASCII letter, leetspeak inside words
+    becomes letters, invisible characters are dropped and spaced-out single
+    letters are joined up. Returns the normalized text and, if characters
+    were dropped, the offset in ``text`` of each normalized character (None
+    means the offsets are unchanged).
+    """
+    # Every table entry is for a non-ASCII character
+    if text.isascii():
+        mapped, hidden = text, _HIDDEN_ASCII
+    else:
+        mapped, hidden = text.translate(LOOKALIKE_TABLE), _HIDDEN
+    if _LEET_CHAR.search(mapped):
+        mapped = _replace_leet_runs(mapped)
+
+    index: Optional[List[int]] = None
+    parts = []
+    last = 0
+    for m in hidden.finditer(mapped):
+        if index is None:
+            index = []
+        start, end = m.span()
+        parts.append(mapped[last:start])
+        index.extend(range(last, start))
+        for i in range(start, end):
+            c = mapped[i]
+            if c.isalpha():
+                parts.append(c)
+                index.append(i)
+        last = end
+    if index is None:
+        return mapped, None
+    parts.append(mapped[last:])
+    index.extend(range(last, len(mapped)))
+    return ''.join(parts), index
+
+
+def map_spans(spans: List[Tuple[int, int]], index: Optional[List[int]]) -> List[Tuple[int, int]]:
+    """Translate spans over normalized text back to the original text."""
+    if index is None:
+        return spans
+    return [(index[start], index[end - 1] + 1) for start, end in spans]
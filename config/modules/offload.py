@@ -0,0 +1,174 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Collection, List, Optional, Tuple, TypeVar
+
+from twisted.python.threadpool import ThreadPool
+
+from .lexicon import LexiconMatcher
+from .rule_engine import RuleEngine, Span, apply_spans, resolve_overlaps
+from .word_matcher import WordMatcher
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Rule engine of a worker process, built by the pool initializer
+_worker_engine: Optional[RuleEngine] = None
+
+
+def _init_worker(words: Optional[List[str]], lexicon_path: Optional[str] = None, normalize: bool = False) -> None:
+    global _worker_engine
+    matcher = LexiconMatcher(lexicon_path) if lexicon_path else WordMatcher(words, normalize=normalize)
+    _worker_engine = RuleEngine(matcher)
+
+
+def _worker_find_spans(text: str, categories: Optional[Collection[str]]) -> List[Span]:
+    return _worker_engine.find_spans(text, categories)
+
+
+def chunk_windows(length: int, chunk_size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """Split ``[0, length)`` into scan windows.
+
+    Returns ``(lo, start, end, hi)`` tuples: each chunk owns ``[start, end)``
+    and is scanned over ``[lo, hi)``, which adds ``overlap`` characters of
+    context on either side so that matches crossing a chunk boundary, and the
+    word boundaries around them, are still seen.
+    """
+    windows = []
+    for start in range(0, length, chunk_size):
+        end = min(start + chunk_size, length)
+        windows.append((max(0, start - overlap), start, end, min(length, end + overlap)))
+    return windows
+
+
+def spans_in_window(spans: List[Span], lo: int, start: int, end: int) -> List[Span]:
+    """Shift spans found in a window back to text offsets and keep the owned ones."""
+    return [(s + lo, e + lo, category) for s, e, category in spans if start <= s + lo < end]
+
+
+class RuleOffloader:
+    """Run rule-based masking off the reactor thread when the text is large.
+
+    Texts up to ``inline_max_chars`` are masked inline. Longer ones go to a
+    bounded pool, and texts longer than ``chunk_chars`` are split into
+    overlapping chunks that are scanned concurrently and merged. With
+    ``executor="process"`` the chunks run in a process pool and scale with
+    cores; with ``"thread"`` they only leave the reactor thread. The scans
+    hold the GIL, so a thread pool doesn't keep a slow scan from delaying the
+    reactor; that relies on the scanners being linear in the text length.
+    """
+
+    def __init__(
+        self,
+        api,
+        engine: RuleEngine,
+        inline_max_chars: int = 2048,
+        chunk_chars: int = 16384,
+        chunk_overlap: int = 256,
+        executor: str = "thread",
+        max_workers: int = 4,
+        reactor=None,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown offload executor: {executor}")
+        self._api = api
+        self._reactor = reactor
+        self.engine = engine
+        self.inline_max_chars = inline_max_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        self.executor = executor
+        self.max_workers = max_workers
+
+        self._threadpool = ThreadPool(minthreads=1, maxthreads=max_workers, name="text_masker")
+        self._threadpool.start()
+        self._processes: Optional[ProcessPoolExecutor] = None
+        if executor == "process":
+            self._processes = self._start_processes()
+        reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def update_engine(self, engine: RuleEngine) -> None:
+        """Use a new engine; worker processes are restarted to pick it up."""
+        self.engine = engine
+        if self._processes is not None:
+            old, self._processes = self._processes, self._start_processes()
+            old.shutdown(wait=False)
+
+    def stop(self) -> None:
+        if self._threadpool.started:
+            self._threadpool.stop()
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+            self._processes = None
+
+    async def call(self, size: int, f: Callable[..., T], *args: Any) -> T:
+        """Call ``f(*args)`` inline, or in the thread pool if ``size`` is over ``inline_max_chars``."""
+        if size <= self.inline_max_chars:
+            return f(*args)
+        return await self._api.defer_to_threadpool(self._threadpool, f, *args)
+
+    async def mask(self, text: str, categories: Optional[Collection[str]] = None) -> str:
+        """Mask ``text`` with the rule engine, inline or in the pool depending on size."""
+        return apply_spans(text, await self.find_spans(text, categories))
+
+    async def find_spans(
+        self,
+        text: str,
+        categories: Optional[Collection[str]] = None,
+        engine: Optional[RuleEngine] = None,
+    ) -> List[Span]:
+        """Find spans with ``engine``, by default the pool's own.
+
+        Other engines than the pool's run in the thread pool, as worker
+        processes only hold the pool's word list.
+        """
+        if engine is None:
+            engine = self.engine
+        if len(text) <= self.inline_max_chars:
+            return engine.find_spans(text, categories)
+
+        find = self._find_function(engine)
+        if len(text) <= self.chunk_chars:
+            return await self._api.defer_to_threadpool(self._threadpool, find, text, categories)
+
+        # Imported here, as spawned worker processes import this module too
+        # and don't need Synapse
+        from synapse.util.async_helpers import yieldable_gather_results
+
+        windows = chunk_windows(len(text), self.chunk_chars, self.chunk_overlap)
+        results = await yieldable_gather_results(
+            lambda window: self._api.defer_to_threadpool(
+                self._threadpool, find, text[window[0]:window[3]], categories
+            ),
+            windows,
+        )
+        spans = []
+        for (lo, start, end, _), window_spans in zip(windows, results):
+            spans.extend(spans_in_window(window_spans, lo, start, end))
+        # A match owned by one chunk can reappear truncated at the start of
+        # the next one; keep the leftmost
+        return resolve_overlaps(spans)
+
+    def _find_function(self, engine: RuleEngine) -> Callable[[str, Optional[Collection[str]]], List[Span]]:
+        if self._processes is None or engine is not self.engine:
+            return engine.find_spans
+        processes = self._processes
+        return lambda text, categories: processes.submit(_worker_find_spans, text, categories).result()
+
+    def _start_processes(self) -> ProcessPoolExecutor:
+        # Workers are spawned rather than forked from the threaded reactor
+        # process. A lexicon is mapped by path rather than sent word by word.
+        matcher = self.engine.word_matcher
+        if isinstance(matcher, LexiconMatcher):
+            initargs = (None, matcher.path)
+        else:
+            initargs = (matcher.words, None, matcher.normalize)
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=initargs,
+        )
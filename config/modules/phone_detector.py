@@ -0,0 +1,209 @@
+"""
+Linear-time phone number detection.
+
+Replaces the backtracking phone regex with a single left-to-right scan over
+runs of digit groups. A run is an optional '+' followed by digit groups,
+where the first group may be wrapped in parentheses and consecutive groups
+are joined by at most one separator (space, tab, '-', '.', '_', '@', '#',
+'%' or '&'). A run is reported as a phone number when either
+
+- it has at least 10 digits (standard, international, continuous, mixed
+  separator and spaced-digit formats), or
+- it has at least 6 digits in groups of two or more joined only by
+  whitespace ("95 95 95", "123456"),
+
+and it is not directly followed by a word character. Dotted IPv4 addresses
+("192.168.1.100": four groups of up to three digits, each at most 255,
+joined by '.') and dates followed by a time ("2024-01-15 10:30": groups of
+4-2-2 or 2-2-4 digits joined by the same '-' or '.', then an hour) are not
+phone numbers, however many digits they have. After a '+' and a country code
+of up to three digits, the next group may be in parentheses as well
+("+1 (234) 567-8900"). A number with 10 or more digits may carry an
+extension ("x12", "ext 12", "extension 12", up to 5 digits). When a run ends
+inside a word, trailing groups are dropped until it doesn't. Every character is visited a bounded number of times, so the cost is
+linear in the input length whatever the input looks like.
+"""
+
+import re
+from typing import List, Tuple
+
+SEPARATORS = frozenset(' \t-._@#%&')
+WHITESPACE = frozenset(' \t')
+EXTENSION_WORDS = ('extension', 'ext', 'x')
+MAX_EXTENSION_DIGITS = 5
+MAX_COUNTRY_CODE_DIGITS = 3
+DATE_LAYOUTS = ((4, 2, 2), (2, 2, 4))
+DATE_SEPARATORS = frozenset('-.')
+
+# Neither pattern can backtrack: they locate the next candidate start and the
+# end of a digit group, which keeps the scan itself in C for ordinary text
+_CANDIDATE = re.compile(r'[+(](?=\d)|\d')
+_DIGITS = re.compile(r'\d*')
+
+
+def _is_word_char(c: str) -> bool:
+    return c.isalnum() or c == '_'
+
+
+def _is_digit(c: str) -> bool:
+    # Same set of characters as `\d`
+    return c.isdecimal()
+
+
+def find_phone_spans(text: str) -> List[Tuple[int, int]]:
+    """Return the (start, end) of every phone number in ``text``, in order."""
+    spans = []
+    length = len(text)
+    i = 0
+    while i < length:
+        candidate = _CANDIDATE.search(text, i)
+        if candidate is None:
+            break
+        start = i = candidate.start()
+        if text[i] == '+':
+            i += 1
+
+        # Collect the digit groups of the run: (group_start, group_end, separator
+        # before it, or '' for the first group)
+        groups = []
+        separator = ''
+        plus = text[start] == '+'
+        while True:
+            paren = text[i] == '(' and _paren_allowed(groups, plus)
+            if paren:
+                i += 1
+            group_start = i
+            i = _DIGITS.match(text, i).end()
+            groups.append((group_start, i, separator))
+            if paren:
+                if i < length and text[i] == ')':
+                    i += 1
+                    separator = ')'
+                else:
+                    separator = ''
+            else:
+                separator = ''
+            # One optional separator between groups; ")" may be followed by one more
+            j = i
+            if j < length and text[j] in SEPARATORS:
+                separator += text[j]
+                j += 1
+            if j < length and _is_digit(text[j]):
+                i = j
+                continue
+            # "+1 (234) 567-8900": the area code may follow a country code
+            if (
+                j + 1 < length
+                and text[j] == '('
+                and _is_digit(text[j + 1])
+                and _paren_allowed(groups, plus)
+            ):
+                i = j
+                continue
+            break
+
+        if not plus and (_is_ipv4(text, groups) or _is_date_time(text, groups)):
+            end = None
+        else:
+            end = _accept(text, groups)
+        if end is None:
+            # Resume after the run; nothing inside it can start a phone number
+            continue
+        end = _extend_with_extension(text, groups, end)
+        spans.append((start, end))
+        i = max(i, end)
+    return spans
+
+
+def _is_ipv4(text: str, groups: List[Tuple[int, int, str]]) -> bool:
+    return (
+        len(groups) == 4
+        and all(separator == '.' for _, _, separator in groups[1:])
+        and all(
+            1 <= group_end - group_start <= 3 and int(text[group_start:group_end]) <= 255
+            for group_start, group_end, _ in groups
+        )
+    )
+
+
+def _paren_allowed(groups: List[Tuple[int, int, str]], plus: bool) -> bool:
+    """Whether the next group may be wrapped in parentheses."""
+    if not groups:
+        return True
+    group_start, group_end, _ = groups[0]
+    return plus and len(groups) == 1 and group_end - group_start <= MAX_COUNTRY_CODE_DIGITS
+
+
+def _is_date_time(text: str, groups: List[Tuple[int, int, str]]) -> bool:
+    """A 4-2-2 or 2-2-4 date followed by an hour ("2024-01-15 10:30")."""
+    if len(groups) < 4:
+        return False
+    lengths = tuple(group_end - group_start for group_start, group_end, _ in groups[:3])
+    if lengths not in DATE_LAYOUTS:
+        return False
+    separator = groups[1][2]
+    if separator not in DATE_SEPARATORS or groups[2][2] != separator or groups[3][2] not in WHITESPACE:
+        return False
+    hour_start, hour_end, _ = groups[3]
+    return hour_end - hour_start <= 2 and int(text[hour_start:hour_end]) <= 23
+
+
+def _accept(text: str, groups: List[Tuple[int, int, str]]):
+    """End offset of the longest acceptable prefix of ``groups``, or None."""
+    # Running totals so dropping trailing groups stays linear
+    digits = 0
+    totals = []
+    whitespace_only = []
+    ok = True
+    for group_start, group_end, separator in groups:
+        digits += group_end - group_start
+        totals.append(digits)
+        ok = ok and (separator == '' or separator in WHITESPACE) and group_end - group_start >= 2
+        whitespace_only.append(ok)
+
+    length = len(text)
+    for k in range(len(groups) - 1, -1, -1):
+        end = groups[k][1]
+        if end < length and _is_word_char(text[end]) and not _has_extension(text, end, totals[k]):
+            continue
+        if totals[k] >= 10 or (totals[k] >= 6 and whitespace_only[k]):
+            return end
+        # Dropping more groups only lowers the digit count
+        if totals[k] < 6:
+            return None
+    return None
+
+
+def _has_extension(text: str, end: int, digits: int) -> bool:
+    return digits >= 10 and _extension_end(text, end) is not None
+
+
+def _extend_with_extension(text: str, groups: List[Tuple[int, int, str]], end: int) -> int:
+    digits = sum(group_end - group_start for group_start, group_end, _ in groups if group_end <= end)
+    if digits < 10:
+        return end
+    extension_end = _extension_end(text, end)
+    return end if extension_end is None else extension_end
+
+
+def _extension_end(text: str, end: int):
+    """End of an "x12" / "ext 12" / "extension 12" suffix starting at ``end``, or None."""
+    length = len(text)
+    i = end
+    while i < length and text[i] in WHITESPACE:
+        i += 1
+    lowered = text[i:i + len(EXTENSION_WORDS[0])].lower()
+    for word in EXTENSION_WORDS:
+        if lowered.startswith(word):
+            i += len(word)
+            break
+    else:
+        return None
+    while i < length and text[i] in WHITESPACE:
+        i += 1
+    digits_start = i
+    while i < length and i - digits_start < MAX_EXTENSION_DIGITS and _is_digit(text[i]):
+        i += 1
+    if i == digits_start or (i < length and _is_word_char(text[i])):
+        return None
+    return i
@@ -0,0 +1,88 @@
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque
+
+from synapse.module_api import ModuleApi
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """The post-send queue is at capacity."""
+
+
+class PostSendQueue:
+    """Bounded queue of work done after an event has been accepted.
+
+    Items passed to :meth:`submit` are handed to ``handler`` by up to
+    ``workers`` concurrent consumers. At most ``max_size`` items wait at
+    once; beyond that :meth:`submit` raises :class:`QueueFull` so the caller
+    can do the work inline instead.
+    """
+
+    def __init__(
+        self,
+        api: ModuleApi,
+        handler: Callable[[Any], Awaitable[None]],
+        max_size: int = 1000,
+        workers: int = 4,
+    ):
+        self._api = api
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self._items: Deque[Any] = deque()
+        self._running = 0
+
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def backlog(self) -> int:
+        """Items waiting for a worker."""
+        return len(self._items)
+
+    @property
+    def in_progress(self) -> int:
+        """Items currently being handled."""
+        return self._running
+
+    def submit(self, item: Any) -> None:
+        if len(self._items) >= self.max_size:
+            self.rejected += 1
+            raise QueueFull(f"Post-send queue is full ({self.max_size} items)")
+        self._items.append(item)
+        self.submitted += 1
+        metrics.post_send_backlog.set(len(self._items))
+        if self._running < self.workers:
+            self._running += 1
+            self._api.run_as_background_process("text_masker_post_send", self._work)
+
+    async def _work(self) -> None:
+        try:
+            while self._items:
+                item = self._items.popleft()
+                metrics.post_send_backlog.set(len(self._items))
+                try:
+                    await self.handler(item)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    metrics.post_send_counter.labels("failed").inc()
+                    logger.error(f"Post-send masking failed: {e}", exc_info=True)
+        finally:
+            self._running -= 1
+
+    def stats(self) -> dict:
+        return {
+            "backlog": self.backlog,
+            "in_progress": self.in_progress,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
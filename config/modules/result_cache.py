@@ -0,0 +1,118 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def approximate_size(obj: Any) -> int:
+    """Size of ``obj`` in bytes, including the members of (nested) tuples."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        size += sum(approximate_size(member) for member in obj)
+    return size
+
+
+class ResultCache:
+    """In-process LRU cache bounded by entry count, approximate size and age.
+
+    Entries expire ``ttl`` seconds after being stored (a per-entry ``ttl`` may
+    be given to :meth:`set`). When either ``max_entries`` or ``max_bytes`` is
+    exceeded the least recently used entries are evicted. Sizes count the
+    members of tuple keys and values, such as ``(original, masked)`` pairs.
+
+    The cache can be tied to a fingerprint of whatever its values were derived
+    from; calling :meth:`set_fingerprint` with a different value drops every
+    entry.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (expires_at, size, value)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._fingerprint: Optional[Hashable] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self._clock()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= self._clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        size = approximate_size(key) + approximate_size(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self.invalidations += 1
+
+    def set_fingerprint(self, fingerprint: Hashable) -> None:
+        """Drop every entry if ``fingerprint`` differs from the current one."""
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                self.clear()
+            self._fingerprint = fingerprint
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,138 @@
+import logging
+from typing import Any, Collection, Dict, FrozenSet, Mapping, NamedTuple, Optional, Tuple
+
+from synapse.module_api import ModuleApi
+
+from .result_cache import ResultCache
+from .rule_engine import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+# State event (with an empty state_key) that sets a room's masking policy
+POLICY_EVENT_TYPE = "m.room.masking"
+
+
+class RoomPolicy(NamedTuple):
+    """How messages in one room are masked.
+
+    ``categories`` limits the rules to some of phone, email and abusive
+    (None means all of them), ``api`` turns the masking API off, leaving
+    the rules, and ``profile`` names an alternative word list from the
+    module config.
+    """
+
+    enabled: bool = True
+    categories: Optional[FrozenSet[str]] = None
+    api: bool = True
+    profile: Optional[str] = None
+
+    @property
+    def cache_tag(self) -> bytes:
+        """Distinguishes results masked under this policy in the result caches."""
+        categories = ",".join(sorted(self.categories)) if self.categories is not None else "*"
+        return f"{categories}|{int(self.api)}|{self.profile or ''}\0".encode('utf-8')
+
+
+DEFAULT_POLICY = RoomPolicy()
+EXEMPT_POLICY = RoomPolicy(enabled=False)
+
+
+def parse_policy(content: Mapping[str, Any], profiles: Collection[str] = ()) -> RoomPolicy:
+    """Build a policy from the content of a policy state event.
+
+    Fields that are missing or invalid keep their default, so a malformed
+    event never turns masking off by accident.
+    """
+    enabled = content.get("enabled", True)
+    if not isinstance(enabled, bool):
+        logger.warning(f"Ignoring invalid masking policy 'enabled': {enabled!r}")
+        enabled = True
+
+    categories = content.get("categories")
+    if categories is not None:
+        if isinstance(categories, list) and all(c in CATEGORIES for c in categories):
+            categories = frozenset(categories)
+        else:
+            logger.warning(f"Ignoring invalid masking policy 'categories': {categories!r}")
+            categories = None
+
+    api = content.get("api", True)
+    if not isinstance(api, bool):
+        logger.warning(f"Ignoring invalid masking policy 'api': {api!r}")
+        api = True
+
+    profile = content.get("profile")
+    if profile is not None and profile not in profiles:
+        logger.warning(f"Ignoring unknown masking profile: {profile!r}")
+        profile = None
+
+    return RoomPolicy(enabled, categories, api, profile)
+
+
+class RoomPolicies:
+    """Resolve and cache the masking policy of each room.
+
+    The policy comes from the room's ``event_type`` state event, or is the
+    default if there is none; rooms in ``exempt_rooms`` are never masked.
+    Anyone can create a room and send state in it, so the event is only
+    honored when its sender is a server admin or in ``trusted_senders``;
+    from anyone else it is ignored and the room keeps the default policy.
+    Resolved policies are cached per room together with the ID of the
+    state event they came from, so a later state event is noticed even if
+    :meth:`invalidate` was not called for it on this worker.
+    """
+
+    def __init__(
+        self,
+        api: ModuleApi,
+        event_type: str = POLICY_EVENT_TYPE,
+        profiles: Collection[str] = (),
+        exempt_rooms: Collection[str] = (),
+        trusted_senders: Collection[str] = (),
+        max_entries: int = 10000,
+    ):
+        self._api = api
+        self.event_type = event_type
+        self.profiles = frozenset(profiles)
+        self.exempt_rooms = frozenset(exempt_rooms)
+        self.trusted_senders = frozenset(trusted_senders)
+        # room_id -> (policy event ID or None, policy)
+        self._cache = ResultCache(max_entries=max_entries, ttl=24 * 3600)
+
+    async def resolve(self, room_id: str, state: Optional[Dict[Tuple[str, str], Any]]) -> RoomPolicy:
+        if room_id in self.exempt_rooms:
+            return EXEMPT_POLICY
+        event = state.get((self.event_type, "")) if state else None
+        event_id = event.event_id if event is not None else None
+
+        cached = self._cache.get(room_id)
+        if cached is not None and cached[0] == event_id:
+            return cached[1]
+
+        if event is None:
+            policy = DEFAULT_POLICY
+        else:
+            try:
+                trusted = await self._is_trusted(event.sender)
+            except Exception as e:
+                # Not cached, so the sender is checked again on the next message
+                logger.warning(f"Could not check the sender of the masking policy in {room_id}: {e}")
+                return DEFAULT_POLICY
+            if trusted:
+                policy = parse_policy(event.content, self.profiles)
+            else:
+                logger.warning(f"Ignoring masking policy in {room_id} set by untrusted sender {event.sender}")
+                policy = DEFAULT_POLICY
+        if policy != DEFAULT_POLICY:
+            logger.info(f"Masking policy for {room_id}: {policy}")
+        self._cache.set(room_id, (event_id, policy))
+        return policy
+
+    async def _is_trusted(self, user_id: str) -> bool:
+        return user_id in self.trusted_senders or await self._api.is_user_admin(user_id)
+
+    def invalidate(self, room_id: str) -> None:
+        self._cache.invalidate(room_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
@@ -0,0 +1,148 @@
+import re
+from time import perf_counter
+from typing import Collection, List, Optional, Tuple
+
+from .email_detector import find_email_spans
+from .phone_detector import find_phone_spans
+from .tracing import current_trace
+from .word_matcher import WordMatcher
+
+PHONE = "phone"
+EMAIL = "email"
+ABUSIVE = "abusive"
+CATEGORIES = (EMAIL, PHONE, ABUSIVE)
+
+_DIGIT = re.compile(r'\d')
+
+# Lower value wins when spans of different categories start at the same place
+_PRIORITY = {EMAIL: 0, PHONE: 1, ABUSIVE: 2}
+
+Span = Tuple[int, int, str]
+
+
+def mask_phone(phone: str) -> str:
+    """Keep first 3 and last 4 digits, mask the rest."""
+    # Handle international format
+    if phone.startswith('+'):
+        country_code = phone[:4]  # Keep country code
+        number = phone[4:]
+        return country_code + '*' * (len(number) - 4) + number[-4:]
+    if len(phone) < 8:
+        # Too short to keep 7 characters; keep the first and last two
+        return phone[0] + '*' * (len(phone) - 3) + phone[-2:]
+    return phone[:3] + '*' * (len(phone) - 7) + phone[-4:]
+
+
+def mask_email(email: str) -> str:
+    """Keep the first and last character of the local part and the TLD."""
+    # Split into local part and domain
+    local_part, domain = email.rsplit('@', 1)
+
+    # Handle quoted strings in local part
+    if local_part.startswith('"') and local_part.endswith('"'):
+        # Keep first and last character of quoted string
+        masked_local = local_part[0] + '*' * (len(local_part) - 2) + local_part[-1]
+    elif len(local_part) > 2:
+        # For standard emails, keep first and last character
+        masked_local = local_part[0] + '*' * (len(local_part) - 2) + local_part[-1]
+    else:
+        masked_local = local_part[0] + '*'  # For very short local parts
+
+    # Mask domain part
+    domain_parts = domain.split('.')
+    if len(domain_parts) > 1:
+        # Keep first and last part of domain
+        masked_domain = domain_parts[0][0] + '*' * (len(domain_parts[0]) - 1)
+        for part in domain_parts[1:-1]:
+            masked_domain += '.' + part[:1] + '*' * (len(part) - 1)
+        masked_domain += '.' + domain_parts[-1]  # Keep TLD as is
+    else:
+        masked_domain = domain[0] + '*' * (len(domain) - 1)
+
+    return f"{masked_local}@{masked_domain}"
+
+
+def mask_abusive(word: str) -> str:
+    return '*' * len(word)
+
+
+_MASKERS = {PHONE: mask_phone, EMAIL: mask_email, ABUSIVE: mask_abusive}
+
+
+class RuleEngine:
+    """Rule-based masking of phone numbers, emails and abusive words.
+
+    All three kinds of span are located on the original text, overlaps are
+    resolved (leftmost first, then longest, then email > phone > abusive) and
+    the masked string is built once. Phone numbers and emails are found by
+    the linear-time scanners in phone_detector and email_detector. Texts
+    without digits skip the phone search and texts without '@' skip the email
+    search, so short chat lines only pay for the word scan.
+    """
+
+    def __init__(self, word_matcher: WordMatcher):
+        self.word_matcher = word_matcher
+
+    def find_spans(self, text: str, categories: Optional[Collection[str]] = None) -> List[Span]:
+        """Return the non-overlapping (start, end, category) spans to mask, in order."""
+        if not text:
+            return []
+        if categories is None:
+            categories = CATEGORIES
+
+        # Each category is timed only when the call is being traced
+        trace = current_trace()
+        started = 0.0
+        spans = []
+        if PHONE in categories and _DIGIT.search(text):
+            if trace is not None:
+                started = perf_counter()
+            spans.extend((start, end, PHONE) for start, end in find_phone_spans(text))
+            if trace is not None:
+                trace.add(PHONE, perf_counter() - started)
+        if EMAIL in categories and '@' in text:
+            if trace is not None:
+                started = perf_counter()
+            spans.extend((start, end, EMAIL) for start, end in find_email_spans(text))
+            if trace is not None:
+                trace.add(EMAIL, perf_counter() - started)
+        if ABUSIVE in categories:
+            if trace is not None:
+                started = perf_counter()
+            spans.extend((start, end, ABUSIVE) for start, end in self.word_matcher.find_spans(text))
+            if trace is not None:
+                trace.add(ABUSIVE, perf_counter() - started)
+
+        if not spans:
+            return spans
+        return resolve_overlaps(spans)
+
+    def mask(self, text: str, categories: Optional[Collection[str]] = None) -> str:
+        """Mask every span found in ``text``."""
+        return apply_spans(text, self.find_spans(text, categories))
+
+
+def resolve_overlaps(spans: List[Span]) -> List[Span]:
+    """Keep the leftmost, then longest, then highest-priority of overlapping spans."""
+    spans.sort(key=lambda span: (span[0], span[0] - span[1], _PRIORITY[span[2]]))
+    selected = []
+    last_end = 0
+    for span in spans:
+        if span[0] >= last_end:
+            selected.append(span)
+            last_end = span[1]
+    return selected
+
+
+def apply_spans(text: str, spans: List[Span]) -> str:
+    """Build the masked text from ordered, disjoint spans."""
+    if not spans:
+        return text
+    parts = []
+    last = 0
+    for start, end, category in spans:
+        parts.append(text[last:start])
+        parts.append(_MASKERS[category](text[start:end]))
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
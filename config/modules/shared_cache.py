@@ -0,0 +1,221 @@
+import logging
+import math
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.module_api import ModuleApi
+from twisted.internet import defer, task
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Stand-in for Redis that lives in the current process.
+
+    Every backend created with the same ``name`` sees the same entries, so
+    several module instances in one process (tests, the benchmark) share a
+    cache the way workers share Redis.
+    """
+
+    _stores: Dict[str, Dict[str, Tuple[float, str]]] = {}
+
+    def __init__(self, name: str = "default", clock: Callable[[], float] = time.monotonic):
+        self._entries = self._stores.setdefault(name, {})
+        self._clock = clock
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self._clock():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (self._clock() + ttl, value)
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Redis through txredisapi, the client Synapse uses for worker replication."""
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        dbid: Optional[int] = None,
+        password: Optional[str] = None,
+        pool_size: int = 4,
+        connect_timeout: float = 5,
+    ):
+        try:
+            import txredisapi
+        except ImportError:
+            raise ValueError("shared_cache backend 'redis' needs txredisapi (pip install matrix-synapse[redis])")
+        # Values are masked text and must never be turned into numbers
+        self._redis = txredisapi.lazyConnectionPool(
+            host=host,
+            port=port,
+            dbid=dbid,
+            password=password,
+            poolsize=pool_size,
+            connectTimeout=connect_timeout,
+            convertNumbers=False,
+        )
+
+    async def get(self, key: str) -> Optional[str]:
+        return await make_deferred_yieldable(self._redis.get(key))
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await make_deferred_yieldable(self._redis.set(key, value, pexpire=max(1, math.ceil(ttl * 1000))))
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        result = await make_deferred_yieldable(
+            self._redis.set(key, value, pexpire=max(1, math.ceil(ttl * 1000)), only_if_not_exists=True)
+        )
+        return result is not None
+
+    def close(self) -> None:
+        self._redis.disconnect()
+
+
+class SharedCache:
+    """Cache tier shared by all worker processes, in front of a backend.
+
+    Results are namespaced by a fingerprint of the masking setup, like
+    ResultCache, so workers with a different word list or API never read
+    each other's results. Small state such as the circuit breaker's lives
+    outside that namespace.
+
+    A worker about to mask a text can :meth:`claim` it; workers that lose
+    the claim :meth:`wait` for the winner's result instead of masking the
+    same text again.
+
+    The backend must not slow masking down: a lookup that fails or takes
+    longer than ``timeout`` counts as a miss, and after either the backend
+    is left alone for ``retry_interval`` seconds. Writes are fire and
+    forget, in background processes.
+    """
+
+    def __init__(
+        self,
+        api: ModuleApi,
+        backend,
+        prefix: str = "text_masker",
+        timeout: float = 0.05,
+        retry_interval: float = 5,
+        clock: Callable[[], float] = time.monotonic,
+        reactor=None,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.backend = backend
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._reactor = reactor
+        self._api = api
+        self._namespace = f"{prefix}:r"
+        self._down_until = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def set_fingerprint(self, fingerprint: str) -> None:
+        self._namespace = f"{self.prefix}:r:{fingerprint[:32]}"
+
+    async def get(self, key: bytes) -> Optional[str]:
+        value = await self._get(f"{self._namespace}:{key.hex()}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: bytes, value: str, ttl: float) -> None:
+        self._set(f"{self._namespace}:{key.hex()}", value, ttl)
+
+    async def claim(self, key: bytes, ttl: float) -> bool:
+        """Claim the masking of ``key`` for ``ttl`` seconds.
+
+        False if another worker holds the claim; True otherwise, including
+        when the backend can't be reached.
+        """
+        if self._clock() < self._down_until:
+            return True
+        d = run_in_background(self.backend.set_if_absent, f"{self._namespace}:{key.hex()}:claim", "1", ttl)
+        d.addTimeout(self.timeout, self._reactor)
+        try:
+            return await make_deferred_yieldable(d)
+        except Exception as e:
+            self._failed(e)
+            return True
+
+    async def wait(self, key: bytes, timeout: float) -> Optional[str]:
+        """Poll for the result of another worker's claim, for up to ``timeout`` seconds."""
+        deadline = self._clock() + timeout
+        interval = 0.005
+        while True:
+            await make_deferred_yieldable(task.deferLater(self._reactor, interval, lambda: None))
+            value = await self._get(f"{self._namespace}:{key.hex()}")
+            if value is not None or self._clock() + interval > deadline or self._clock() < self._down_until:
+                return value
+            interval = min(interval * 2, 0.05)
+
+    async def get_state(self, name: str) -> Optional[str]:
+        return await self._get(f"{self.prefix}:s:{name}")
+
+    def set_state(self, name: str, value: str, ttl: float) -> None:
+        self._set(f"{self.prefix}:s:{name}", value, ttl)
+
+    async def _get(self, key: str) -> Optional[str]:
+        if self._clock() < self._down_until:
+            return None
+        d = run_in_background(self.backend.get, key)
+        d.addTimeout(self.timeout, self._reactor)
+        try:
+            return await make_deferred_yieldable(d)
+        except Exception as e:
+            self._failed(e)
+        return None
+
+    def _failed(self, e: Exception) -> None:
+        self.errors += 1
+        if isinstance(e, defer.TimeoutError):
+            logger.warning(f"Shared cache timed out, bypassing it for {self.retry_interval}s")
+            metrics.shared_cache_errors_counter.labels("timeout").inc()
+        else:
+            logger.warning(f"Shared cache operation failed, bypassing it for {self.retry_interval}s: {e}")
+            metrics.shared_cache_errors_counter.labels("error").inc()
+        self._down_until = self._clock() + self.retry_interval
+
+    def _set(self, key: str, value: str, ttl: float) -> None:
+        if self._clock() < self._down_until:
+            return
+        self._api.run_as_background_process("text_masker_shared_cache_set", self._write, key, value, ttl)
+
+    async def _write(self, key: str, value: str, ttl: float) -> None:
+        try:
+            await self.backend.set(key, value, ttl)
+        except Exception as e:
+            self._failed(e)
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
@@ -1,14 +1,49 @@
-import re
+import time
+import hashlib
 import logging
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Set, Tuple, Any
 from synapse.module_api import ModuleApi
 from synapse.events import EventBase
-import requests
 from twisted.internet import defer
 
-# Configure logger
+from . import metrics
+from .admission import AdmissionController
+from .batcher import MaskingBatcher
+from .circuit_breaker import CircuitBreaker
+from .diagnostics import DiagnosticsResource, profiler
+from .edits import diff_window, is_edit, splice
+from .html_masker import HTML_FORMAT, FormattedBody
+from .lexicon import LexiconMatcher, lexicon_changed
+from .masking_client import MaskingApiClient, MaskingApiError, MaskingApiTimeout
+from .offload import RuleOffloader
+from .post_send import PostSendQueue, QueueFull
+from .result_cache import ResultCache
+from .room_policy import DEFAULT_POLICY, POLICY_EVENT_TYPE, RoomPolicies, RoomPolicy
+from .rule_engine import ABUSIVE, EMAIL, PHONE, RuleEngine, Span, apply_spans
+from .shared_cache import MemoryBackend, RedisBackend, SharedCache
+from .tracing import SlowCallLog, stage
+from .word_matcher import WordMatcher
+
+# Levels come from Synapse's log config; per-message logging is at DEBUG
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Default abusive-word list, used when the module config doesn't provide one
+DEFAULT_ABUSIVE_WORDS = [
+    "🖕","2 girls 1 cup","2g1c","aad","aand","abusive hashtag phrase","abusive word for Pakistan","acronym for bhosdike","acronym for bhosdike","acronym for motherfucker","acronym for motherfucker","acronym for sisterfucker","acronym for sisterfucker","acrotomophilia","alabama hot pocket","alaskan pipeline","alcoholic","alcoholic","alcoholic","alcoholic","anal","anilingus","anus","apeshit","arse","arse","arse","arsehead","arsehole","ass","ass","ass","ass hole","asshole","asshole","asshole","asshole","asshole","asshole","assmunch","auto erotic","autoerotic","b.c.","b.s.d.k","babbe","babbey","babeland","baby batter","baby juice","bahenchod","bakchod","bakchodd","bakchodi","ball gag","ball gravy","ball kicking","ball licking","ball sack","ball sucking","bangbros","bareback","barely legal","barenaked","bastard","bastard","bastard","bastard","bastard","bastard","bastard","bastard","bastardo","bastinado","bbw","bc","bdsm","beaner","beaners","beaver cleaver","beaver lips","behenchod","bestiality","bevakoof","bevda","bevdey","bevkoof","bevkuf","bewakoof","bewda","bewday","bewkoof","bewkuf","bhadua","bhaduaa","bhadva","bhadvaa","bhadwa","bhadwaa","bhenchod","bhenchodd","bhonsdike","bhosada","Bhosadchod","Bhosadchod","Bhosadchodal","Bhosadchodal","bhosda","bhosdaa","bhosdike","bhosdiki","bhosdiwala","bhosdiwale","big black","big breasts","big knockers","big tits","bimbos","birdlock","bitch","bitch","bitch","bitch","bitch","bitches","blabbering","blabbermouth","blabbermouth","black cock","blonde action","blonde on blonde action","blow job","blow your load","blowjob","blue waffle","blumpkin","bollocks","bondage","boner","boob","boobs","boobs","boobs","boobs","boobs","boobs","boobs","booty call","brotherfucker","brown showers","brunette action","bsdk","bube","bubey","bugger","bukkake","bulldyke","bullet vibe","bullshit","bung hole","bunghole","bur","burr","busty","butt","buttcheeks","butthole","buur","buurr","camel toe","camgirl","camslut","camwhore","carpet muncher","carpetmuncher","charsi","chhod","child-fucker","chocolate rosebuds","chod","chodd","chooche","choochi","choot","Christ on a bike","Christ on a cracker","chuchi","chudne","chudney","chudwa","chudwaa","chudwaane","chudwane","chut","chutad","chute","chutia","chutiya","chutiye","chuttad","circlejerk","cleveland steamer","clit","clitoris","clover clamps","clusterfuck","cock","cocks","cocksucker","coon","coons","coprolagnia","coprophilia","cornhole","crap","creampie","cum","cumming","cunnilingus","cunt","dalaal","dalal","dalle","dalley","dammit","damn","damn it","damned","darkie","date rape","daterape","daughter of a whore","deep throat","deepthroat","dendrophilia","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick-head","dickhead","dildo","dingleberries","dingleberry","dirty pillows","dirty sanchez","dog","dog","dog","dog shit","dog shit","dog style","doggie style","doggiestyle","doggy style","doggystyle","dolcett","domination","dominatrix","dommes","donkey","donkey","donkey punch","double dong","double penetration","dp action","druggie","dry hump","dumb ass","dumb-ass","dumbass","dvda","dyke","eat my ass","ecchi","ejaculation","erotic","erotism","escort","eunuch","excreta / faeces","faeces","faeces","faeces","faggot","father-fucker","fatherfucker","fattu","fecal","felch","fellatio","feltch","female squirting","femdom","figging","fingerbang","fingering","fisting","fool","foot fetish","footjob","frotting","fuck","fuck","fuck buttons","fucked","fucked","fucked","fucked","fucker","fucker","fuckin","fucking","fucking","fucking","fucktards","fudge packer","fudgepacker","futanari","g-spot","gaand","gadha","gadhalund","gadhe","gand","gandfat","gandfut","gandiya","gandiye","gandu","gang bang","gay sex","genitals","get fuck","get fuck","giant cock","girl on","girl on top","girls gone wild","goatcx","goatse","god dammit","god damn","goddammit","goddamn","goddamned","goddamnit","godsdamn","gokkun","golden shower","goo","goo girl","goodpoop","goregasm","gote","gotey","gotte","grope","group sex","gu","guro","hag","haggu","hagne","hagney","hand job","handjob","haraamjaada","haraamjaade","haraamkhor","haraamzaade","haraamzyaada","Harami","harami","haramjada","haramkhor","haramzyada","hard core","hardcore","hell","hentai","hit / kill","hit now","holy shit","homoerotic","honkey","hooker","horseshit","hot carl","hot chick","how to kill","how to murder","huge fat","humping","husband of a whore","husband of a whore","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","in shit","incest","intercourse","jack off","jack-ass","jackarse","jackass","jail bait","jailbait","jelly donut","jerk","jerk off","Jesus Christ","Jesus fuck","Jesus H. Christ","Jesus Harold Christ","Jesus wept","Jesus, Mary and Joseph","jhaat","jhaatu","jhat","jhatu","jigaboo","jiggaboo","jiggerboo","jizz","juggs","kike","kinbaku","kinkster","kinky","knobbing","kutia","kutiya","Kutta","kutta","kutte","kuttey","kutti","kuttiya","lame","landi","landy","lauda","laude","laudey","launda","laundey","laundi","laundiya","laura","leather restraint","leather straight jacket","lemon party","ling","loda","lode","lolita","lora","loser","lounde","loundi","loundiya","lovemaking","lulli","lund","m.c.","maar","madarchod","madarchodd","madarchood","madarchoot","madarchut","make me come","male squirting","mamme","mammey","maro","marunga","masturbate","masturbate","masturbate","mc","menage a trois","milf","missionary position","moot","mooth","mootne","mother fucker","mother-fucker","mother's cunt","mother's cunt","motherfucker","motherfucker","motherfucker","motherfucker","mound of venus","mr hands","muff diver","muffdiving","mut","muth","mutne","nambla","Napoonsak","nawashi","negro","neonazi","nig nog","nigga","nigger","nigra","nimphomania","nipple","nipple","nipple","nipples","nipples","nsfw images","nude","nudity","nunni","nunnu","nympho","nymphomania","octopussy","omorashi","one cup two girls","one guy one jar","orgasm","orgy","paaji","paedophile","pain in the neck","paji","paki","panties","panty","pedobear","pedophile","pegging","penis","penis","penis of donkey","pesaab","pesab","peshaab","peshab","phone sex","piece of shit","pig","pig","pigfucker","pilla","pillay","pille","pilley","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pisaab","pisab","piss","piss","piss","piss","piss","piss","piss","piss / pee","piss / pee","piss pig","pissed off","pissing","pisspig","pkmkb","playboy","pleasure chest","pole smoker","ponyplay","poof","poon","poontang","poop chute","poopchute","porkistan","porn","porno","pornography","prick","prince albert piercing","prostitute","prostitute","prostitute","prostitute","pthc","pubes","pubic hair","pubic hair","pubic hair","pubic hair","punany","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy fucker","pussy fucker","pussy fucker","pussy fucker","queaf","queef","quim","raand","raghead","raging boner","rand","randi","randy","rape","raping","rapist","rectum","retard","reverse cowgirl","rimjob","rimming","rosy palm","rosy palm and her 5 sisters","rusty trombone","s&m","sadism","santorum","scat","schlong","scissoring","semen","sex","sexo","sexy","shaved beaver","shaved pussy","shemale","shibari","shit","shit","shit","shit ass","shitblimp","shite","shitty","Shoot!","shota","shrimping","Shut up!!","sibling fucker","sisterfuck","sisterfucker","sisterfucker","sisterfucker","sisterfucker","sisterfucker","skeet","slanteye","slut","slut","slut","slut","slut","small sized penis","small sized penis","smut","snatch","snowballing","sodomize","sodomy","son of a bitch","son of a dog","son of a dog","son of a dog","son of a dog","son of a whore","son of a whore","son of a whore","spastic","spic","splooge","splooge moose","spooge","spread legs","spunk","strap on","strapon","strappado","strip club","stupid","style doggy","suar","suar","Suar ki aulad","suck","sucks","suicide girls","sultry women","swastika","sweet Jesus","swinger","tainted love","taste my","tatte","tatti","tatty","tea bagging","testicles","testicles","testicles","testicles","testicles","testicles","threesome","throating","ticked off","tied up","tight white","timid / fearful","tit","tits","titties","titty","to excrete","to excrete","to excrete","to piss / pee","to piss / pee","tongue in a","topless","tosser","towelhead","tranny","tribadism","tub girl","tubgirl","tushy","twat","twink","twinkie","two girls one cup","ullu","Ullu ka pattha","undressing","upskirt","urethra play","urophilia","useless","useless","vagina","venus mound","vibrator","violet wand","vorarephilia","voyeur","vulva","wank","wanker","wet dream","wetback","white power","will kill","wimp","wrapping men","wrinkled starfish","xx","xxx","yaoi","yellow showers","yiffy","your mother","zoophilia"
+]
+
+# Matching automata for the default list, built once per process on first use
+_DEFAULT_WORD_MATCHERS: Dict[bool, WordMatcher] = {}
+
+
+def default_word_matcher(normalize: bool) -> WordMatcher:
+    if normalize not in _DEFAULT_WORD_MATCHERS:
+        _DEFAULT_WORD_MATCHERS[normalize] = WordMatcher(DEFAULT_ABUSIVE_WORDS, normalize=normalize)
+    return _DEFAULT_WORD_MATCHERS[normalize]
+
+# Added to the content of every event the module has masked
+MASKED_NOTICE = "Some content has been masked for privacy and safety."
+
 
 class TextMasker:
     def __init__(self, config: Dict, api: ModuleApi):
@@ -16,79 +51,69 @@ class TextMasker:
         self.api = api
         self.config = config
                 
-        # Comprehensive pattern for various phone number formats
-        self.phone_pattern = r'''
-            # International format with optional country code
-            (?:\+\d{1,3}[-.\s]?)?
-            
-            # Various formats:
-            (?:
-                # Standard format: (123) 456-7890
-                \(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}
-                |
-                # International format: +1 234 567 8900
-                \d{1,4}[-.\s]?\d{3}[-.\s]?\d{3}[-.\s]?\d{4}
-                |
-                # Continuous format: 1234567890
-                \d{10}
-                |
-                # With separators: 123-456-7890 or 123.456.7890
-                \d{3}[-.]\d{3}[-.]\d{4}
-                |
-                # With spaces: 123 456 7890
-                \d{3}\s\d{3}\s\d{4}
-                |
-                # With mixed separators: 123_456@7890
-                \d{3}[_\-@#%&\.]\d{3}[_\-@#%&\.]\d{4}
-                |
-                # Extension format: 123-456-7890 x1234
-                \d{3}[-.\s]?\d{3}[-.\s]?\d{4}\s*(?:x|ext|extension)?\s*\d{1,5}
-                |
-                # Repeating number patterns: 95 95 95 95 95
-                (?:\d{2,3}\s?){3,}
-                |
-                # Ten consecutive numbers with spaces: 1 2 3 4 5 6 7 8 9 0
-                (?:\d\s){9}\d
-            )
-            
-            # Word boundary to avoid partial matches
-            \b
-        '''
-        self.phone_pattern = re.compile(self.phone_pattern, re.VERBOSE | re.IGNORECASE)
-        
-        # Comprehensive email pattern
-        self.email_pattern = r'''
-            # Local part (before @)
-            (?:
-                # Standard email characters
-                [a-zA-Z0-9._%+-]+
-                |
-                # Quoted strings with special characters
-                "[^"\\]*(?:\\.[^"\\]*)*"
+        # Match obfuscated spellings ("f.u.c.k", "sh1t", look-alike letters)
+        # by normalizing text once before the word scan
+        self.normalize_obfuscation = config.get("obfuscation", {}).get("enabled", True)
+
+        # Load abusive words from a compiled lexicon file, from config, or use
+        # the default matcher shared by all instances
+        lexicon_config = config.get("lexicon", {})
+        if lexicon_config.get("path"):
+            self.word_matcher = LexiconMatcher(lexicon_config["path"])
+            if self.word_matcher.normalize != self.normalize_obfuscation:
+                logger.warning(
+                    f"Lexicon {lexicon_config['path']} was compiled with normalize={self.word_matcher.normalize}, "
+                    f"which overrides obfuscation.enabled"
+                )
+        elif "abusive_words" in config:
+            self.word_matcher = WordMatcher(config["abusive_words"], normalize=self.normalize_obfuscation)
+        else:
+            self.word_matcher = default_word_matcher(self.normalize_obfuscation)
+
+        # Single-pass engine for phone numbers, emails and abusive words
+        self.rules = RuleEngine(self.word_matcher)
+        logger.debug(f"Loaded {len(self.word_matcher)} abusive words")
+
+        # Per-room policy from a state event: rooms can be exempt, limited to
+        # some rule categories, kept off the API or use another word list
+        policy_config = config.get("room_policy", {})
+        self.profile_rules: Dict[str, RuleEngine] = {}
+        for name, profile in policy_config.get("profiles", {}).items():
+            if profile.get("lexicon"):
+                matcher = LexiconMatcher(profile["lexicon"])
+            else:
+                matcher = WordMatcher(profile.get("abusive_words", []), normalize=self.normalize_obfuscation)
+            self.profile_rules[name] = RuleEngine(matcher)
+        if policy_config.get("enabled", True):
+            self.room_policies = RoomPolicies(
+                api,
+                event_type=policy_config.get("event_type", POLICY_EVENT_TYPE),
+                profiles=self.profile_rules,
+                exempt_rooms=policy_config.get("exempt_rooms", []),
+                trusted_senders=policy_config.get("trusted_senders", []),
+                max_entries=policy_config.get("max_entries", 10000),
             )
-            @
-            # Domain part
-            (?:
-                # Standard domain
-                [a-zA-Z0-9.-]+
-                |
-                # IP address in brackets
-                \[(?:[0-9]{1,3}\.){3}[0-9]{1,3}\]
+        else:
+            self.room_policies = None
+
+        # Also mask the HTML formatted_body, text nodes and links, with the rules
+        self.mask_formatted_body = config.get("formatted_body", {}).get("enabled", True)
+
+        # Rule-based masking of large bodies runs in a bounded pool instead of
+        # on the reactor thread; very large ones are scanned in chunks
+        offload_config = config.get("offload", {})
+        if offload_config.get("enabled", True):
+            self.offloader = RuleOffloader(
+                api,
+                self.rules,
+                inline_max_chars=offload_config.get("inline_max_chars", 2048),
+                chunk_chars=offload_config.get("chunk_chars", 16384),
+                chunk_overlap=offload_config.get("chunk_overlap", 256),
+                executor=offload_config.get("executor", "thread"),
+                max_workers=offload_config.get("max_workers", 4),
             )
-            \.
-            # TLD (2+ characters)
-            [a-zA-Z]{2,}
-        '''
-        self.email_pattern = re.compile(self.email_pattern, re.VERBOSE | re.IGNORECASE)
-        
-        # Load abusive words from config or use default list
-        self.abusive_words = config.get("abusive_words", [
-        "🖕","2 girls 1 cup","2g1c","aad","aand","abusive hashtag phrase","abusive word for Pakistan","acronym for bhosdike","acronym for bhosdike","acronym for motherfucker","acronym for motherfucker","acronym for sisterfucker","acronym for sisterfucker","acrotomophilia","alabama hot pocket","alaskan pipeline","alcoholic","alcoholic","alcoholic","alcoholic","anal","anilingus","anus","apeshit","arse","arse","arse","arsehead","arsehole","ass","ass","ass","ass hole","asshole","asshole","asshole","asshole","asshole","asshole","assmunch","auto erotic","autoerotic","b.c.","b.s.d.k","babbe","babbey","babeland","baby batter","baby juice","bahenchod","bakchod","bakchodd","bakchodi","ball gag","ball gravy","ball kicking","ball licking","ball sack","ball sucking","bangbros","bareback","barely legal","barenaked","bastard","bastard","bastard","bastard","bastard","bastard","bastard","bastard","bastardo","bastinado","bbw","bc","bdsm","beaner","beaners","beaver cleaver","beaver lips","behenchod","bestiality","bevakoof","bevda","bevdey","bevkoof","bevkuf","bewakoof","bewda","bewday","bewkoof","bewkuf","bhadua","bhaduaa","bhadva","bhadvaa","bhadwa","bhadwaa","bhenchod","bhenchodd","bhonsdike","bhosada","Bhosadchod","Bhosadchod","Bhosadchodal","Bhosadchodal","bhosda","bhosdaa","bhosdike","bhosdiki","bhosdiwala","bhosdiwale","big black","big breasts","big knockers","big tits","bimbos","birdlock","bitch","bitch","bitch","bitch","bitch","bitches","blabbering","blabbermouth","blabbermouth","black cock","blonde action","blonde on blonde action","blow job","blow your load","blowjob","blue waffle","blumpkin","bollocks","bondage","boner","boob","boobs","boobs","boobs","boobs","boobs","boobs","boobs","booty call","brotherfucker","brown showers","brunette action","bsdk","bube","bubey","bugger","bukkake","bulldyke","bullet vibe","bullshit","bung hole","bunghole","bur","burr","busty","butt","buttcheeks","butthole","buur","buurr","camel toe","camgirl","camslut","camwhore","carpet muncher","carpetmuncher","charsi","chhod","child-fucker","chocolate rosebuds","chod","chodd","chooche","choochi","choot","Christ on a bike","Christ on a cracker","chuchi","chudne","chudney","chudwa","chudwaa","chudwaane","chudwane","chut","chutad","chute","chutia","chutiya","chutiye","chuttad","circlejerk","cleveland steamer","clit","clitoris","clover clamps","clusterfuck","cock","cocks","cocksucker","coon","coons","coprolagnia","coprophilia","cornhole","crap","creampie","cum","cumming","cunnilingus","cunt","dalaal","dalal","dalle","dalley","dammit","damn","damn it","damned","darkie","date rape","daterape","daughter of a whore","deep throat","deepthroat","dendrophilia","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick","dick-head","dickhead","dildo","dingleberries","dingleberry","dirty pillows","dirty sanchez","dog","dog","dog","dog shit","dog shit","dog style","doggie style","doggiestyle","doggy style","doggystyle","dolcett","domination","dominatrix","dommes","donkey","donkey","donkey punch","double dong","double penetration","dp action","druggie","dry hump","dumb ass","dumb-ass","dumbass","dvda","dyke","eat my ass","ecchi","ejaculation","erotic","erotism","escort","eunuch","excreta / faeces","faeces","faeces","faeces","faggot","father-fucker","fatherfucker","fattu","fecal","felch","fellatio","feltch","female squirting","femdom","figging","fingerbang","fingering","fisting","fool","foot fetish","footjob","frotting","fuck","fuck","fuck buttons","fucked","fucked","fucked","fucked","fucker","fucker","fuckin","fucking","fucking","fucking","fucktards","fudge packer","fudgepacker","futanari","g-spot","gaand","gadha","gadhalund","gadhe","gand","gandfat","gandfut","gandiya","gandiye","gandu","gang bang","gay sex","genitals","get fuck","get fuck","giant cock","girl on","girl on top","girls gone wild","goatcx","goatse","god dammit","god damn","goddammit","goddamn","goddamned","goddamnit","godsdamn","gokkun","golden shower","goo","goo girl","goodpoop","goregasm","gote","gotey","gotte","grope","group sex","gu","guro","hag","haggu","hagne","hagney","hand job","handjob","haraamjaada","haraamjaade","haraamkhor","haraamzaade","haraamzyaada","Harami","harami","haramjada","haramkhor","haramzyada","hard core","hardcore","hell","hentai","hit / kill","hit now","holy shit","homoerotic","honkey","hooker","horseshit","hot carl","hot chick","how to kill","how to murder","huge fat","humping","husband of a whore","husband of a whore","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","idiot","in shit","incest","intercourse","jack off","jack-ass","jackarse","jackass","jail bait","jailbait","jelly donut","jerk","jerk off","Jesus Christ","Jesus fuck","Jesus H. Christ","Jesus Harold Christ","Jesus wept","Jesus, Mary and Joseph","jhaat","jhaatu","jhat","jhatu","jigaboo","jiggaboo","jiggerboo","jizz","juggs","kike","kinbaku","kinkster","kinky","knobbing","kutia","kutiya","Kutta","kutta","kutte","kuttey","kutti","kuttiya","lame","landi","landy","lauda","laude","laudey","launda","laundey","laundi","laundiya","laura","leather restraint","leather straight jacket","lemon party","ling","loda","lode","lolita","lora","loser","lounde","loundi","loundiya","lovemaking","lulli","lund","m.c.","maar","madarchod","madarchodd","madarchood","madarchoot","madarchut","make me come","male squirting","mamme","mammey","maro","marunga","masturbate","masturbate","masturbate","mc","menage a trois","milf","missionary position","moot","mooth","mootne","mother fucker","mother-fucker","mother's cunt","mother's cunt","motherfucker","motherfucker","motherfucker","motherfucker","mound of venus","mr hands","muff diver","muffdiving","mut","muth","mutne","nambla","Napoonsak","nawashi","negro","neonazi","nig nog","nigga","nigger","nigra","nimphomania","nipple","nipple","nipple","nipples","nipples","nsfw images","nude","nudity","nunni","nunnu","nympho","nymphomania","octopussy","omorashi","one cup two girls","one guy one jar","orgasm","orgy","paaji","paedophile","pain in the neck","paji","paki","panties","panty","pedobear","pedophile","pegging","penis","penis","penis of donkey","pesaab","pesab","peshaab","peshab","phone sex","piece of shit","pig","pig","pigfucker","pilla","pillay","pille","pilley","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pimp","pisaab","pisab","piss","piss","piss","piss","piss","piss","piss","piss / pee","piss / pee","piss pig","pissed off","pissing","pisspig","pkmkb","playboy","pleasure chest","pole smoker","ponyplay","poof","poon","poontang","poop chute","poopchute","porkistan","porn","porno","pornography","prick","prince albert piercing","prostitute","prostitute","prostitute","prostitute","pthc","pubes","pubic hair","pubic hair","pubic hair","pubic hair","punany","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy","pussy fucker","pussy fucker","pussy fucker","pussy fucker","queaf","queef","quim","raand","raghead","raging boner","rand","randi","randy","rape","raping","rapist","rectum","retard","reverse cowgirl","rimjob","rimming","rosy palm","rosy palm and her 5 sisters","rusty trombone","s&m","sadism","santorum","scat","schlong","scissoring","semen","sex","sexo","sexy","shaved beaver","shaved pussy","shemale","shibari","shit","shit","shit","shit ass","shitblimp","shite","shitty","Shoot!","shota","shrimping","Shut up!!","sibling fucker","sisterfuck","sisterfucker","sisterfucker","sisterfucker","sisterfucker","sisterfucker","skeet","slanteye","slut","slut","slut","slut","slut","small sized penis","small sized penis","smut","snatch","snowballing","sodomize","sodomy","son of a bitch","son of a dog","son of a dog","son of a dog","son of a dog","son of a whore","son of a whore","son of a whore","spastic","spic","splooge","splooge moose","spooge","spread legs","spunk","strap on","strapon","strappado","strip club","stupid","style doggy","suar","suar","Suar ki aulad","suck","sucks","suicide girls","sultry women","swastika","sweet Jesus","swinger","tainted love","taste my","tatte","tatti","tatty","tea bagging","testicles","testicles","testicles","testicles","testicles","testicles","threesome","throating","ticked off","tied up","tight white","timid / fearful","tit","tits","titties","titty","to excrete","to excrete","to excrete","to piss / pee","to piss / pee","tongue in a","topless","tosser","towelhead","tranny","tribadism","tub girl","tubgirl","tushy","twat","twink","twinkie","two girls one cup","ullu","Ullu ka pattha","undressing","upskirt","urethra play","urophilia","useless","useless","vagina","venus mound","vibrator","violet wand","vorarephilia","voyeur","vulva","wank","wanker","wet dream","wetback","white power","will kill","wimp","wrapping men","wrinkled starfish","xx","xxx","yaoi","yellow showers","yiffy","your mother","zoophilia"
-    ])
-        logger.debug(f"Loaded {len(self.abusive_words)} abusive words from config")
-        
-        # Create regex pattern for abusive words
-        self.abusive_pattern = r'\b(' + '|'.join(map(re.escape, self.abusive_words)) + r')\b'
+        else:
+            self.offloader = None
         
         # API endpoint configuration with fallback
         self.mask_api_url = config.get("mask_api_url", "<API_URL>")
@@ -97,162 +122,671 @@ class TextMasker:
         # Timeout configuration (in seconds)
         self.timeout = config.get("timeout", 10)
         
-        # Create a session for connection pooling
-        self.session = requests.Session()
+        # Non-blocking API client with a keep-alive connection pool and a cap
+        # on concurrent requests
+        self.max_in_flight = config.get("max_in_flight", 10)
+        self.client = MaskingApiClient(
+            self.mask_api_url,
+            timeout=self.timeout,
+            max_in_flight=self.max_in_flight,
+            pool_size=config.get("pool_size"),
+            pool_idle_timeout=config.get("pool_idle_timeout", 60),
+        )
+
+        # Optional micro-batching: messages arriving within `window_ms` of each
+        # other (up to `max_items`) share one request to the batch endpoint
+        batching_config = config.get("batching", {})
+        if batching_config.get("enabled", False):
+            if not batching_config.get("batch_api_url"):
+                logger.error("batching.batch_api_url is required when batching is enabled")
+                raise ValueError("batching.batch_api_url is required when batching is enabled")
+            self.batcher = MaskingBatcher(
+                api,
+                self.client,
+                batching_config["batch_api_url"],
+                window=batching_config.get("window_ms", 10) / 1000,
+                max_items=batching_config.get("max_items", 32),
+            )
+        else:
+            self.batcher = None
+
+        # Circuit breaker in front of the API. While open, messages go straight
+        # to rule-based masking; `timeout` caps the adaptive per-request timeout.
+        breaker_config = config.get("circuit_breaker", {})
+        if breaker_config.get("enabled", True):
+            self.circuit_breaker = CircuitBreaker(
+                failure_threshold=breaker_config.get("failure_threshold", 0.5),
+                window_size=breaker_config.get("window_size", 20),
+                min_requests=breaker_config.get("min_requests", 5),
+                reset_timeout=breaker_config.get("reset_timeout", 30),
+                timeout_multiplier=breaker_config.get("timeout_multiplier", 1.5),
+                min_timeout=breaker_config.get("min_timeout", 0.2),
+                max_timeout=self.timeout,
+            )
+        else:
+            self.circuit_breaker = None
+
+        # Masked results keyed by a hash of the message body. Results from the
+        # rule-based fallback are kept for a shorter time so that API masking
+        # takes over again soon after the API recovers.
+        cache_config = config.get("cache", {})
+        if cache_config.get("enabled", True):
+            self.cache = ResultCache(
+                max_entries=cache_config.get("max_entries", 10000),
+                max_bytes=cache_config.get("max_bytes", 16 * 1024 * 1024),
+                ttl=cache_config.get("ttl", 300),
+            )
+            self.cache_fallback_ttl = cache_config.get("fallback_ttl", 30)
+            self.cache.set_fingerprint(self._masking_fingerprint())
+        else:
+            self.cache = None
+
+        # Optional second tier shared by all workers, normally the Redis that
+        # Synapse uses for replication. Workers also open their circuit
+        # breaker while another worker has it open.
+        shared_config = config.get("shared_cache", {})
+        if shared_config.get("enabled", False):
+            backend_name = shared_config.get("backend", "redis")
+            if backend_name == "redis":
+                backend = RedisBackend(
+                    host=shared_config.get("host", "localhost"),
+                    port=shared_config.get("port", 6379),
+                    dbid=shared_config.get("dbid"),
+                    password=shared_config.get("password"),
+                    pool_size=shared_config.get("pool_size", 4),
+                )
+            elif backend_name == "memory":
+                backend = MemoryBackend(shared_config.get("name", "default"))
+            else:
+                logger.error(f"Unknown shared_cache.backend: {backend_name}")
+                raise ValueError(f"Unknown shared_cache.backend: {backend_name}")
+            self.shared_cache = SharedCache(
+                api,
+                backend,
+                prefix=shared_config.get("prefix", "text_masker"),
+                timeout=shared_config.get("timeout_ms", 50) / 1000,
+                retry_interval=shared_config.get("retry_interval", 5),
+            )
+            self.shared_cache.set_fingerprint(self._masking_fingerprint())
+            self.shared_cache_ttl = shared_config.get("ttl", 3600)
+            self.shared_cache_fallback_ttl = shared_config.get("fallback_ttl", 30)
+            self.shared_cache_claim_wait = shared_config.get("claim_wait_ms", 2000) / 1000
+            breaker_sync = shared_config.get("circuit_breaker_sync", 1)
+            if self.circuit_breaker is not None and breaker_sync:
+                api.looping_background_call(
+                    self._sync_circuit_breaker, breaker_sync * 1000, run_on_all_instances=True
+                )
+        else:
+            self.shared_cache = None
         
+        # Per-sender token buckets and a global cap on API maskings in
+        # progress; messages over either limit are masked by the rules only
+        admission_config = config.get("admission", {})
+        if admission_config.get("enabled", True):
+            self.admission = AdmissionController(
+                max_concurrent=admission_config.get("max_concurrent", 50),
+                sender_rate=admission_config.get("sender_rate", 5),
+                sender_burst=admission_config.get("sender_burst", 20),
+                max_senders=admission_config.get("max_senders", 10000),
+            )
+        else:
+            self.admission = None
+
+        # Opt-in post-send mode: messages that pass the inline rule check are
+        # accepted at once and masked with the API afterwards, by editing or
+        # redacting them if needed
+        deferred_config = config.get("deferred", {})
+        if deferred_config.get("enabled", False):
+            self.deferred_action = deferred_config.get("action", "edit")
+            if self.deferred_action not in ("edit", "redact"):
+                logger.error(f"Unknown deferred.action: {self.deferred_action}")
+                raise ValueError(f"Unknown deferred.action: {self.deferred_action}")
+            self.post_send_queue = PostSendQueue(
+                api,
+                self._mask_after_send,
+                max_size=deferred_config.get("queue_size", 1000),
+                workers=deferred_config.get("workers", 4),
+            )
+            # (room, sender, edited event, body) of the edits being sent by
+            # _mask_after_send, which come back through check_event_allowed
+            self._own_edits: Set[Tuple[str, str, str, str]] = set()
+        else:
+            self.post_send_queue = None
+
+        # Original and masked text of recent messages, by event ID, so that
+        # edits only re-scan what changed. Masked messages are rebuilt with a
+        # new ID, so their entry waits in pending_edit_bases until
+        # on_new_event reports the persisted ID.
+        edits_config = config.get("edits", {})
+        if edits_config.get("enabled", True):
+            self.edit_bases = ResultCache(
+                max_entries=edits_config.get("max_entries", 10000),
+                max_bytes=edits_config.get("max_bytes", 32 * 1024 * 1024),
+                ttl=edits_config.get("ttl", 3600),
+            )
+            self.pending_edit_bases = ResultCache(max_entries=1000, ttl=60)
+            self.edit_margin = edits_config.get("margin", 32)
+            self.edit_rules_only_chars = edits_config.get("max_rules_only_chars", 64)
+        else:
+            self.edit_bases = None
+
+        # Pick up a recompiled lexicon file without a restart
+        reload_interval = lexicon_config.get("reload_interval", 30)
+        if isinstance(self.word_matcher, LexiconMatcher) and reload_interval:
+            api.looping_background_call(
+                self._reload_lexicon, reload_interval * 1000, run_on_all_instances=True
+            )
+
+        # Slowest recent on_event calls with per-stage timings, and an on-demand
+        # profiler, behind an admin-only endpoint
+        diagnostics_config = config.get("diagnostics", {})
+        if diagnostics_config.get("enabled", True):
+            self.slow_calls = SlowCallLog(
+                capacity=diagnostics_config.get("capacity", 100),
+                threshold=diagnostics_config.get("slow_threshold_ms", 100) / 1000,
+            )
+            profiler.interval = diagnostics_config.get("profiler_interval_ms", 5) / 1000
+            profiler.max_seconds = diagnostics_config.get("profiler_max_seconds", 60)
+            api.register_web_resource(
+                diagnostics_config.get("path", "/_synapse/client/text_masker/diagnostics"),
+                DiagnosticsResource(api, self.slow_calls),
+            )
+        else:
+            self.slow_calls = None
+
         # Register the event handler
         api.register_third_party_rules_callbacks(
-            check_event_allowed=self.on_event
+            check_event_allowed=self.on_event,
+            on_new_event=(
+                self.on_new_event if self.edit_bases is not None or self.room_policies is not None else None
+            ),
         )
         logger.info("TextMasker module initialized successfully")
 
+    @property
+    def abusive_words(self) -> List[str]:
+        return self.word_matcher.words
+
+    def _masking_fingerprint(self) -> str:
+        """Digest of everything cached results depend on."""
+        digest = hashlib.sha256(self.mask_api_url.encode('utf-8'))
+        digest.update(b'\0' + self.word_matcher.fingerprint.encode('ascii'))
+        for name, rules in sorted(self.profile_rules.items()):
+            digest.update(f"\0{name}={rules.word_matcher.fingerprint}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def update_abusive_words(self, words: List[str]) -> None:
+        """Swap in a new abusive-word list and drop results masked with the old one."""
+        self._use_word_matcher(WordMatcher(words, normalize=self.normalize_obfuscation))
+
+    def _reload_lexicon(self) -> None:
+        """Map the lexicon file again if it has been replaced since it was loaded."""
+        matcher = self.word_matcher
+        if not isinstance(matcher, LexiconMatcher) or not lexicon_changed(matcher):
+            return
+        try:
+            new_matcher = LexiconMatcher(matcher.path)
+        except Exception as e:
+            logger.error(f"Failed to reload lexicon {matcher.path}: {e}")
+            return
+        self._use_word_matcher(new_matcher)
+
+    def _use_word_matcher(self, matcher) -> None:
+        # Scans already running keep the old matcher until they finish
+        self.word_matcher = matcher
+        self.rules = RuleEngine(matcher)
+        if self.offloader is not None:
+            self.offloader.update_engine(self.rules)
+        if self.cache is not None:
+            self.cache.set_fingerprint(self._masking_fingerprint())
+        if self.shared_cache is not None:
+            self.shared_cache.set_fingerprint(self._masking_fingerprint())
+        logger.info(f"Loaded {len(matcher)} abusive words")
+
+    def update_mask_api_url(self, url: str) -> None:
+        """Point the API client at a new URL and drop results from the old one."""
+        self.mask_api_url = url
+        self.client.url = url
+        if self.cache is not None:
+            self.cache.set_fingerprint(self._masking_fingerprint())
+        if self.shared_cache is not None:
+            self.shared_cache.set_fingerprint(self._masking_fingerprint())
+        logger.info(f"Using masking API at: {self.mask_api_url}")
+
     def mask_phone_number(self, text: str) -> str:
         """Mask phone numbers in the text."""
-        logger.debug(f"Masking phone numbers in text: {text[:50]}...")
-        
-        def mask_phone(match):
-            phone = match.group(0)
-            # Keep first 3 and last 4 digits, mask the rest
-            # Handle international format
-            if phone.startswith('+'):
-                country_code = phone[:4]  # Keep country code
-                number = phone[4:]
-                return country_code + '*' * (len(number) - 4) + number[-4:]
-            else:
-                return phone[:3] + '*' * (len(phone) - 7) + phone[-4:]
-        
-        masked_text = self.phone_pattern.sub(mask_phone, text)
-        logger.debug(f"Phone numbers masked: {masked_text[:50]}...")
-        return masked_text
+        return self.rules.mask(text, (PHONE,))
 
     def mask_email(self, text: str) -> str:
         """Mask email addresses in the text."""
-        logger.debug(f"Masking email addresses in text: {text[:50]}...")
-        
-        def mask_email(match):
-            email = match.group(0)
-            # Split into local part and domain
-            local_part, domain = email.split('@')
-            
-            # Handle quoted strings in local part
-            if local_part.startswith('"') and local_part.endswith('"'):
-                # Keep first and last character of quoted string
-                masked_local = local_part[0] + '*' * (len(local_part) - 2) + local_part[-1]
-            else:
-                # For standard emails, keep first and last character
-                if len(local_part) > 2:
-                    masked_local = local_part[0] + '*' * (len(local_part) - 2) + local_part[-1]
-                else:
-                    masked_local = local_part[0] + '*'  # For very short local parts
-            
-            # Mask domain part
-            domain_parts = domain.split('.')
-            if len(domain_parts) > 1:
-                # Keep first and last part of domain
-                masked_domain = domain_parts[0][0] + '*' * (len(domain_parts[0]) - 1)
-                for part in domain_parts[1:-1]:
-                    masked_domain += '.' + part[0] + '*' * (len(part) - 1)
-                masked_domain += '.' + domain_parts[-1]  # Keep TLD as is
-            else:
-                masked_domain = domain[0] + '*' * (len(domain) - 1)
-            
-            return f"{masked_local}@{masked_domain}"
-        
-        masked_text = self.email_pattern.sub(mask_email, text)
-        logger.debug(f"Email addresses masked: {masked_text[:50]}...")
-        return masked_text
+        return self.rules.mask(text, (EMAIL,))
 
     def mask_abusive_words(self, text: str) -> str:
         """Mask abusive words in the text."""
-        logger.debug(f"Masking abusive words in text: {text[:50]}...")
-        def mask_word(match):
-            word = match.group(0)
-            return '*' * len(word)
-        
-        masked_text = re.sub(self.abusive_pattern, mask_word, text, flags=re.IGNORECASE)
-        logger.debug(f"Abusive words masked: {masked_text[:50]}...")
-        return masked_text
+        return self.rules.mask(text, (ABUSIVE,))
 
-    def mask_text_by_rules(self, text: str) -> str:
-        """Apply all masking rules to the text."""
+    def _rules_for(self, policy: RoomPolicy) -> RuleEngine:
+        return self.profile_rules[policy.profile] if policy.profile else self.rules
+
+    def mask_text_by_rules(self, text: str, policy: RoomPolicy = DEFAULT_POLICY) -> str:
+        """Apply all masking rules (those of ``policy``) to the text in a single pass."""
         if not text:
-            logger.debug("Empty text received, nothing to mask")
             return text
-            
-        logger.info(f"Starting text masking process for text: {text[:50]}...")
-        masked_text = text
-        masked_text = self.mask_phone_number(masked_text)
-        masked_text = self.mask_email(masked_text)
-        masked_text = self.mask_abusive_words(masked_text)
-        logger.info(f"Text masking completed. Original length: {len(text)}, Masked length: {len(masked_text)}")
+
+        with metrics.rules_seconds.time():
+            spans = self._rules_for(policy).find_spans(text, policy.categories)
+            masked_text = apply_spans(text, spans)
+        self._count_masks(spans)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Rule-based masking completed. Original length: {len(text)}, Masked length: {len(masked_text)}")
         return masked_text
 
-    async def _make_request(self, text: str) -> str:
-        """Make the HTTP request to the masking API."""
-        try:
-            # Create form data
-            files = {'query': (None, text)}
-            
-            logger.debug(f"Making request to {self.mask_api_url} with data: {text[:50]}...")
-            
-            # Make the request using requests
-            response = self.session.post(
-                self.mask_api_url,
-                files=files,
-                headers={
-                    'Accept': '*/*',
-                    'User-Agent': 'Matrix-Synapse/1.0'
-                },
-                timeout=self.timeout
-            )
-            
-            logger.debug(f"Received response with status code: {response.status_code}")
-            
-            if response.status_code == 200:
-                content = response.text
-                logger.debug(f"Received content: {content[:100]}...")
-                return content
+    async def _mask_text_by_rules_offloaded(self, text: str, policy: RoomPolicy = DEFAULT_POLICY) -> str:
+        """Like mask_text_by_rules, but keeps large bodies off the reactor thread."""
+        if not text or self.offloader is None:
+            return self.mask_text_by_rules(text, policy)
+        with metrics.rules_seconds.time(), stage("rules"):
+            spans = await self.offloader.find_spans(text, policy.categories, self._rules_for(policy))
+            masked_text = apply_spans(text, spans)
+        self._count_masks(spans)
+        return masked_text
+
+    async def _mask_formatted(self, content: Dict[str, Any], policy: RoomPolicy = DEFAULT_POLICY) -> Optional[str]:
+        """Mask the HTML formatted_body of ``content`` with the rules.
+
+        Returns None if there is no formatted_body or nothing in it was masked.
+        """
+        formatted_body = content.get("formatted_body")
+        if (
+            not self.mask_formatted_body
+            or content.get("format") != HTML_FORMAT
+            or not isinstance(formatted_body, str)
+            or not formatted_body
+        ):
+            return None
+        with metrics.rules_seconds.time(), stage("formatted_body"):
+            rules = self._rules_for(policy)
+            if self.offloader is not None:
+                # Large bodies are tokenized and rebuilt in the pool too
+                size = len(formatted_body)
+                document = await self.offloader.call(size, FormattedBody, formatted_body)
+                spans = await self.offloader.find_spans(document.text, policy.categories, rules)
+                masked = await self.offloader.call(size, document.apply, spans)
             else:
-                logger.error(f"API request failed with status {response.status_code}. Response: {response.text}")
-                return text
-        except requests.Timeout:
-            logger.error(f"API request timed out after {self.timeout} seconds")
-            return text
-        except requests.RequestException as e:
-            logger.error(f"Failed to connect to masking API at {self.mask_api_url}: {str(e)}")
-            return text
+                document = FormattedBody(formatted_body)
+                spans = rules.find_spans(document.text, policy.categories)
+                masked = document.apply(spans)
+        self._count_masks(spans)
+        return masked if masked != formatted_body else None
+
+    @staticmethod
+    def _count_masks(spans: List[Span]) -> None:
+        for _, _, category in spans:
+            metrics.masks_applied_counter.labels(category).inc()
+
+    async def _make_request(self, text: str) -> Optional[str]:
+        """Make the HTTP request to the masking API; None if it failed."""
+        breaker = self.circuit_breaker
+        timeout = breaker.current_timeout() if breaker else self.timeout
+        timed_out = None
+        start = time.monotonic()
+        try:
+            logger.debug("Making request to %s for %d characters", self.mask_api_url, len(text))
+            requester = self.batcher or self.client
+            with stage("api"):
+                content = await requester.mask(text, timeout=timeout)
+            elapsed = time.monotonic() - start
+            metrics.api_request_seconds.observe(elapsed)
+            metrics.api_requests_counter.labels("success").inc()
+            if breaker:
+                breaker.record_success(elapsed)
+            return content
+        except MaskingApiTimeout:
+            logger.error(f"API request timed out after {timeout} seconds")
+            metrics.api_requests_counter.labels("timeout").inc()
+            timed_out = timeout
+        except MaskingApiError as e:
+            logger.error(str(e))
+            metrics.api_requests_counter.labels("error").inc()
         except Exception as e:
             logger.error(f"Error in HTTP request: {str(e)}", exc_info=True)
-            return text
+            metrics.api_requests_counter.labels("error").inc()
+        metrics.api_request_seconds.observe(time.monotonic() - start)
+        if breaker:
+            breaker.record_failure(timed_out)
+            if self.shared_cache is not None and breaker.state == CircuitBreaker.OPEN:
+                self._publish_circuit_open()
+        return None
+
+    def _circuit_state_name(self) -> str:
+        return "circuit:" + hashlib.sha256(self.mask_api_url.encode('utf-8')).hexdigest()[:16]
+
+    def _publish_circuit_open(self) -> None:
+        """Tell the other workers that the API circuit is open, and until when."""
+        remaining = self.circuit_breaker.open_remaining()
+        if remaining > 0:
+            self.shared_cache.set_state(self._circuit_state_name(), str(time.time() + remaining), remaining)
+
+    async def _sync_circuit_breaker(self) -> None:
+        """Open the local circuit while another worker has it open."""
+        if self.circuit_breaker.state != CircuitBreaker.CLOSED:
+            return
+        open_until = await self.shared_cache.get_state(self._circuit_state_name())
+        if open_until is None:
+            return
+        remaining = float(open_until) - time.time()
+        if remaining > 0:
+            logger.warning(f"Masking API circuit is open on another worker, opening it here for {remaining:.1f}s")
+            self.circuit_breaker.trip(remaining)
+
+    async def mask_text(self, text: str, sender: Optional[str] = None, policy: RoomPolicy = DEFAULT_POLICY) -> str:
+        """Apply masking using external API, fall back to rule-based masking if API fails.
 
-    async def mask_text(self, text: str) -> str:
-        """Apply masking using external API, fall back to rule-based masking if API fails."""
+        With a ``sender`` the call is subject to admission control and may be
+        masked by the rules alone under load. A room ``policy`` can restrict
+        the rules or keep the text away from the API.
+        """
         if not text:
-            logger.debug("Empty text received, nothing to mask")
             return text
-            
-        logger.info(f"Starting text masking process for text: {text[:50]}...")
+
+        if self.cache is not None or self.shared_cache is not None:
+            data = text.encode('utf-8')
+            if policy != DEFAULT_POLICY:
+                data = policy.cache_tag + data
+            key = hashlib.blake2b(data, digest_size=16).digest()
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.cache_lookups_counter.labels("hit").inc()
+                return cached
+            metrics.cache_lookups_counter.labels("miss").inc()
+
+        # Shared entries are prefixed with "1" if the API masked them, "0" if the rules did
+        if self.shared_cache is not None:
+            with stage("shared_cache"):
+                shared = await self.shared_cache.get(key)
+            if shared is not None:
+                metrics.cache_lookups_counter.labels("shared_hit").inc()
+                masked_text = shared[1:]
+                if self.cache is not None:
+                    self.cache.set(key, masked_text, ttl=None if shared[0] == "1" else self.cache_fallback_ttl)
+                return masked_text
+            metrics.cache_lookups_counter.labels("shared_miss").inc()
+
+            # Another worker is already masking the same text: use its result
+            with stage("shared_cache"):
+                claimed = await self.shared_cache.claim(key, self.shared_cache_claim_wait)
+            if not claimed:
+                with stage("shared_cache_wait"):
+                    shared = await self.shared_cache.wait(key, self.shared_cache_claim_wait)
+                if shared is not None:
+                    metrics.cache_lookups_counter.labels("shared_wait_hit").inc()
+                    masked_text = shared[1:]
+                    if self.cache is not None:
+                        self.cache.set(key, masked_text, ttl=None if shared[0] == "1" else self.cache_fallback_ttl)
+                    return masked_text
+                metrics.cache_lookups_counter.labels("shared_wait_miss").inc()
+
+        masked_text, via_api = await self._mask_text_uncached(text, sender, policy)
+
+        if self.cache is not None:
+            self.cache.set(key, masked_text, ttl=None if via_api else self.cache_fallback_ttl)
+        if self.shared_cache is not None:
+            self.shared_cache.set(
+                key,
+                ("1" if via_api else "0") + masked_text,
+                self.shared_cache_ttl if via_api else self.shared_cache_fallback_ttl,
+            )
+        return masked_text
+
+    async def _mask_text_uncached(
+        self, text: str, sender: Optional[str] = None, policy: RoomPolicy = DEFAULT_POLICY
+    ) -> Tuple[str, bool]:
+        """Mask ``text`` and report whether the API (rather than the rules) did it."""
+        if not policy.api:
+            return await self._mask_text_by_rules_offloaded(text, policy), False
+
+        admission = self.admission
+        if admission is None or sender is None:
+            return await self._mask_text_admitted(text, policy)
+
+        reason = admission.try_acquire(sender)
+        if reason is not None:
+            logger.debug("Shedding API masking for %s (%s), using rule-based masking", sender, reason)
+            metrics.shed_counter.labels(reason).inc()
+            metrics.fallbacks_counter.labels("shed").inc()
+            return await self._mask_text_by_rules_offloaded(text, policy), False
+        try:
+            return await self._mask_text_admitted(text, policy)
+        finally:
+            admission.release()
+
+    async def _mask_text_admitted(self, text: str, policy: RoomPolicy = DEFAULT_POLICY) -> Tuple[str, bool]:
+        if self.circuit_breaker and not self.circuit_breaker.allow_request():
+            logger.debug("Masking API circuit is open, using rule-based masking")
+            metrics.fallbacks_counter.labels("circuit_open").inc()
+            return await self._mask_text_by_rules_offloaded(text, policy), False
         
         try:
             masked_text = await self._make_request(text)
-            
-            # If API request failed (returned original text), fall back to rule-based masking
-            if masked_text == text:
-                logger.warning("API request failed or returned unchanged text, falling back to rule-based masking")
-                masked_text = self.mask_text_by_rules(text)
-                logger.info("Successfully applied rule-based masking as fallback")
-            else:
-                logger.info("Successfully applied API-based masking")
-                
-            logger.info(f"Text masking completed. Original length: {len(text)}, Masked length: {len(masked_text)}")
-            return masked_text
+
+            # If the API failed or found nothing, the rules still get a go at the text
+            if masked_text is None:
+                logger.warning("API request failed, falling back to rule-based masking")
+                metrics.fallbacks_counter.labels("api_failure").inc()
+            elif masked_text == text:
+                # Most clean messages end up here, so this stays off the warning log
+                logger.debug("API returned the text unchanged, applying rule-based masking")
+                metrics.fallbacks_counter.labels("api_unchanged").inc()
+            via_api = masked_text is not None and masked_text != text
+            if not via_api:
+                masked_text = await self._mask_text_by_rules_offloaded(text, policy)
+
+            logger.debug(
+                "Text masked by the %s. Original length: %d, Masked length: %d",
+                "API" if via_api else "rules", len(text), len(masked_text),
+            )
+            return masked_text, via_api
                     
         except Exception as e:
             logger.error(f"Error in text masking API call: {str(e)}", exc_info=True)
             logger.warning("Falling back to rule-based masking due to API error")
-            masked_text = self.mask_text_by_rules(text)
-            logger.info("Successfully applied rule-based masking as fallback")
+            metrics.fallbacks_counter.labels("error").inc()
+            masked_text = await self._mask_text_by_rules_offloaded(text, policy)
+            return masked_text, False
+
+    async def _mask_before_send(
+        self,
+        event: EventBase,
+        text: str,
+        target_id: Optional[str] = None,
+        policy: RoomPolicy = DEFAULT_POLICY,
+    ) -> str:
+        """Mask ``text`` with the rules only, queueing API masking for later.
+
+        If the rules change nothing, the event is queued for the API and sent
+        as is; a later edit, if needed, replaces ``target_id`` (by default the
+        event itself). When the queue is full the API is called inline as usual.
+        Without a ``target_id``, only call this when nothing else in the event
+        is rewritten: a rebuilt event no longer has the queued ID.
+        """
+        masked_text = await self._mask_text_by_rules_offloaded(text, policy)
+        # Trailing whitespace is trimmed from every masked body, so it doesn't count as a change
+        if masked_text.rstrip() != text.rstrip() or not text or not policy.api or self._is_own_edit(event, text):
             return masked_text
+        try:
+            self.post_send_queue.submit((target_id or event.event_id, event.room_id, event.sender, text, policy))
+        except QueueFull:
+            logger.warning("Post-send queue is full, masking inline")
+            metrics.post_send_counter.labels("inline_queue_full").inc()
+            return await self.mask_text(text, event.sender, policy)
+        return text
+
+    def _is_own_edit(self, event: EventBase, text: str) -> bool:
+        """Whether ``event`` is a masked edit being sent by :meth:`_mask_after_send`.
+
+        Clients can set ``m.notice`` too, so it is not trusted on its own.
+        """
+        relates_to = event.content.get("m.relates_to")
+        if (
+            event.content.get("m.notice") != MASKED_NOTICE
+            or not isinstance(relates_to, dict)
+            or relates_to.get("rel_type") != "m.replace"
+        ):
+            return False
+        return (event.room_id, event.sender, relates_to.get("event_id"), text) in self._own_edits
+
+    async def _mask_after_send(self, item: Tuple[str, str, str, str, RoomPolicy]) -> None:
+        """Mask an already accepted message and edit or redact it if needed."""
+        event_id, room_id, sender, text, policy = item
+        masked_text = (await self.mask_text(text, policy=policy)).rstrip()
+        if masked_text == text.rstrip():
+            metrics.post_send_counter.labels("unchanged").inc()
+            return
+
+        if self.deferred_action == "redact":
+            await self.api.create_and_send_event_into_room({
+                "type": "m.room.redaction",
+                "room_id": room_id,
+                "sender": sender,
+                "redacts": event_id,
+                "content": {"redacts": event_id, "reason": MASKED_NOTICE},
+            })
+            logger.info(f"Redacted {event_id} after masking")
+            metrics.post_send_counter.labels("redacted").inc()
+            return
+
+        new_content = {"msgtype": "m.text", "body": masked_text}
+        own_edit = (room_id, sender, event_id, masked_text)
+        self._own_edits.add(own_edit)
+        try:
+            await self.api.create_and_send_event_into_room({
+                "type": "m.room.message",
+                "room_id": room_id,
+                "sender": sender,
+                "content": {
+                    "msgtype": "m.text",
+                    "body": f"* {masked_text}",
+                    "m.new_content": new_content,
+                    "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
+                    "m.notice": MASKED_NOTICE,
+                },
+            })
+        finally:
+            self._own_edits.discard(own_edit)
+        logger.info(f"Replaced {event_id} with a masked edit")
+        metrics.post_send_counter.labels("edited").inc()
+
+    async def _mask_message(self, event: EventBase, policy: RoomPolicy = DEFAULT_POLICY) -> Optional[Dict[str, Any]]:
+        """Mask the body of a new message; return the new content, or None if unchanged."""
+        original_content = event.content.get("body", "")
+        masked_formatted = await self._mask_formatted(event.content, policy)
+        # A rewritten formatted_body gives the event a new ID, which a later
+        # edit from the post-send queue couldn't target, so mask inline then
+        if self.post_send_queue is not None and masked_formatted is None:
+            masked_content = await self._mask_before_send(event, original_content, policy=policy)
+        else:
+            masked_content = await self.mask_text(original_content, event.sender, policy)
+        # Trim any trailing newlines from the masked content
+        masked_content = masked_content.rstrip()
+
+        if masked_content == original_content.rstrip() and masked_formatted is None:
+            logger.debug("No sensitive content found, event unchanged")
+            if self.edit_bases is not None:
+                self.edit_bases.set(event.event_id, (original_content, original_content))
+            return None
+
+        logger.debug("Content of %s was modified, creating new event", event.event_id)
+        if self.edit_bases is not None:
+            # The rebuilt event gets a new ID; on_new_event files this under it
+            self.pending_edit_bases.set(
+                (event.room_id, event.sender, masked_content), (original_content, masked_content)
+            )
+        # Create a new content dictionary that preserves all original fields
+        new_content = dict(event.content)
+        new_content["body"] = masked_content
+        if masked_formatted is not None:
+            new_content["formatted_body"] = masked_formatted
+        new_content["m.notice"] = MASKED_NOTICE
+        return new_content
+
+    async def _mask_edit(self, event: EventBase, policy: RoomPolicy = DEFAULT_POLICY) -> Optional[Dict[str, Any]]:
+        """Mask an edit, re-scanning only what changed since the previous version.
+
+        Returns the new content, or None if the edit needs no masking.
+        """
+        target_id = event.content["m.relates_to"].get("event_id")
+        new_body = event.content["m.new_content"].get("body", "")
+        base = self.edit_bases.get(target_id) if target_id else None
+
+        window = None
+        if base is not None and len(base[0]) == len(base[1]):
+            window = diff_window(base[0], new_body, base[1], self.edit_margin)
+
+        if window is not None and window.changed <= self.edit_rules_only_chars:
+            # The window reaches out to whitespace, so it can still be most
+            # of a long body; large windows are scanned off the reactor
+            masked_window = await self._mask_text_by_rules_offloaded(new_body[window.start:window.new_end], policy)
+            masked_body = splice(base[1], window, masked_window)
+            metrics.edits_counter.labels("unchanged" if window.changed == 0 else "incremental").inc()
+        else:
+            if self.post_send_queue is not None:
+                masked_body = await self._mask_before_send(event, new_body, target_id, policy)
+            else:
+                masked_body = await self.mask_text(new_body, event.sender, policy)
+            metrics.edits_counter.labels("full").inc()
+        masked_body = masked_body.rstrip()
+        if target_id:
+            self.edit_bases.set(target_id, (new_body, masked_body))
+
+        # The fallback body is usually "* " followed by the new text
+        body = event.content.get("body", "")
+        if body == f"* {new_body}":
+            masked_fallback = f"* {masked_body}"
+        else:
+            masked_fallback = (await self.mask_text(body, event.sender, policy)).rstrip()
+
+        masked_formatted = await self._mask_formatted(event.content["m.new_content"], policy)
+        masked_fallback_formatted = await self._mask_formatted(event.content, policy)
+
+        if (
+            masked_body == new_body.rstrip()
+            and masked_fallback == body.rstrip()
+            and masked_formatted is None
+            and masked_fallback_formatted is None
+        ):
+            logger.debug("No sensitive content found in edit, event unchanged")
+            return None
+
+        logger.debug("Edit of %s was modified, creating new event", target_id)
+        new_content = dict(event.content)
+        new_content["m.new_content"] = dict(event.content["m.new_content"], body=masked_body)
+        if masked_formatted is not None:
+            new_content["m.new_content"]["formatted_body"] = masked_formatted
+        if masked_fallback_formatted is not None:
+            new_content["formatted_body"] = masked_fallback_formatted
+        new_content["body"] = masked_fallback
+        new_content["m.notice"] = MASKED_NOTICE
+        return new_content
+
+    async def on_new_event(self, event: EventBase, state_events) -> None:
+        """Drop the cached policy of rooms whose policy changed, and record
+        the persisted ID of messages that were masked before sending."""
+        if self.room_policies is not None and event.type == self.room_policies.event_type:
+            if event.get_state_key() == "":
+                self.room_policies.invalidate(event.room_id)
+            return
+        if (
+            self.edit_bases is None
+            or event.type != "m.room.message"
+            or event.content.get("m.notice") != MASKED_NOTICE
+        ):
+            return
+        key = (event.room_id, event.sender, event.content.get("body"))
+        base = self.pending_edit_bases.get(key)
+        if base is not None:
+            self.pending_edit_bases.invalidate(key)
+            self.edit_bases.set(event.event_id, base)
 
     async def on_event(self, event: EventBase, state) -> Tuple[bool, Optional[Dict[str, Any]]]:
         """
@@ -267,51 +801,66 @@ class TextMasker:
             - allowed: bool indicating whether the event should be allowed
             - new_content: dict containing the new event content, or None if unchanged
         """
+        # Exempt rooms are let through before any other work
+        policy = DEFAULT_POLICY
+        if self.room_policies is not None:
+            policy = await self.room_policies.resolve(event.room_id, state)
+            if not policy.enabled:
+                metrics.room_policy_skips_counter.inc()
+                return True, None
+
+        trace = self.slow_calls.start("on_event") if self.slow_calls is not None else None
+        new_event = None
+        try:
+            with metrics.on_event_seconds.time():
+                allowed, new_event = await self._on_event(event, state, policy)
+            return allowed, new_event
+        finally:
+            if trace is not None:
+                body = event.content.get("body")
+                self.slow_calls.finish(
+                    trace,
+                    body=body if isinstance(body, str) else None,
+                    event_id=event.event_id,
+                    room_id=event.room_id,
+                    sender=event.sender,
+                    type=event.type,
+                    masked=new_event is not None,
+                )
+
+    async def _on_event(
+        self, event: EventBase, state, policy: RoomPolicy = DEFAULT_POLICY
+    ) -> Tuple[bool, Optional[Dict[str, Any]]]:
         try:
-            logger.info(f"Processing event: {event.event_id} of type {event.type}")
-            
             if event.type == "m.room.message" and event.content.get("msgtype") == "m.text":
-                logger.debug("Event is a text message, checking for sensitive content")
-                original_content = event.content.get("body", "")
-                logger.debug(f"Original content: {original_content[:50]}...")
-                
-                # Log the start of masking process
-                logger.info(f"Starting text masking process for text: {original_content[:50]}...")
-                masked_content = await self.mask_text(original_content)
-                # Trim any trailing newlines from the masked content
-                masked_content = masked_content.rstrip()
-                logger.debug(f"Masked content after trimming: {masked_content[:50]}...")
-                
+                if self.edit_bases is not None and is_edit(event.content):
+                    new_content = await self._mask_edit(event, policy)
+                else:
+                    new_content = await self._mask_message(event, policy)
+
                 # Only modify the event if masking was applied
-                if masked_content != original_content:
-                    logger.info("Content was modified, creating new event")
-                    # Create a new content dictionary that preserves all original fields
-                    new_content = dict(event.content)
-                    logger.debug(f"Original event content: {event.content}")
-                    
-                    new_content["body"] = masked_content
-                    new_content["m.notice"] = "Some content has been masked for privacy and safety."
-                    logger.debug(f"New content after modification: {new_content}")
-                    
+                if new_content is not None:
                     # Create a new event dictionary with all original fields
                     try:
-                        new_event = {
-                            "type": event.type,
-                            "room_id": event.room_id,
-                            "sender": event.sender,
-                            "content": new_content,
-                            "origin_server_ts": event.origin_server_ts,
-                            "unsigned": event.unsigned,
-                            "event_id": event.event_id,
-                            "prev_event_ids": event.prev_event_ids,
-                            "auth_event_ids": event.auth_event_ids,
-                            "depth": event.depth,
-                            "hashes": event.hashes,
-                            "signatures": event.signatures
-                        }
-                        
-                        logger.info(f"Successfully created new event for {event.event_id}")
-                        logger.debug(f"Full new event structure: {new_event}")
+                        with stage("rebuild"):
+                            new_event = {
+                                "type": event.type,
+                                "room_id": event.room_id,
+                                "sender": event.sender,
+                                "content": new_content,
+                                "origin_server_ts": event.origin_server_ts,
+                                "unsigned": event.unsigned,
+                                "event_id": event.event_id,
+                                "prev_event_ids": event.prev_event_ids,
+                                "auth_event_ids": event.auth_event_ids,
+                                "depth": event.depth,
+                                "hashes": event.hashes,
+                                "signatures": event.signatures
+                            }
+
+                        logger.debug("Created new event for %s", event.event_id)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"Full new event structure: {new_event}")
                         return True, new_event
                     except AttributeError as e:
                         logger.error(f"Error accessing event attribute: {str(e)}")
@@ -323,13 +872,8 @@ class TextMasker:
                             "sender": event.sender,
                             "content": new_content
                         }
-                        logger.debug(f"Minimal event structure: {minimal_event}")
                         return True, minimal_event
-                else:
-                    logger.debug("No sensitive content found, event unchanged")
-            else:
-                logger.debug(f"Event type {event.type} not handled, skipping")
-            
+
             # If no masking was needed, return None to indicate no changes
             return True, None
             
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from synapse.logging.context import make_deferred_yieldable
+from synapse.module_api import ModuleApi
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, readBody
+from twisted.web.http_headers import Headers
+
+from .result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Public keys Firebase signs ID tokens with, as {kid: PEM certificate}
+GOOGLE_KEYS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class TokenVerificationError(Exception):
+    """The ID token is malformed, badly signed or has the wrong claims."""
+
+
+class ExpiredTokenError(TokenVerificationError):
+    """The ID token's ``exp`` has passed."""
+
+
+def load_public_keys(keys: Dict[str, str]) -> Dict[str, Any]:
+    """Parse a ``{kid: PEM}`` mapping of X.509 certificates or public keys."""
+    parsed = {}
+    for kid, pem in keys.items():
+        data = pem.encode('ascii')
+        if b'BEGIN CERTIFICATE' in data:
+            parsed[kid] = x509.load_pem_x509_certificate(data).public_key()
+        else:
+            parsed[kid] = load_pem_public_key(data)
+    return parsed
+
+
+class FirebaseTokenVerifier:
+    """Verify Firebase ID tokens locally against Google's public keys.
+
+    Tokens are checked for an RS256 signature by a known key and for ``aud``,
+    ``iss``, ``exp``, ``iat`` and ``sub`` as Firebase documents them. The key
+    set is fetched from ``keys_url`` and refreshed in the background when its
+    ``Cache-Control: max-age`` runs out; a token signed with an unknown
+    ``kid`` triggers an early refresh, at most once per
+    ``min_refresh_interval``. A fetch is abandoned after ``fetch_timeout``
+    seconds. With ``keys_file`` the keys are read from a
+    local ``{kid: PEM}`` file instead and never refreshed.
+
+    Verified claims are cached by token hash until the token expires, so
+    retries of the same login skip the RSA check.
+    """
+
+    def __init__(
+        self,
+        api: ModuleApi,
+        project_id: str,
+        keys_url: str = GOOGLE_KEYS_URL,
+        keys_file: Optional[str] = None,
+        leeway: float = 60,
+        refresh_margin: float = 300,
+        min_refresh_interval: float = 60,
+        cache_max_entries: int = 10000,
+        fetch_timeout: float = 10,
+        clock: Callable[[], float] = time.time,
+        reactor=None,
+    ):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._api = api
+        self._clock = clock
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.keys_url = keys_url
+        self.keys_file = keys_file
+        self.leeway = leeway
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+
+        self._keys: Dict[str, Any] = {}
+        self._last_refresh = 0.0
+        self._waiters: Optional[List[defer.Deferred]] = None
+        self._refresh_call = None
+        self._agent = Agent(reactor, connectTimeout=fetch_timeout)
+        self.cache = ResultCache(max_entries=cache_max_entries, ttl=0)
+
+        if keys_file:
+            with open(keys_file) as f:
+                self._keys = load_public_keys(json.load(f))
+            logger.info(f"Loaded {len(self._keys)} token signing keys from {keys_file}")
+
+    def start(self) -> None:
+        """Fetch the key set now and keep it fresh in the background."""
+        if not self.keys_file:
+            self._refresh_in_background()
+
+    def stop(self) -> None:
+        if self._refresh_call is not None and self._refresh_call.active():
+            self._refresh_call.cancel()
+        self._refresh_call = None
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """Return the claims of a valid ``token``.
+
+        Raises:
+            ExpiredTokenError: if the token has expired
+            TokenVerificationError: if the token is invalid for any other reason
+        """
+        key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        claims = self.cache.get(key)
+        if claims is not None:
+            return claims
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(f"Malformed token: {e}") from e
+        if header.get("alg") != "RS256":
+            raise TokenVerificationError(f"Unexpected token algorithm: {header.get('alg')}")
+        kid = header.get("kid")
+        public_key = self._keys.get(kid)
+        if public_key is None:
+            await self._refresh_for_unknown_kid()
+            public_key = self._keys.get(kid)
+            if public_key is None:
+                raise TokenVerificationError(f"Token signed with unknown key: {kid}")
+
+        claims = self._decode(token, public_key)
+        ttl = claims["exp"] - self._clock()
+        if ttl > 0:
+            self.cache.set(key, claims, ttl=ttl)
+        return claims
+
+    def _decode(self, token: str, public_key: Any) -> Dict[str, Any]:
+        try:
+            claims = jwt.decode(
+                token,
+                public_key,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={"require": ["exp", "iat", "aud", "iss", "sub"]},
+            )
+        except jwt.ExpiredSignatureError as e:
+            raise ExpiredTokenError("Token has expired") from e
+        except jwt.InvalidTokenError as e:
+            raise TokenVerificationError(str(e)) from e
+
+        sub = claims["sub"]
+        if not isinstance(sub, str) or not sub or len(sub) > 128:
+            raise TokenVerificationError("Token has an invalid sub claim")
+        auth_time = claims.get("auth_time")
+        if auth_time is not None and auth_time > self._clock() + self.leeway:
+            raise TokenVerificationError("Token auth_time is in the future")
+        return claims
+
+    async def _refresh_for_unknown_kid(self) -> None:
+        if self.keys_file:
+            return
+        if self._waiters is None and self._clock() - self._last_refresh < self.min_refresh_interval:
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Failed to refresh token signing keys: {e}")
+
+    async def refresh(self) -> None:
+        """Fetch the key set, sharing one request between concurrent callers."""
+        d = defer.Deferred()
+        if self._waiters is None:
+            self._waiters = [d]
+            self._api.run_as_background_process("firebase_auth_fetch_keys", self._fetch_for_waiters)
+        else:
+            self._waiters.append(d)
+        await make_deferred_yieldable(d)
+
+    async def _fetch_for_waiters(self) -> None:
+        # Runs as a background process, which swallows errors, so the
+        # outcome is handed to the waiters here
+        fetch = defer.ensureDeferred(self._fetch_keys())
+        fetch.addTimeout(self.fetch_timeout, self._reactor, onTimeoutCancel=self._on_fetch_timeout)
+        try:
+            await make_deferred_yieldable(fetch)
+        except Exception:
+            self._refresh_done(Failure())
+        else:
+            self._refresh_done(None)
+
+    def _on_fetch_timeout(self, result, timeout: float):
+        # Whatever the agent raised on cancellation, report a timeout
+        raise TokenVerificationError(f"No response from {self.keys_url} within {timeout} seconds")
+
+    def _refresh_done(self, result) -> None:
+        waiters, self._waiters = self._waiters, None
+        for d in waiters:
+            d.callback(result)
+
+    async def _fetch_keys(self) -> None:
+        self._last_refresh = self._clock()
+        response = await self._agent.request(
+            b'GET', self.keys_url.encode('ascii'), Headers({b'User-Agent': [b'Matrix-Synapse/1.0']})
+        )
+        content = await readBody(response)
+        if response.code != 200:
+            raise TokenVerificationError(f"Key fetch from {self.keys_url} failed with status {response.code}")
+        self._keys = load_public_keys(json.loads(content))
+
+        max_age = None
+        for value in response.headers.getRawHeaders(b'Cache-Control', []):
+            match = MAX_AGE_RE.search(value.decode('ascii', errors='replace'))
+            if match:
+                max_age = int(match.group(1))
+        delay = max(self.min_refresh_interval, (max_age or 3600) - self.refresh_margin)
+        self._schedule_refresh(delay)
+        logger.info(f"Loaded {len(self._keys)} token signing keys, next refresh in {delay:.0f}s")
+
+    def _schedule_refresh(self, delay: float) -> None:
+        self.stop()
+        self._refresh_call = self._reactor.callLater(delay, self._refresh_in_background)
+
+    def _refresh_in_background(self) -> None:
+        self._refresh_call = None
+        self._api.run_as_background_process("firebase_auth_refresh_keys", self._scheduled_refresh)
+
+    async def _scheduled_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh token signing keys: {e}")
+            self._schedule_refresh(self.min_refresh_interval)
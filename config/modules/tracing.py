@@ -0,0 +1,114 @@
+import hashlib
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+# Trace of the call being handled in the current coroutine, if it is traced
+_current: ContextVar[Optional["Trace"]] = ContextVar("masking_trace", default=None)
+
+# Per-process key, so that body hashes can't be checked against guessed texts
+_HASH_KEY = os.urandom(16)
+
+
+def hash_body(text: str) -> str:
+    """Keyed digest of a message body, to spot repeats without storing the text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8, key=_HASH_KEY).hexdigest()
+
+
+class Trace:
+    """Wall time of one call, split into the stages it went through."""
+
+    __slots__ = ("kind", "start", "stages", "_token")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class stage:
+    """Add the time spent in the ``with`` block to the current trace, if any.
+
+    Stages with the same name add up, and nested stages are counted in both.
+    """
+
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+class SlowCallLog:
+    """Ring buffer of recent calls that took at least ``threshold`` seconds.
+
+    :meth:`start` makes a trace current for the calling coroutine, so that
+    :class:`stage` blocks anywhere below it are timed; :meth:`finish` ends
+    it and keeps a record if the call was slow. Fast calls cost a context
+    variable update and a few clock reads, and nothing is formatted for them.
+    """
+
+    def __init__(self, capacity: int = 100, threshold: float = 0.1):
+        self.threshold = threshold
+        self._records: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self.calls = 0
+        self.slow_calls = 0
+
+    def start(self, kind: str) -> Trace:
+        trace = Trace(kind)
+        trace._token = _current.set(trace)
+        return trace
+
+    def finish(self, trace: Trace, body: Optional[str] = None, **details: Any) -> None:
+        """End ``trace``; ``body`` is only kept as its length and a hash."""
+        _current.reset(trace._token)
+        duration = time.perf_counter() - trace.start
+        self.calls += 1
+        if duration < self.threshold:
+            return
+        self.slow_calls += 1
+        record = {
+            "kind": trace.kind,
+            "ts": int(time.time() * 1000),
+            "duration_ms": round(duration * 1000, 3),
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in trace.stages.items()},
+        }
+        if body is not None:
+            details["body_length"] = len(body)
+            details["body_hash"] = hash_body(body)
+        record.update(details)
+        self._records.append(record)
+
+    def records(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The recorded calls, slowest first."""
+        records = sorted(self._records, key=lambda record: record["duration_ms"], reverse=True)
+        return records[:limit] if limit is not None else records
+
+    def clear(self) -> None:
+        self._records.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "slow_calls": self.slow_calls,
+            "recorded": len(self._records),
+            "capacity": self._records.maxlen,
+            "threshold_ms": self.threshold * 1000,
+        }
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+from . import normalizer
+
+logger = logging.getLogger(__name__)
+
+
+def fold_case(text: str) -> str:
+    """Lower-case text without changing its length.
+
+    ``str.lower`` expands a few characters (e.g. "İ"), which would shift every
+    offset after them, so those characters are kept as they are.
+    """
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def _is_word_char(c: str) -> bool:
+    # Same notion of a word character as the `\w` class used by `\b`
+    return c.isalnum() or c == '_'
+
+
+def select_spans(text: str, candidates: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Pick the leftmost-longest, non-overlapping word-bounded spans.
+
+    A span must not continue a word on either side: if its first (last)
+    character is a word character, the character before (after) it must not
+    be one. Terms that start or end with punctuation or emoji therefore match
+    next to any character, unlike a plain `\\b` anchor.
+    """
+    spans = []
+    length = len(text)
+    for start, end in candidates:
+        if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+            continue
+        if end < length and _is_word_char(text[end - 1]) and _is_word_char(text[end]):
+            continue
+        spans.append((start, end))
+
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    selected = []
+    last_end = 0
+    for start, end in spans:
+        if start >= last_end:
+            selected.append((start, end))
+            last_end = end
+    return selected
+
+
+class WordMatcher:
+    """Aho-Corasick automaton matching a word list in one pass over the text.
+
+    Scanning cost is linear in the length of the text plus the number of
+    matches, independent of how many words the matcher was built from.
+
+    With ``normalize`` the automaton is built from normalized terms and text
+    is normalized (see normalizer.normalize) before the scan, so obfuscated
+    spellings match too; spans are still reported on the original text.
+    """
+
+    def __init__(self, words: Iterable[str], normalize: bool = False):
+        self.words = []
+        self.normalize = normalize
+        # Per node: outgoing edges, failure link, length of the term ending
+        # here (0 if none) and the next node on the failure chain that ends a term
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._term_len: List[int] = [0]
+        self._dict_link: List[int] = [0]
+
+        seen = set()
+        for word in words:
+            key = word.strip()
+            if normalize:
+                key = normalizer.normalize(key)[0]
+            key = fold_case(key)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            self.words.append(word.strip())
+            self._insert(key)
+        self._build_links()
+        logger.debug("Built word matcher with %d unique terms and %d nodes",
+                     len(self.words), len(self._goto))
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    @property
+    def fingerprint(self) -> str:
+        """SHA-256 hex digest of the sorted word list and matching mode."""
+        digest = hashlib.sha256(b'normalize' if self.normalize else b'')
+        for word in sorted(self.words):
+            digest.update(b'\0' + word.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _insert(self, key: str) -> None:
+        node = 0
+        for c in key:
+            nxt = self._goto[node].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._term_len.append(0)
+                self._dict_link.append(0)
+                self._goto[node][c] = nxt
+            node = nxt
+        self._term_len[node] = len(key)
+
+    def _build_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(c, 0)
+                self._fail[child] = target if target != child else 0
+                target = self._fail[child]
+                self._dict_link[child] = target if self._term_len[target] else self._dict_link[target]
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int]]:
+        """Yield the (start, end) of every term occurrence, boundaries unchecked."""
+        goto, fail, term_len, dict_link = self._goto, self._fail, self._term_len, self._dict_link
+        node = 0
+        for i, c in enumerate(fold_case(text)):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            out = node if term_len[node] else dict_link[node]
+            while out:
+                yield i + 1 - term_len[out], i + 1
+                out = dict_link[out]
+
+    def find_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Return the word-bounded, non-overlapping matches in ``text``."""
+        if not len(self) or not text:
+            return []
+        if not self.normalize:
+            return select_spans(text, self.iter_matches(text))
+        normalized, index = normalizer.normalize(text)
+        return normalizer.map_spans(select_spans(normalized, self.iter_matches(normalized)), index)
+
+    def mask(self, text: str, mask_char: str = '*') -> str:
+        """Replace every matched term with ``mask_char`` of the same length."""
+        spans = self.find_spans(text)
+        if not spans:
+            return text
+        parts = []
+        last = 0
+        for start, end in spans:
+            parts.append(text[last:start])
+            parts.append(mask_char * (end - start))
+            last = end
+        parts.append(text[last:])
+        return ''.join(parts)
@@ -0,0 +1,266 @@
+"""
+Re-mask historical messages after the lexicon or masking rules change.
+
+Streams m.room.message events from Synapse's Postgres database through a
+server-side cursor, masks their bodies and HTML formatted bodies with
+TextMasker's rule engine across a process pool and writes the changes back
+in one transaction per batch:
+
+    replace  store the masked body in place, with the usual masked-content
+             notice, and update the full-text search entry
+    redact   empty the content, as Synapse does when it censors redacted
+             events, and drop the search entry
+
+Progress is checkpointed after every committed batch, so an interrupted run
+continues where it stopped when started again with the same --checkpoint.
+Synapse caches events in memory: restart it after a backfill so that clients
+are served the rewritten content.
+
+The postgres service in docker-compose.yml does not publish its port; add
+`ports: ["127.0.0.1:5432:5432"]` to it or pass the container's address with
+--host.
+
+Usage:
+    python scripts/backfill_masking.py --dry-run
+    python scripts/backfill_masking.py --lexicon /data/abusive.lexicon --mode replace
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config.modules.html_masker import HTML_FORMAT, FormattedBody  # noqa: E402
+from config.modules.offload import _init_worker, _worker_find_spans  # noqa: E402
+from config.modules.rule_engine import apply_spans  # noqa: E402
+from config.modules.text_masker import DEFAULT_ABUSIVE_WORDS, MASKED_NOTICE  # noqa: E402
+
+SELECT_MESSAGES = """
+    SELECT e.stream_ordering, e.event_id, ej.json
+    FROM events AS e
+    JOIN event_json AS ej USING (event_id)
+    WHERE e.type = 'm.room.message'
+        AND (%(after)s::bigint IS NULL OR e.stream_ordering > %(after)s)
+        AND (%(room_id)s::text IS NULL OR e.room_id = %(room_id)s)
+        AND NOT EXISTS (SELECT 1 FROM redactions AS r WHERE r.redacts = e.event_id)
+    ORDER BY e.stream_ordering
+"""
+
+UPDATE_JSON = """
+    UPDATE event_json AS ej SET json = v.json
+    FROM (VALUES %s) AS v (event_id, json)
+    WHERE ej.event_id = v.event_id
+"""
+
+UPDATE_SEARCH = """
+    UPDATE event_search AS es SET vector = to_tsvector('english', v.body)
+    FROM (VALUES %s) AS v (event_id, body)
+    WHERE es.event_id = v.event_id AND es.key = 'content.body'
+"""
+
+DELETE_SEARCH = "DELETE FROM event_search WHERE event_id = ANY(%s)"
+
+
+# Fields holding an HTML formatted_body rather than a plain body
+FORMATTED_FIELDS = frozenset(("formatted_body", "new_formatted_body"))
+
+
+def mask_field(item):
+    """Mask one (field, text) pair in a worker process; None if nothing changed."""
+    field, text = item
+    if field in FORMATTED_FIELDS:
+        document = FormattedBody(text)
+        spans = _worker_find_spans(document.text, None)
+        masked = document.apply(spans)
+    else:
+        spans = _worker_find_spans(text, None)
+        masked = apply_spans(text, spans).rstrip()
+    return masked if spans and masked != text else None
+
+
+def load_checkpoint(path):
+    # Backfilled events have negative stream orderings, so a fresh run
+    # starts before any of them rather than at a fixed number
+    if not path or not os.path.exists(path):
+        return {"after": None, "scanned": 0, "changed": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def read_words(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def _content_texts(content, prefix=""):
+    texts = []
+    if isinstance(content.get("body"), str) and content["body"]:
+        texts.append((f"{prefix}body", content["body"]))
+    formatted_body = content.get("formatted_body")
+    if content.get("format") == HTML_FORMAT and isinstance(formatted_body, str) and formatted_body:
+        texts.append((f"{prefix}formatted_body", formatted_body))
+    return texts
+
+
+def message_texts(event):
+    """The texts of a message event that get masked, as (field, text) pairs.
+
+    Edits carry the new text in m.new_content as well as a fallback body,
+    and either may have an HTML formatted_body next to its body.
+    """
+    content = event.get("content") or {}
+    if content.get("msgtype") != "m.text":
+        return []
+    texts = _content_texts(content)
+    new_content = content.get("m.new_content")
+    if isinstance(new_content, dict):
+        texts.extend(_content_texts(new_content, "new_"))
+    return texts
+
+
+def write_batch(conn, mode, changes):
+    """Apply ``{event_id: (event, {field: masked text})}`` in one transaction."""
+    from psycopg2.extras import execute_values
+
+    rows = []
+    search = []
+    for event_id, (event, masked) in changes.items():
+        content = event["content"]
+        if mode == "redact":
+            event["content"] = {}
+        else:
+            if "body" in masked:
+                content["body"] = masked["body"]
+                search.append((event_id, masked["body"]))
+            if "formatted_body" in masked:
+                content["formatted_body"] = masked["formatted_body"]
+            if "new_body" in masked:
+                content["m.new_content"]["body"] = masked["new_body"]
+            if "new_formatted_body" in masked:
+                content["m.new_content"]["formatted_body"] = masked["new_formatted_body"]
+            content["m.notice"] = MASKED_NOTICE
+        rows.append((event_id, json.dumps(event, ensure_ascii=False, separators=(',', ':'))))
+
+    with conn.cursor() as cur:
+        execute_values(cur, UPDATE_JSON, rows)
+        if mode == "redact":
+            cur.execute(DELETE_SEARCH, (list(changes),))
+        elif search:
+            execute_values(cur, UPDATE_SEARCH, search)
+    conn.commit()
+
+
+def run(args):
+    # Imported here so that the helpers above work without a database driver
+    import psycopg2
+
+    if args.lexicon:
+        initargs = (None, args.lexicon)
+    else:
+        words = read_words(args.words) if args.words else DEFAULT_ABUSIVE_WORDS
+        initargs = (words, None, not args.no_normalize)
+
+    checkpoint = load_checkpoint(args.checkpoint)
+    if checkpoint["after"] is not None:
+        print(f"Resuming after stream ordering {checkpoint['after']} "
+              f"({checkpoint['scanned']} scanned, {checkpoint['changed']} changed so far)")
+
+    dsn = dict(host=args.host, port=args.port, dbname=args.database, user=args.user, password=args.password)
+    read_conn = psycopg2.connect(**dsn)
+    write_conn = psycopg2.connect(**dsn)
+    read_conn.set_session(readonly=True)
+
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=initargs,
+    )
+
+    start = time.perf_counter()
+    scanned = changed = 0
+    try:
+        with read_conn.cursor(name="backfill_masking") as cur:
+            cur.itersize = args.batch_size
+            cur.execute(SELECT_MESSAGES, {"after": checkpoint["after"], "room_id": args.room_id})
+            while True:
+                rows = cur.fetchmany(args.batch_size)
+                if not rows:
+                    break
+
+                candidates = []
+                for _, event_id, raw in rows:
+                    event = json.loads(raw)
+                    for field, text in message_texts(event):
+                        candidates.append((event_id, event, field, text))
+
+                chunksize = max(1, len(candidates) // (args.workers * 4))
+                masked = pool.map(mask_field, [(field, text) for _, _, field, text in candidates], chunksize=chunksize)
+                changes = {}
+                for (event_id, event, field, _), masked_text in zip(candidates, masked):
+                    if masked_text is not None:
+                        changes.setdefault(event_id, (event, {}))[1][field] = masked_text
+
+                if changes and not args.dry_run:
+                    write_batch(write_conn, args.mode, changes)
+
+                scanned += len(rows)
+                changed += len(changes)
+                checkpoint = {
+                    "after": rows[-1][0],
+                    "scanned": checkpoint["scanned"] + len(rows),
+                    "changed": checkpoint["changed"] + len(changes),
+                }
+                if not args.dry_run:
+                    save_checkpoint(args.checkpoint, checkpoint)
+
+                elapsed = time.perf_counter() - start
+                print(f"{scanned} rows scanned, {changed} changed, "
+                      f"{scanned / elapsed:.0f} rows/sec, at stream ordering {checkpoint['after']}")
+    finally:
+        pool.shutdown()
+        read_conn.close()
+        write_conn.close()
+
+    elapsed = time.perf_counter() - start
+    verb = "would change" if args.dry_run else "changed"
+    print(f"\nDone: {scanned} rows scanned, {verb} {changed} in {elapsed:.1f}s "
+          f"({scanned / elapsed if elapsed else 0:.0f} rows/sec)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-mask historical messages in the Synapse database')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--lexicon', help='Compiled lexicon file (see scripts/compile_lexicon.py)')
+    source.add_argument('--words', help='Word file, one term per line (default: the built-in list)')
+    parser.add_argument('--no-normalize', action='store_true', help='Match --words or the built-in list literally')
+    parser.add_argument('--mode', choices=('replace', 'redact'), default='replace',
+                        help='Store the masked body, or empty the content of affected messages')
+    parser.add_argument('--room-id', help='Only backfill this room')
+    parser.add_argument('--batch-size', type=int, default=2000, help='Rows per fetch and per write transaction')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Masking processes')
+    parser.add_argument('--checkpoint', default='backfill_masking.checkpoint.json',
+                        help='Progress file; delete it to start over')
+    parser.add_argument('--dry-run', action='store_true', help='Count the messages that would change')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--database', default='matrix')
+    parser.add_argument('--user', default='matrix')
+    parser.add_argument('--password', default=os.environ.get('POSTGRES_PASSWORD', 'matrix_dev_password_2024'),
+                        help='Defaults to $POSTGRES_PASSWORD, then the docker-compose development password')
+
+    run(parser.parse_args())
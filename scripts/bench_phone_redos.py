@@ -0,0 +1,173 @@
+"""
+ReDoS and fuzz benchmark for phone number detection.
+
+Times the linear-time detector in config/modules/phone_detector.py against
+the regex it replaced on adversarial inputs of growing size, and reports the
+cost per KB of input. The legacy regex backtracks exponentially on some of
+these inputs, so each of its runs happens in a child process and is
+abandoned after --legacy-budget seconds.
+
+A fuzz pass then runs the detector over random digit/separator/letter strings.
+It checks that every span is well formed and counts the inputs where the
+detector and the legacy regex disagree (informational only, the detector
+intentionally differs on a few formats).
+
+Usage:
+    python scripts/bench_phone_redos.py [--sizes 1024 4096 16384] [--json out.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config.modules.phone_detector import find_phone_spans  # noqa: E402
+
+# The phone pattern TextMasker used before the linear-time detector
+LEGACY_PHONE_PATTERN = r'''
+    (?:\+\d{1,3}[-.\s]?)?
+    (?:
+        \(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}
+        |
+        \d{1,4}[-.\s]?\d{3}[-.\s]?\d{3}[-.\s]?\d{4}
+        |
+        \d{10}
+        |
+        \d{3}[-.]\d{3}[-.]\d{4}
+        |
+        \d{3}\s\d{3}\s\d{4}
+        |
+        \d{3}[_\-@#%&\.]\d{3}[_\-@#%&\.]\d{4}
+        |
+        \d{3}[-.\s]?\d{3}[-.\s]?\d{4}\s*(?:x|ext|extension)?\s*\d{1,5}
+        |
+        (?:\d{2,3}\s?){3,}
+        |
+        (?:\d\s){9}\d
+    )
+    \b
+'''
+LEGACY_PHONE = re.compile(LEGACY_PHONE_PATTERN, re.VERBOSE | re.IGNORECASE)
+
+# Adversarial inputs, each a function of the target size in characters
+GENERATORS = {
+    "digit_run_then_letter": lambda n: "1" * (n - 1) + "a",
+    "digit_pairs_then_letter": lambda n: ("12 " * (n // 3))[: n - 1] + "a",
+    "spaced_digits": lambda n: ("1 " * (n // 2))[: n - 1] + "x",
+    "dashed_groups": lambda n: ("123-" * (n // 4))[: n - 1] + "a",
+    "plus_prefixes": lambda n: ("+1 " * (n // 3))[:n],
+    "chat_with_numbers": lambda n: ("call me at 98765 43210 or +1 (555) 123-4567 ext 12 ok " * (n // 54 + 1))[:n],
+}
+
+FUZZ_ALPHABET = "0123456789     -._@#%&()+xXeta"
+
+
+def _legacy_worker(text, queue):
+    start = time.perf_counter()
+    list(LEGACY_PHONE.finditer(text))
+    queue.put(time.perf_counter() - start)
+
+
+def time_legacy(text, budget):
+    """Seconds the legacy regex needs for ``text``, or None if over ``budget``."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_legacy_worker, args=(text, queue))
+    process.start()
+    process.join(budget)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return None
+    return queue.get()
+
+
+def time_detector(text, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        find_phone_spans(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(sizes, legacy_budget, repeat):
+    results = []
+    for name, generate in GENERATORS.items():
+        legacy_exhausted = False
+        for size in sizes:
+            text = generate(size)
+            detector = time_detector(text, repeat)
+            legacy = None if legacy_exhausted else time_legacy(text, legacy_budget)
+            legacy_exhausted = legacy_exhausted or legacy is None
+            kb = len(text) / 1024
+            results.append({
+                "input": name,
+                "chars": len(text),
+                "detector_us_per_kb": detector * 1e6 / kb,
+                "legacy_us_per_kb": None if legacy is None else legacy * 1e6 / kb,
+            })
+    return results
+
+
+def run_fuzz(iterations, max_length, seed):
+    rng = random.Random(seed)
+    disagreements = 0
+    for _ in range(iterations):
+        text = ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(1, max_length)))
+        spans = find_phone_spans(text)
+        last_end = 0
+        for start, end in spans:
+            if not (last_end <= start < end <= len(text)):
+                raise AssertionError(f"Malformed span {(start, end)} for {text!r}")
+            last_end = end
+        legacy = [(m.start(), m.end()) for m in LEGACY_PHONE.finditer(text)]
+        if legacy != spans:
+            disagreements += 1
+    return {"iterations": iterations, "max_length": max_length, "disagreements_with_legacy": disagreements}
+
+
+def print_report(results, fuzz):
+    print(f"{'input':<26}{'chars':>8}{'detector us/KB':>16}{'legacy us/KB':>16}")
+    for row in results:
+        legacy = row["legacy_us_per_kb"]
+        legacy = "timeout" if legacy is None else f"{legacy:.1f}"
+        print(f"{row['input']:<26}{row['chars']:>8}{row['detector_us_per_kb']:>16.1f}{legacy:>16}")
+
+    print("\nDetector cost growth (largest / smallest input, us per KB):")
+    for name in GENERATORS:
+        rows = [row for row in results if row["input"] == name]
+        growth = rows[-1]["detector_us_per_kb"] / rows[0]["detector_us_per_kb"]
+        print(f"  {name:<26}{growth:.2f}x")
+
+    print(f"\nFuzz: {fuzz['iterations']} inputs up to {fuzz['max_length']} chars, "
+          f"all spans well formed, {fuzz['disagreements_with_legacy']} differ from the legacy regex")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark phone detection against pathological inputs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024, 4096, 16384, 65536],
+                        help='Input sizes in characters')
+    parser.add_argument('--legacy-budget', type=float, default=2.0,
+                        help='Seconds the legacy regex may spend on one input before it is abandoned')
+    parser.add_argument('--repeat', type=int, default=5, help='Detector runs per input; the fastest is kept')
+    parser.add_argument('--fuzz-iterations', type=int, default=20000, help='Number of random fuzz inputs')
+    parser.add_argument('--fuzz-max-length', type=int, default=40,
+                        help='Maximum fuzz input length (kept small so the legacy regex finishes)')
+    parser.add_argument('--seed', type=int, default=0, help='Fuzz random seed')
+    parser.add_argument('--json', help='Also write the results to this file as JSON')
+
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.legacy_budget, args.repeat)
+    fuzz = run_fuzz(args.fuzz_iterations, args.fuzz_max_length, args.seed)
+    print_report(results, fuzz)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"benchmark": results, "fuzz": fuzz}, f, indent=2)
@@ -0,0 +1,496 @@
+"""
+Offline benchmark for the TextMasker and FirebaseAuthProvider modules.
+
+Drives TextMasker.on_event and FirebaseAuthProvider.check_firebase_auth
+in-process with a fake ModuleApi and fake events. No homeserver is needed:
+masking API calls go to the local stub in scripts/stub_masking_api.py, and
+logins use a throwaway service account and RS256 key generated at startup.
+
+Each scenario reports messages (or logins) per second, p50/p99 latency and
+peak memory. Results can be written as JSON and compared against a previous
+run to catch regressions:
+
+    python scripts/benchmark_modules.py --json before.json
+    python scripts/benchmark_modules.py --baseline before.json --max-regression 0.2
+
+Before the masker scenarios, a few serial API calls measure the floor the
+harness puts under every message. If it is well above --api-latency-ms the
+numbers say more about the harness than the modules, and a warning is
+printed (--strict-floor makes it an error).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from twisted.internet import defer, task
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_masking_api import start_server  # noqa: E402
+
+CORPORA = ("short_chat", "long_paste", "pii_heavy", "hinglish", "adversarial", "formatted")
+
+CHAT_WORDS = ("ok", "thanks", "see you", "lol", "where are you", "meeting at 5", "sure", "on my way",
+              "good morning", "haha", "call me later", "sounds good", "what time", "done", "nice")
+HINGLISH_WORDS = ("kya haal hai", "bhai", "chal", "theek hai", "kal milte", "kaha ho", "accha", "yaar",
+                  "bakchodi mat kar", "kutta", "pagal hai kya", "chutiya", "arre", "sahi hai", "bewakoof")
+ABUSIVE_WORDS = ("idiot", "stupid", "bastard", "shit", "fuck")
+
+
+def _phone(rng):
+    return rng.choice((
+        "+91 {} {}".format(rng.randint(10000, 99999), rng.randint(10000, 99999)),
+        "({}) {}-{}".format(rng.randint(100, 999), rng.randint(100, 999), rng.randint(1000, 9999)),
+        str(rng.randint(6000000000, 9999999999)),
+    ))
+
+
+def _email(rng):
+    name = ''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+    return f"{name}{rng.randint(1, 99)}@{rng.choice(('gmail.com', 'example.org', 'mail.co.in'))}"
+
+
+def make_corpus(name, count, seed=0):
+    """Generate ``count`` message bodies of the given kind."""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        if name == "short_chat":
+            text = ' '.join(rng.choice(CHAT_WORDS) for _ in range(rng.randint(1, 4)))
+        elif name == "long_paste":
+            words = [rng.choice(CHAT_WORDS + ABUSIVE_WORDS) for _ in range(rng.randint(800, 1500))]
+            words[rng.randrange(len(words))] = _phone(rng)
+            text = ' '.join(words)
+        elif name == "pii_heavy":
+            parts = []
+            for _ in range(rng.randint(3, 8)):
+                parts.append(rng.choice(CHAT_WORDS))
+                parts.append(rng.choice((_phone(rng), _email(rng), rng.choice(ABUSIVE_WORDS))))
+            text = ' '.join(parts)
+        elif name == "hinglish":
+            text = ' '.join(rng.choice(HINGLISH_WORDS) for _ in range(rng.randint(2, 10)))
+        elif name == "formatted":
+            # HTML formatted_body; bench_masker derives the plain body
+            parts = []
+            for _ in range(rng.randint(20, 200)):
+                word = rng.choice(CHAT_WORDS + ABUSIVE_WORDS)
+                parts.append(rng.choice((word, f"<b>{word}</b>", f"<em>{word}</em>", f"{word}<br>")))
+            email = _email(rng)
+            parts.append(f'<a href="mailto:{email}">{email}</a> or {_phone(rng)}')
+            text = f"<p>{' '.join(parts)}</p>"
+        elif name == "adversarial":
+            text = rng.choice((
+                "1" * rng.randint(200, 2000) + "a",
+                "12 " * rng.randint(100, 700) + "x",
+                "a@" * rng.randint(100, 1000) + ".",
+                "f.u.c.k " * rng.randint(50, 300),
+                "(" * rng.randint(100, 1000) + "123",
+            ))
+        else:
+            raise ValueError(f"Unknown corpus: {name}")
+        # Keep bodies unique so the result cache doesn't hide the work
+        messages.append(f"{text} #{i}")
+    return messages
+
+
+class FakeEvent:
+    def __init__(self, body, index, room_id="!bench:localhost", sender="@bench:localhost", formatted_body=None):
+        self.type = "m.room.message"
+        self.content = {"msgtype": "m.text", "body": body}
+        if formatted_body is not None:
+            self.content.update(format="org.matrix.custom.html", formatted_body=formatted_body)
+        self.event_id = f"$bench{index}"
+        self.room_id = room_id
+        self.sender = sender
+        self.state_key = None
+        self.origin_server_ts = int(time.time() * 1000)
+        self.unsigned = {}
+        self.depth = 1
+        self.hashes = {}
+        self.signatures = {}
+
+    def prev_event_ids(self):
+        return []
+
+    def auth_event_ids(self):
+        return []
+
+    def is_state(self):
+        return False
+
+
+class FakeModuleApi:
+    """Just enough of synapse.module_api.ModuleApi for the modules to run."""
+
+    server_name = "localhost"
+
+    def __init__(self, reactor, db_latency=0.0):
+        self._reactor = reactor
+        self.db_latency = db_latency
+        self.users = set()
+        self.db_queries = 0
+        self.registrations = 0
+        self.sent_events = []
+        self.callbacks = {}
+
+    def register_third_party_rules_callbacks(self, **callbacks):
+        self.callbacks.update(callbacks)
+
+    def register_password_auth_provider_callbacks(self, **callbacks):
+        self.callbacks.update(callbacks)
+
+    def register_web_resource(self, path, resource):
+        pass
+
+    def looping_background_call(self, f, msec, *args, **kwargs):
+        pass
+
+    def run_as_background_process(self, desc, func, *args, **kwargs):
+        return defer.ensureDeferred(func(*args, **kwargs))
+
+    async def defer_to_thread(self, f, *args, **kwargs):
+        from synapse.logging.context import defer_to_thread
+        return await defer_to_thread(self._reactor, f, *args, **kwargs)
+
+    async def defer_to_threadpool(self, threadpool, f, *args, **kwargs):
+        from synapse.logging.context import defer_to_threadpool
+        return await defer_to_threadpool(self._reactor, threadpool, f, *args, **kwargs)
+
+    async def is_user_admin(self, user_id):
+        return False
+
+    async def sleep(self, seconds):
+        await task.deferLater(self._reactor, seconds, lambda: None)
+
+    async def create_and_send_event_into_room(self, event_dict):
+        self.sent_events.append(event_dict)
+        return event_dict
+
+    async def check_user_exists(self, user_id):
+        self.db_queries += 1
+        if self.db_latency:
+            await self.sleep(self.db_latency)
+        return user_id if user_id in self.users else None
+
+    async def register_user(self, localpart, displayname=None, emails=None, admin=False):
+        self.db_queries += 1
+        if self.db_latency:
+            await self.sleep(self.db_latency)
+        user_id = f"@{localpart}:{self.server_name}"
+        self.registrations += 1
+        self.users.add(user_id)
+        return user_id
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_calls(calls, concurrency, trace_memory):
+    """Run the zero-argument async callables with bounded concurrency and time each one."""
+    latencies = []
+    semaphore = defer.DeferredSemaphore(concurrency)
+
+    async def timed(call):
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await defer.gatherResults(
+        [semaphore.run(lambda c=call: defer.ensureDeferred(timed(c))) for call in calls],
+        consumeErrors=True,
+    )
+    wall = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "count": len(latencies),
+        "per_second": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "traced_peak_kb": None if peak is None else peak / 1024,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+async def measure_api_floor(reactor, api_url, requests=20):
+    """Median of serial masking API round trips through the module's client, in ms.
+
+    With nothing else in flight this is the stub latency plus transport
+    overhead. Much more than the stub latency means the harness, not the
+    modules, sets the pace, as when replies wait on delayed ACKs.
+    """
+    from config.modules.masking_client import MaskingApiClient
+
+    client = MaskingApiClient(api_url, reactor=reactor)
+    latencies = []
+    try:
+        # The first request also opens the connection
+        for i in range(requests + 1):
+            start = time.perf_counter()
+            await client.mask(f"floor check {i}")
+            if i:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    latencies.sort()
+    return percentile(latencies, 0.50) * 1000
+
+
+async def bench_masker(reactor, args, api_url, stub_state):
+    from config.modules.text_masker import TextMasker
+
+    results = []
+    for corpus in args.corpora:
+        config = {
+            "mask_api_url": api_url,
+            "timeout": args.api_timeout,
+            "cache": {"enabled": not args.disable_cache},
+            "shared_cache": {"enabled": args.shared_cache, "backend": "memory", "name": f"bench-{corpus}"},
+            "deferred": {"enabled": args.deferred},
+            "admission": {"enabled": not args.disable_admission},
+        }
+        api = FakeModuleApi(reactor)
+        # Every message is masked by each of the simulated workers, as when
+        # the same text reaches several worker processes
+        maskers = [TextMasker(config, api) for _ in range(args.workers)]
+        api_calls = stub_state.stats["queries"]
+        events = []
+        for i, body in enumerate(make_corpus(corpus, args.messages, args.seed)):
+            sender = f"@user{i % args.senders}:localhost"
+            if corpus == "formatted":
+                events.append(FakeEvent(re.sub(r'<[^>]*>', '', body), i, sender=sender, formatted_body=body))
+            else:
+                events.append(FakeEvent(body, i, sender=sender))
+        calls = [lambda e=event, m=m: m.on_event(e, {}) for event in events for m in maskers]
+        stats = await run_calls(calls, args.concurrency, args.trace_memory)
+        stats.update({"module": "text_masker", "scenario": corpus})
+        if args.deferred:
+            # Let background masking finish before tearing down the clients
+            while any(m.post_send_queue.backlog or m.post_send_queue.in_progress for m in maskers):
+                await api.sleep(0.01)
+            stats["post_send_edits"] = len(api.sent_events)
+        if not args.disable_admission:
+            stats["shed"] = sum(
+                m.admission.stats()["shed_sender_rate"] + m.admission.stats()["shed_concurrency"] for m in maskers
+            )
+        stats["api_calls"] = stub_state.stats["queries"] - api_calls
+        results.append(stats)
+        for m in maskers:
+            if m.offloader is not None:
+                m.offloader.stop()
+            await m.client.close()
+    return results
+
+
+def write_service_account(directory):
+    """Create a throwaway service account and signing key set.
+
+    Returns (service account path, keys file path, private key PEM, project id).
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode('ascii')
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode('ascii')
+    keys_path = os.path.join(directory, "signing-keys.json")
+    with open(keys_path, 'w') as f:
+        json.dump({"bench": public_pem}, f)
+    project_id = "bench-project"
+    path = os.path.join(directory, "service-account.json")
+    with open(path, 'w') as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": project_id,
+            "private_key_id": "bench",
+            "private_key": pem,
+            "client_email": f"bench@{project_id}.iam.gserviceaccount.com",
+            "client_id": "1",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+    return path, keys_path, pem, project_id
+
+
+def mint_token(pem, project_id, uid, lifetime=3600):
+    import jwt
+
+    now = int(time.time())
+    payload = {
+        "iss": f"https://securetoken.google.com/{project_id}",
+        "aud": project_id,
+        "sub": uid,
+        "user_id": uid,
+        "iat": now,
+        "auth_time": now,
+        "exp": now + lifetime,
+    }
+    return jwt.encode(payload, pem, algorithm="RS256", headers={"kid": "bench"})
+
+
+async def bench_auth(reactor, args, workdir):
+    from config.modules.firebase_auth import FirebaseAuthProvider
+
+    path, keys_path, pem, project_id = write_service_account(workdir)
+    results = []
+    scenarios = {
+        # Every login is a first login for a distinct user
+        "new_users": lambda i: f"uid{i}",
+        # Logins spread over a small set of returning users
+        "returning_users": lambda i: f"uid{i % 50}",
+    }
+    for name, uid_for in scenarios.items():
+        api = FakeModuleApi(reactor, db_latency=args.db_latency_ms / 1000)
+        provider = FirebaseAuthProvider(
+            {"service_account_path": path, "token_verification": {"keys_file": keys_path}},
+            account_handler=api,
+        )
+        tokens = [mint_token(pem, project_id, uid_for(i)) for i in range(args.logins)]
+        calls = [
+            lambda t=token: provider.check_firebase_auth("", "m.login.firebase", {"token": t})
+            for token in tokens
+        ]
+        stats = await run_calls(calls, args.concurrency, args.trace_memory)
+        stats.update({
+            "module": "firebase_auth",
+            "scenario": name,
+            "db_queries": api.db_queries,
+            "registrations": api.registrations,
+        })
+        results.append(stats)
+    return results
+
+
+def print_report(results):
+    print(f"{'module':<15}{'scenario':<18}{'count':>7}{'per sec':>11}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'max ms':>10}{'peak KB':>10}")
+    for row in results:
+        peak = row["traced_peak_kb"]
+        peak = "-" if peak is None else f"{peak:.0f}"
+        print(f"{row['module']:<15}{row['scenario']:<18}{row['count']:>7}{row['per_second']:>11.1f}"
+              f"{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}{peak:>10}")
+    print(f"\nmax RSS: {results[-1]['max_rss_kb'] / 1024:.1f} MB" if results else "")
+
+
+def compare(results, baseline_path, max_regression):
+    """Print regressions against a baseline JSON file; return True if any exceed the limit."""
+    with open(baseline_path) as f:
+        baseline = {(row["module"], row["scenario"]): row for row in json.load(f)["results"]}
+    failed = False
+    for row in results:
+        before = baseline.get((row["module"], row["scenario"]))
+        if before is None:
+            continue
+        checks = (
+            ("per_second", before["per_second"] and (before["per_second"] - row["per_second"]) / before["per_second"]),
+            ("p99_ms", before["p99_ms"] and (row["p99_ms"] - before["p99_ms"]) / before["p99_ms"]),
+        )
+        for metric, regression in checks:
+            if regression > max_regression:
+                failed = True
+                print(f"REGRESSION {row['module']}/{row['scenario']} {metric}: "
+                      f"{before[metric]:.2f} -> {row[metric]:.2f} ({regression:+.0%})")
+    return failed
+
+
+async def main(reactor, args):
+    server = start_server(latency_ms=args.api_latency_ms, jitter_ms=args.api_jitter_ms,
+                          failure_rate=args.api_failure_rate)
+    host, port = server.server_address
+    api_url = f"http://{host}:{port}/mask"
+
+    results = []
+    api_floor_ms = None
+    if "masker" in args.modules:
+        api_floor_ms = await measure_api_floor(reactor, api_url)
+        expected = args.api_latency_ms + args.api_jitter_ms / 2
+        print(f"API floor: p50 {api_floor_ms:.2f} ms serial, stub latency {expected:.2f} ms")
+        if api_floor_ms > expected + args.max_floor_overhead_ms:
+            print(f"WARNING: serial API calls take {api_floor_ms - expected:.1f} ms more than the stub "
+                  f"latency; the results measure the harness rather than the modules")
+            if args.strict_floor:
+                server.shutdown()
+                raise SystemExit(1)
+        print()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if "masker" in args.modules:
+            results.extend(await bench_masker(reactor, args, api_url, server.state))
+        if "auth" in args.modules:
+            results.extend(await bench_auth(reactor, args, workdir))
+    server.shutdown()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"args": vars(args), "api_floor_ms": api_floor_ms, "results": results}, f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the TextMasker and FirebaseAuthProvider modules offline')
+    parser.add_argument('--modules', nargs='+', choices=('masker', 'auth'), default=['masker', 'auth'])
+    parser.add_argument('--corpora', nargs='+', choices=CORPORA, default=list(CORPORA),
+                        help='Message corpora for the masker')
+    parser.add_argument('--messages', type=int, default=500, help='Messages per corpus')
+    parser.add_argument('--logins', type=int, default=500, help='Logins per auth scenario')
+    parser.add_argument('--concurrency', type=int, default=20, help='Calls in flight at once')
+    parser.add_argument('--api-latency-ms', type=float, default=5.0, help='Stub masking API latency')
+    parser.add_argument('--api-jitter-ms', type=float, default=0.0, help='Random extra stub latency')
+    parser.add_argument('--api-failure-rate', type=float, default=0.0, help='Fraction of stub API calls that fail')
+    parser.add_argument('--max-floor-overhead-ms', type=float, default=5.0,
+                        help='Warn if serial API calls take this much longer than the stub latency')
+    parser.add_argument('--strict-floor', action='store_true',
+                        help='Exit with an error instead of warning about the API floor')
+    parser.add_argument('--api-timeout', type=float, default=10, help='TextMasker `timeout` setting')
+    parser.add_argument('--db-latency-ms', type=float, default=1.0, help='Fake database latency for logins')
+    parser.add_argument('--disable-cache', action='store_true', help='Turn off the masked-result cache')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Simulated worker processes (TextMasker instances); each masks every message')
+    parser.add_argument('--shared-cache', action='store_true',
+                        help='Share masked results between the simulated workers (in-memory backend)')
+    parser.add_argument('--senders', type=int, default=100, help='Distinct senders the messages come from')
+    parser.add_argument('--disable-admission', action='store_true', help='Turn off admission control')
+    parser.add_argument('--deferred', action='store_true',
+                        help='Use post-send masking; latencies then exclude the API round trip')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Measure peak Python allocations per scenario (slows the run down)')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus random seed')
+    parser.add_argument('--log-level', default='WARNING', help='Log level for the modules')
+    parser.add_argument('--json', help='Write results to this file as JSON')
+    parser.add_argument('--baseline', help='Compare against results previously written with --json')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Fail if throughput drops or p99 grows by more than this fraction')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    task.react(lambda reactor: defer.ensureDeferred(main(reactor, args)))
@@ -0,0 +1,186 @@
+"""
+Startup-time benchmark: how long until the modules (or a homeserver) serve
+their first request.
+
+By default each run starts a fresh Python process that imports Synapse's
+module API, then the modules, creates a TextMasker and a
+FirebaseAuthProvider with the fake ModuleApi from benchmark_modules.py,
+and serves one message (against the local masking API stub) and one login
+(with a throwaway service account and signing key). Times are measured from
+the moment the process was launched:
+
+    synapse   Python start-up and Synapse's own imports, paid regardless
+    import    importing the modules
+    init      creating both modules
+    message   the first message masked
+    login     the first login served
+
+With --url the benchmark measures a running homeserver instead: it runs
+--restart-cmd (if given) and polls until /_matrix/client/versions answers,
+and, with --login-token, until a Firebase login succeeds. This covers the
+container entrypoint, dependency install included:
+
+    python scripts/benchmark_startup.py --runs 5
+    python scripts/benchmark_startup.py --url http://localhost:8008 \\
+        --restart-cmd "docker compose restart matrix" --runs 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, '..'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+PHASES = ("synapse", "import", "init", "message", "login")
+
+
+def child(args):
+    """Run in a fresh process: start the modules and serve one message and one login."""
+    marks = {}
+
+    import synapse.module_api  # noqa: F401
+    from twisted.internet import defer, task
+    from benchmark_modules import FakeEvent, FakeModuleApi
+    marks["synapse"] = time.time()
+
+    from config.modules.firebase_auth import FirebaseAuthProvider
+    from config.modules.text_masker import TextMasker
+    marks["import"] = time.time()
+
+    async def run(reactor):
+        api = FakeModuleApi(reactor)
+        masker = TextMasker({"mask_api_url": args.api_url}, api)
+        provider = FirebaseAuthProvider(
+            {"service_account_path": args.service_account, "token_verification": {"keys_file": args.keys_file}},
+            account_handler=api,
+        )
+        marks["init"] = time.time()
+
+        await masker.on_event(FakeEvent("call me at 9876543210, idiot", 0), {})
+        marks["message"] = time.time()
+        result = await provider.check_firebase_auth("", "m.login.firebase", {"token": args.token})
+        if result is None:
+            raise SystemExit("The first login failed")
+        marks["login"] = time.time()
+
+        if masker.offloader is not None:
+            masker.offloader.stop()
+        await masker.client.close()
+        # task.react exits the process when run() is done
+        with open(args.out, 'w') as f:
+            json.dump(marks, f)
+
+    task.react(lambda reactor: defer.ensureDeferred(run(reactor)))
+
+
+def bench_modules(args):
+    from benchmark_modules import mint_token, write_service_account
+    from stub_masking_api import start_server
+
+    server = start_server()
+    host, port = server.server_address
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        service_account, keys_file, pem, project_id = write_service_account(workdir)
+        for i in range(args.runs):
+            with tempfile.NamedTemporaryFile('r', suffix='.json') as out:
+                launched = time.time()
+                subprocess.run(
+                    [
+                        sys.executable, os.path.abspath(__file__), '--child',
+                        '--api-url', f"http://{host}:{port}/mask",
+                        '--service-account', service_account,
+                        '--keys-file', keys_file,
+                        '--token', mint_token(pem, project_id, f"uid{i}"),
+                        '--out', out.name,
+                    ],
+                    check=True,
+                )
+                marks = json.load(out)
+            runs.append({phase: (marks[phase] - launched) * 1000 for phase in PHASES})
+            print(f"run {i + 1}: " + "  ".join(f"{phase} {runs[-1][phase]:.0f} ms" for phase in PHASES))
+    server.shutdown()
+
+    print(f"\n{'cumulative ms':<15}{'median':>10}{'min':>10}{'max':>10}")
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        print(f"{phase:<15}{statistics.median(values):>10.0f}{min(values):>10.0f}{max(values):>10.0f}")
+    return runs
+
+
+def request_ok(url, body=None, timeout=2.0):
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return False
+
+
+def wait_for(check, start, deadline, interval):
+    """Poll ``check`` until it passes; return seconds since ``start``, or None at the deadline."""
+    while time.perf_counter() < deadline:
+        if check():
+            return time.perf_counter() - start
+        time.sleep(interval)
+    return None
+
+
+def bench_server(args):
+    url = args.url.rstrip('/')
+    login = {"type": "m.login.firebase", "token": args.login_token}
+    runs = []
+    for i in range(args.runs):
+        start = time.perf_counter()
+        deadline = start + args.timeout
+        if args.restart_cmd:
+            subprocess.run(args.restart_cmd, shell=True, check=True)
+        restarted = time.perf_counter() - start
+        served = wait_for(lambda: request_ok(f"{url}/_matrix/client/versions"), start, deadline, args.interval)
+        logged_in = None
+        if served is not None and args.login_token:
+            logged_in = wait_for(
+                lambda: request_ok(f"{url}/_matrix/client/v3/login", login), start, deadline, args.interval
+            )
+        runs.append({"restart_cmd": restarted, "first_request": served, "first_login": logged_in})
+        print(f"run {i + 1}: " + "  ".join(
+            f"{name} {'timed out' if value is None else f'{value:.2f} s'}"
+            for name, value in runs[-1].items()
+            if name != "first_login" or args.login_token
+        ))
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the time until the modules serve their first request')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to measure')
+    parser.add_argument('--json', help='Write the measurements to this file as JSON')
+    server_args = parser.add_argument_group('homeserver mode')
+    server_args.add_argument('--url', help='Measure this homeserver instead of the modules in-process')
+    server_args.add_argument('--restart-cmd', help='Shell command that restarts the homeserver')
+    server_args.add_argument('--login-token', help='Firebase ID token for a first login')
+    server_args.add_argument('--timeout', type=float, default=300, help='Seconds to wait for the server')
+    server_args.add_argument('--interval', type=float, default=0.1, help='Seconds between polls')
+    # Internal: a single cold start, run in a child process
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    for name in ('--api-url', '--service-account', '--keys-file', '--token', '--out'):
+        parser.add_argument(name, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+
+    runs = bench_server(args) if args.url else bench_modules(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"args": vars(args), "runs": runs}, f, indent=2)
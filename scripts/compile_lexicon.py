@@ -0,0 +1,60 @@
+"""
+Compile an abusive-word list into a lexicon file for TextMasker.
+
+The word file has one term per line; blank lines and lines starting with '#'
+are ignored. The output replaces any existing file atomically, so running
+homeservers with `lexicon.reload_interval` set pick it up on their next check.
+Lexicons are compiled for obfuscation-resistant matching unless
+--no-normalize is given.
+
+Usage:
+    python scripts/compile_lexicon.py words.txt /data/abusive.lexicon
+    python scripts/compile_lexicon.py --default /data/abusive.lexicon
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config.modules.lexicon import LexiconMatcher, compile_lexicon  # noqa: E402
+
+
+def read_words(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile an abusive-word list into a lexicon file')
+    parser.add_argument('words', nargs='?', help='Word file, one term per line')
+    parser.add_argument('output', help='Lexicon file to write')
+    parser.add_argument('--default', action='store_true', help="Compile TextMasker's built-in word list")
+    parser.add_argument('--no-normalize', action='store_true',
+                        help='Match terms literally, for TextMasker configs with obfuscation.enabled: false')
+    args = parser.parse_args()
+
+    if args.default:
+        from config.modules.text_masker import DEFAULT_ABUSIVE_WORDS
+        words = DEFAULT_ABUSIVE_WORDS
+    elif args.words:
+        words = list(read_words(args.words))
+    else:
+        parser.error('a word file or --default is required')
+
+    start = time.perf_counter()
+    matcher = compile_lexicon(words, args.output, normalize=not args.no_normalize)
+    compiled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    LexiconMatcher(args.output)
+    loaded = time.perf_counter() - start
+
+    print(f"Wrote {len(matcher)} terms to {args.output} ({os.path.getsize(args.output) / 1024:.1f} KB)")
+    print(f"Compiled in {compiled:.2f}s, loads in {loaded * 1000:.2f}ms")
+    print(f"Fingerprint: {matcher.fingerprint}")
@@ -0,0 +1,364 @@
+"""
+Load generator for Firebase logins through FirebaseAuthProvider.
+
+Mints signed test ID tokens in bulk, across processes, then sends
+m.login.firebase requests to /_matrix/client/v3/login at a fixed target
+rate over a pool of keep-alive connections. Requests are scheduled
+open-loop: latency is measured from the time a request was due, so a
+server that falls behind shows up as latency rather than a lower send
+rate. The report gives throughput, latency percentiles and errors by
+HTTP status and Matrix errcode.
+
+Tokens are signed with an RSA key and key ID of your choice. Without --key a
+fresh key is generated and its public half written to --keys-out, in the
+{kid: PEM} format read by the module's `token_verification.keys_file`, so a
+local homeserver can be pointed at it:
+
+    token_verification:
+      project_id: "loadtest-project"
+      keys_file: "/data/loadtest-keys.json"
+
+Synapse rate-limits logins per address and per account by default; raise
+`rc_login` (address, account and failed_attempts) in homeserver.yaml before
+a load test, or most requests will come back as 429 M_LIMIT_EXCEEDED.
+
+With --stub the requests go to a local stub that checks token signatures
+and answers like Synapse, to validate the tool and the tokens without a
+homeserver.
+
+Usage:
+    python scripts/load_test_login.py --users 5000 --rate 200 --duration 60
+    python scripts/load_test_login.py --key key.pem --kid mykey --save-tokens tokens.jsonl --mint-only
+    python scripts/load_test_login.py --tokens tokens.jsonl --url http://localhost:8008 --rate 500
+    python scripts/load_test_login.py --stub --rate 1000 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+LOGIN_PATH = "/_matrix/client/v3/login"
+
+
+def generate_key(keys_out, kid):
+    """Generate an RSA signing key and write its public key set to ``keys_out``."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode('ascii')
+    write_public_keys(pem, keys_out, kid)
+    return pem
+
+
+def write_public_keys(pem, keys_out, kid):
+    public_pem = serialization.load_pem_private_key(pem.encode('ascii'), password=None).public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode('ascii')
+    with open(keys_out, 'w') as f:
+        json.dump({kid: public_pem}, f)
+
+
+def _mint_chunk(pem, kid, project_id, uids, lifetime, issued_at):
+    key = serialization.load_pem_private_key(pem.encode('ascii'), password=None)
+    payload = {
+        "iss": f"https://securetoken.google.com/{project_id}",
+        "aud": project_id,
+        "iat": issued_at,
+        "auth_time": issued_at,
+        "exp": issued_at + lifetime,
+    }
+    tokens = []
+    for uid in uids:
+        payload["sub"] = payload["user_id"] = uid
+        tokens.append((uid, jwt.encode(payload, key, algorithm="RS256", headers={"kid": kid})))
+    return tokens
+
+
+def mint_tokens(pem, kid, project_id, uids, lifetime=3600, workers=None):
+    """Sign one ID token per UID, split across ``workers`` processes."""
+    workers = workers or os.cpu_count() or 1
+    issued_at = int(time.time())
+    chunk = max(1, -(-len(uids) // workers))
+    chunks = [uids[i:i + chunk] for i in range(0, len(uids), chunk)]
+    if len(chunks) <= 1:
+        return _mint_chunk(pem, kid, project_id, uids, lifetime, issued_at)
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_mint_chunk, pem, kid, project_id, c, lifetime, issued_at) for c in chunks]
+        return [token for future in futures for token in future.result()]
+
+
+def save_tokens(path, tokens):
+    with open(path, 'w') as f:
+        for uid, token in tokens:
+            f.write(json.dumps({"uid": uid, "token": token}) + "\n")
+
+
+def load_tokens(path):
+    with open(path) as f:
+        return [(entry["uid"], entry["token"]) for entry in map(json.loads, f) if entry]
+
+
+def start_stub(public_pem, project_id, host="127.0.0.1", port=0):
+    """Serve a stand-in for Synapse's login endpoint that checks token signatures."""
+    key = serialization.load_pem_public_key(public_pem.encode('ascii'))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if self.path != LOGIN_PATH or body.get("type") != "m.login.firebase":
+                return self._reply(400, {"errcode": "M_UNKNOWN", "error": "Unknown login type"})
+            try:
+                claims = jwt.decode(body.get("token", ""), key, algorithms=["RS256"], audience=project_id)
+            except jwt.PyJWTError:
+                return self._reply(403, {"errcode": "M_FORBIDDEN", "error": "Invalid login token"})
+            self._reply(200, {
+                "user_id": f"@firebase_{claims['sub']}:localhost",
+                "access_token": "stub",
+                "device_id": "STUB",
+            })
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Connection:
+    """A keep-alive HTTP/1.1 connection for JSON POSTs."""
+
+    def __init__(self, host, port, ssl):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reader = None
+        self.writer = None
+
+    async def post(self, path, payload):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        body = json.dumps(payload).encode('utf-8')
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode('ascii') + body
+        )
+        try:
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("connection closed by server")
+            status = int(status_line.split()[1])
+            length = 0
+            close = False
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(":")
+                name = name.strip().lower()
+                if name == "content-length":
+                    length = int(value)
+                elif name == "connection" and value.strip().lower() == "close":
+                    close = True
+            data = await self.reader.readexactly(length)
+        except BaseException:
+            self.close()
+            raise
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def run_load(args, tokens, url):
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    ssl = parts.scheme == "https"
+
+    total = args.requests or int(args.rate * args.duration)
+    queue = asyncio.Queue()
+    latencies = []
+    outcomes = Counter()
+
+    async def worker():
+        connection = Connection(parts.hostname, port, ssl)
+        while True:
+            item = await queue.get()
+            if item is None:
+                connection.close()
+                return
+            due, (uid, token) = item
+            payload = {
+                "type": "m.login.firebase",
+                "token": token,
+                "identifier": {"type": "m.id.user", "user": f"firebase_{uid}"},
+            }
+            try:
+                status, data = await asyncio.wait_for(connection.post(LOGIN_PATH, payload), args.timeout)
+            except asyncio.TimeoutError:
+                connection.close()
+                outcomes["timeout"] += 1
+                continue
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                outcomes[f"connection error ({type(e).__name__})"] += 1
+                continue
+            latencies.append(time.perf_counter() - due)
+            if status == 200:
+                outcomes["200 ok"] += 1
+            else:
+                try:
+                    errcode = json.loads(data).get("errcode", "-")
+                except ValueError:
+                    errcode = "-"
+                outcomes[f"{status} {errcode}"] += 1
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for i in range(total):
+        due = start + i / args.rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        queue.put_nowait((due, tokens[i % len(tokens)]))
+    for _ in workers:
+        queue.put_nowait(None)
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "target_rate": args.rate,
+        "achieved_rate": round(total / elapsed, 1),
+        "ok_per_sec": round(outcomes["200 ok"] / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "outcomes": dict(outcomes.most_common()),
+    }
+
+
+def print_report(result):
+    print(f"\n{result['requests']} requests in {result['elapsed_s']:.1f}s "
+          f"(target {result['target_rate']:.0f}/s, sent {result['achieved_rate']:.0f}/s)")
+    print(f"Successful logins: {result['ok_per_sec']:.1f}/s")
+    print(f"Latency from schedule: p50 {result['p50_ms']:.1f}ms  p90 {result['p90_ms']:.1f}ms  "
+          f"p99 {result['p99_ms']:.1f}ms  max {result['max_ms']:.1f}ms")
+    print("Outcomes:")
+    for outcome, count in result["outcomes"].items():
+        print(f"  {outcome:40} {count:8} ({count / result['requests']:.1%})")
+
+
+def main(args):
+    if args.tokens:
+        tokens = load_tokens(args.tokens)
+        print(f"Loaded {len(tokens)} tokens from {args.tokens}")
+    else:
+        if args.key:
+            with open(args.key) as f:
+                pem = f.read()
+            if args.keys_out:
+                write_public_keys(pem, args.keys_out, args.kid)
+        else:
+            pem = generate_key(args.keys_out, args.kid)
+            print(f"Generated a signing key; public key set written to {args.keys_out}")
+        uids = [f"{args.uid_prefix}{i}" for i in range(args.users)]
+        start = time.perf_counter()
+        tokens = mint_tokens(pem, args.kid, args.project_id, uids, args.expiry, args.mint_workers)
+        elapsed = time.perf_counter() - start
+        print(f"Minted {len(tokens)} tokens in {elapsed:.2f}s ({len(tokens) / elapsed:.0f}/s), "
+              f"valid for {args.expiry}s")
+        if args.save_tokens:
+            save_tokens(args.save_tokens, tokens)
+            print(f"Saved tokens to {args.save_tokens}")
+    if args.mint_only:
+        return
+    if not tokens:
+        sys.exit("No tokens to send")
+
+    url = args.url
+    stub = None
+    if args.stub:
+        with open(args.keys_out) as f:
+            public_pem = json.load(f)[args.kid]
+        stub = start_stub(public_pem, args.project_id)
+        url = "http://%s:%d" % stub.server_address
+        print(f"Stub login endpoint listening on {url}")
+
+    print(f"Sending logins to {url}{LOGIN_PATH} at {args.rate:.0f}/s over {args.concurrency} connections")
+    try:
+        result = asyncio.run(run_load(args, tokens, url))
+    finally:
+        if stub is not None:
+            stub.shutdown()
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test m.login.firebase logins')
+    parser.add_argument('--url', default='http://localhost:8008', help='Homeserver base URL')
+    parser.add_argument('--stub', action='store_true', help='Send to a local stub instead of a homeserver')
+    parser.add_argument('--rate', type=float, default=100, help='Target logins per second')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to send for')
+    parser.add_argument('--requests', type=int, help='Send exactly this many logins instead of --duration')
+    parser.add_argument('--concurrency', type=int, default=64, help='Connections, and so requests in flight')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+    tokens = parser.add_argument_group('tokens')
+    tokens.add_argument('--tokens', help='Use tokens saved with --save-tokens instead of minting')
+    tokens.add_argument('--users', type=int, default=1000, help='Distinct UIDs to mint tokens for')
+    tokens.add_argument('--uid-prefix', default='loadtest-', help='UIDs are this prefix plus a number')
+    tokens.add_argument('--expiry', type=int, default=3600, help='Token lifetime in seconds')
+    tokens.add_argument('--project-id', default='loadtest-project', help='Token audience and issuer project')
+    tokens.add_argument('--key', help='RSA private key (PEM) to sign with; generated if not given')
+    tokens.add_argument('--kid', default='loadtest', help='Key ID put in the token header')
+    tokens.add_argument('--keys-out', default='loadtest-keys.json',
+                        help='Where to write the public key set for token_verification.keys_file')
+    tokens.add_argument('--mint-workers', type=int, help='Processes used for signing (default: CPU count)')
+    tokens.add_argument('--save-tokens', help='Write minted tokens to this file, one JSON object per line')
+    tokens.add_argument('--mint-only', action='store_true', help='Mint (and save) tokens without sending')
+    parser.add_argument('--json', help='Write the results to this file as JSON')
+
+    main(parser.parse_args())
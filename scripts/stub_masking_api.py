@@ -0,0 +1,143 @@
+"""
+Local stand-in for the external masking API.
+
+Serves the two endpoints TextMasker talks to:
+
+    POST /mask        multipart form with a `query` field, returns masked text
+    POST /mask/batch  JSON {"queries": [...]}, returns {"results": [...]}
+    GET  /stats       request counters as JSON
+
+Masking replaces every digit with '*'. Latency and failure rate are
+configurable so the module can be exercised against a slow or flaky API.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIGITS = re.compile(r'\d')
+
+
+def mask(text):
+    return DIGITS.sub('*', text)
+
+
+def parse_multipart_query(content_type, body):
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body
+    )
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'query':
+            return part.get_payload(decode=True).decode('utf-8')
+    return None
+
+
+class StubState:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "batch_requests": 0, "queries": 0, "failures": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Replies are written whole, so nothing is held back waiting for an ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, code, body, content_type="text/plain; charset=utf-8"):
+            data = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            # end_headers() and a second write for the body, in one write
+            self._headers_buffer.append(b"\r\n" + data)
+            self.flush_headers()
+
+        def do_GET(self):
+            if self.path != "/stats":
+                return self._reply(404, "not found")
+            with state.lock:
+                body = json.dumps(state.stats)
+            self._reply(200, body, "application/json")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            delay = state.latency_ms + random.uniform(0, state.jitter_ms)
+            if delay:
+                time.sleep(delay / 1000)
+            if random.random() < state.failure_rate:
+                state.count("failures")
+                return self._reply(503, "stub failure")
+
+            if self.path.rstrip("/").endswith("/batch"):
+                state.count("batch_requests")
+                try:
+                    queries = json.loads(body)["queries"]
+                except (ValueError, KeyError):
+                    return self._reply(400, "expected {\"queries\": [...]}")
+                state.count("queries", len(queries))
+                return self._reply(200, json.dumps({"results": [mask(q) for q in queries]}), "application/json")
+
+            state.count("requests")
+            query = parse_multipart_query(self.headers.get("Content-Type", ""), body)
+            if query is None:
+                return self._reply(400, "missing query field")
+            state.count("queries")
+            self._reply(200, mask(query))
+
+    return Handler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 overflows when a client pool connects all at
+    # once, and each dropped SYN stalls a connection for a second
+    request_queue_size = 128
+
+
+def start_server(host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0):
+    """Start the stub in a background thread and return the server.
+
+    The bound address is ``server.server_address``; stop it with
+    ``server.shutdown()``.
+    """
+    state = StubState(latency_ms, jitter_ms, failure_rate)
+    server = StubServer((host, port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stub of the masking API')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8090, help='Port to bind (default: 8090)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Fixed delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra delay up to this many ms')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.failure_rate)
+    host, port = server.server_address
+    print(f"Stub masking API listening on http://{host}:{port}/mask (batch: /mask/batch)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
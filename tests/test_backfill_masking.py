@@ -0,0 +1,58 @@
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import backfill_masking  # noqa: E402
+
+
+def sqlite_query(query):
+    """SELECT_MESSAGES in SQLite syntax: named parameters and no casts."""
+    query = re.sub(r'::\w+', '', query)
+    return re.sub(r'%\((\w+)\)s', r':\1', query)
+
+
+class SelectMessagesTest(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript("""
+            CREATE TABLE events (stream_ordering INTEGER, event_id TEXT, type TEXT, room_id TEXT);
+            CREATE TABLE event_json (event_id TEXT, json TEXT);
+            CREATE TABLE redactions (redacts TEXT);
+        """)
+        # Federation backfill stores events with negative stream orderings
+        for ordering in (-7, -2, 3, 9):
+            event_id = f"$event{ordering}"
+            self.db.execute("INSERT INTO events VALUES (?, ?, 'm.room.message', '!room:example.com')",
+                            (ordering, event_id))
+            self.db.execute("INSERT INTO event_json VALUES (?, '{}')", (event_id,))
+        self.db.execute("INSERT INTO redactions VALUES ('$event3')")
+
+    def tearDown(self):
+        self.db.close()
+
+    def select(self, after):
+        rows = self.db.execute(
+            sqlite_query(backfill_masking.SELECT_MESSAGES), {"after": after, "room_id": None}
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def test_fresh_run_includes_backfilled_events(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = backfill_masking.load_checkpoint(os.path.join(tmp, "checkpoint.json"))
+        self.assertEqual(self.select(checkpoint["after"]), [-7, -2, 9])
+
+    def test_resume_after_negative_ordering(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "checkpoint.json")
+            backfill_masking.save_checkpoint(path, {"after": -7, "scanned": 1, "changed": 0})
+            checkpoint = backfill_masking.load_checkpoint(path)
+        self.assertEqual(self.select(checkpoint["after"]), [-2, 9])
+
+
+if __name__ == "__main__":
+    unittest.main()
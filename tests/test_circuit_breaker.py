@@ -0,0 +1,65 @@
+import unittest
+
+from config.modules.circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(reset_timeout=30, clock=self.clock)
+
+    def request(self, latency: float) -> bool:
+        """Send a request that takes ``latency`` seconds, if the breaker allows it."""
+        if not self.breaker.allow_request():
+            self.clock.now += 1
+            return False
+        timeout = self.breaker.current_timeout()
+        if latency > timeout:
+            self.clock.now += timeout
+            self.breaker.record_failure(timeout)
+            return False
+        self.clock.now += latency
+        self.breaker.record_success(latency)
+        return True
+
+    def test_timeout_follows_latency(self):
+        for _ in range(100):
+            self.assertTrue(self.request(0.05))
+        self.assertAlmostEqual(self.breaker.current_timeout(), 0.2)
+
+    def test_recovers_when_latency_rises_above_timeout(self):
+        breaker = CircuitBreaker(min_timeout=0.01, reset_timeout=30, clock=self.clock)
+        self.breaker = breaker
+        for _ in range(200):
+            self.assertTrue(self.request(0.05))
+        self.assertAlmostEqual(breaker.current_timeout(), 0.075)
+
+        # The service now answers in 400ms, well over the 75ms timeout
+        outcomes = [self.request(0.4) for _ in range(300)]
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(all(outcomes[-50:]))
+        self.assertGreaterEqual(breaker.current_timeout(), 0.4)
+
+    def test_half_open_probe_uses_max_timeout(self):
+        for _ in range(50):
+            self.request(0.05)
+        for _ in range(20):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.current_timeout(), self.breaker.max_timeout)
+        self.breaker.record_success(0.4)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+
+from twisted.internet import defer, task
+
+from config.modules.edits import EditWindow, diff_window, splice
+from config.modules.room_policy import RoomPolicy
+from config.modules.rule_engine import RuleEngine
+from config.modules.word_matcher import WordMatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from benchmark_modules import FakeEvent, FakeModuleApi  # noqa: E402
+
+RULES = RuleEngine(WordMatcher(["idiot"]))
+
+FILLER = " ".join(f"word{i}" for i in range(40))
+
+
+def incremental(old, new, margin=32):
+    """Mask ``new`` by re-scanning only the window around the edit."""
+    old_masked = RULES.mask(old)
+    window = diff_window(old, new, old_masked, margin)
+    return window, splice(old_masked, window, RULES.mask(new[window.start:window.new_end]))
+
+
+class DiffWindowTest(unittest.TestCase):
+    def test_unchanged(self):
+        text = f"{FILLER} call 9876543210"
+        window = diff_window(text, text, RULES.mask(text))
+        self.assertEqual(window, EditWindow(len(text), len(text), len(text), 0))
+
+    def test_window_is_margin_out_to_whitespace(self):
+        old = f"{FILLER} hello {FILLER}"
+        new = f"{FILLER} hallo {FILLER}"
+        window = diff_window(old, new, old, margin=8)
+        self.assertEqual(window.changed, 1)
+        prefix = len(FILLER) + 2
+        self.assertLessEqual(window.start, prefix - 8)
+        self.assertGreater(window.start, prefix - 8 - len("word39 "))
+        self.assertTrue(window.start == 0 or new[window.start - 1] == ' ')
+        self.assertTrue(window.new_end == len(new) or new[window.new_end] == ' ')
+        self.assertLess(window.new_end - window.start, 40)
+
+    def test_length_changing_edit(self):
+        old = f"{FILLER} my number is 98765 {FILLER}"
+        new = f"{FILLER} my number is 9876543210 {FILLER}"
+        window, masked = incremental(old, new)
+        self.assertEqual(window.new_end - window.old_end, len(new) - len(old))
+        self.assertEqual(masked, RULES.mask(new))
+        self.assertIn("987***3210", masked)
+
+    def test_masked_span_across_the_window_edge_is_rescanned_whole(self):
+        # The margin ends inside a phone number with spaces in it; the window
+        # has to take all of it, or the result would keep a half-masked number
+        number = "+91 98765 43210"
+        for old, new in (
+            (f"{FILLER} call {number} you idiot", f"{FILLER} call {number} you idiots"),
+            (f"idiot, call {number} {FILLER}", f"idiots, call {number} {FILLER}"),
+        ):
+            number_start = new.index(number)
+            number_end = number_start + len(number)
+            for margin in range(60):
+                with self.subTest(old=old[:12], margin=margin):
+                    window, masked = incremental(old, new, margin)
+                    self.assertFalse(number_start < window.start < number_end)
+                    self.assertFalse(number_start < window.new_end < number_end)
+                    self.assertEqual(masked, RULES.mask(new))
+
+    def test_edits_match_a_full_scan(self):
+        old = f"reach me at 9876543210 or bob@example.com, {FILLER} you idiot"
+        for new in (
+            old.replace("9876543210", "9876543211"),
+            old.replace("bob@", "bobby@"),
+            old.replace("you idiot", "you are an idiot"),
+            old.replace("reach me", "call me"),
+            old + " and 9123456780",
+            old[:20],
+        ):
+            with self.subTest(new=new):
+                _, masked = incremental(old, new)
+                self.assertEqual(masked, RULES.mask(new))
+
+
+class MaskEditTest(unittest.TestCase):
+    def setUp(self):
+        from config.modules.text_masker import TextMasker
+
+        self.masker = TextMasker({"edits": {"enabled": True}, "admission": {"enabled": False}},
+                                 FakeModuleApi(task.Clock()))
+        self.addCleanup(self.masker.offloader.stop)
+
+    def edit(self, target_id, body):
+        event = FakeEvent(f"* {body}", 2)
+        event.content.update({
+            "m.relates_to": {"rel_type": "m.replace", "event_id": target_id},
+            "m.new_content": {"msgtype": "m.text", "body": body},
+        })
+        d = defer.ensureDeferred(self.masker._mask_edit(event, RoomPolicy(api=False)))
+        self.assertTrue(d.called)
+        return d.result
+
+    def test_length_changing_mask_falls_back_to_a_full_scan(self):
+        # A one-character email local part masks to two characters, so the
+        # masked base no longer lines up with the original
+        old = f"{FILLER} mail a@example.com"
+        old_masked = self.masker.mask_text_by_rules(old)
+        self.assertNotEqual(len(old), len(old_masked))
+        self.masker.edit_bases.set("$target", (old, old_masked))
+
+        new = old + " or call 9876543210"
+        content = self.edit("$target", new)
+        self.assertEqual(content["m.new_content"]["body"], self.masker.mask_text_by_rules(new))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import random
+import re
+import time
+import unittest
+
+from config.modules.email_detector import find_email_spans
+
+# The email pattern the rule engine used before the linear-time detector
+LEGACY_EMAIL = re.compile(r'''
+    (?:[a-zA-Z0-9._%+-]+|"[^"\\]*(?:\\.[^"\\]*)*")
+    @
+    (?:[a-zA-Z0-9.-]+|\[(?:[0-9]{1,3}\.){3}[0-9]{1,3}\])
+    \.[a-zA-Z]{2,}
+''', re.VERBOSE | re.IGNORECASE)
+
+
+def emails(text):
+    return [text[start:end] for start, end in find_email_spans(text)]
+
+
+class FindEmailSpansTest(unittest.TestCase):
+    def test_emails(self):
+        for text in (
+            "john.doe@example.com",
+            "a+tag@mail.example.co.uk",
+            '"john doe"@example.com',
+            "root@[192.168.1.1].com",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(emails(f"mail {text}, thanks"), [text])
+
+    def test_not_emails(self):
+        for text in ("@alice:example.com", "a@b", "a@b.c", "user@localhost", "a@.com"):
+            with self.subTest(text=text):
+                self.assertEqual(emails(text), [])
+
+    def test_matches_legacy_pattern(self):
+        rng = random.Random(7)
+        alphabet = 'ab.@-_+"\\[]19Z% '
+        for _ in range(20000):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 30)))
+            expected = [m.span() for m in LEGACY_EMAIL.finditer(text)]
+            self.assertEqual(find_email_spans(text), expected, text)
+
+    def test_linear_on_adversarial_input(self):
+        # The legacy pattern took seconds on each of these
+        for text in (
+            "a" * 8000 + "@" + "a." * 4000,
+            "a" * 16000 + "@" + "a" * 16000,
+            "a@" * 8000,
+            '"@' * 8000,
+        ):
+            started = time.perf_counter()
+            find_email_spans(text)
+            self.assertLess(time.perf_counter() - started, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import time
+import unittest
+
+from config.modules.html_masker import FormattedBody
+from config.modules.rule_engine import RuleEngine
+from config.modules.word_matcher import WordMatcher
+
+
+def mask(source: str) -> str:
+    document = FormattedBody(source)
+    return document.apply(RuleEngine(WordMatcher(["idiot"])).find_spans(document.text))
+
+
+class FormattedBodyTest(unittest.TestCase):
+    def test_masks_text_and_href(self):
+        self.assertEqual(
+            mask('<p>call <b>98765</b>43210</p><a href="tel:9876543210">you idiot</a>'),
+            '<p>call <b>987**</b>*3210</p><a href="tel:987***3210">you *****</a>',
+        )
+
+    def test_quoted_attribute_may_contain_gt(self):
+        document = FormattedBody("<a title='x>y' href=http://example.com>link</a>")
+        self.assertEqual(document.text, "\nhttp://example.com\nlink")
+
+    def test_href_inside_another_attribute_is_not_the_href(self):
+        self.assertEqual(
+            mask('<a title="href=x" href="mailto:a@b.com">mail</a>'),
+            '<a title="href=x" href="mailto:a*@b.com">mail</a>',
+        )
+        document = FormattedBody("<a data-x='href=\"y\"' HREF=tel:9876543210>call</a>")
+        self.assertEqual(document.text, "\ntel:9876543210\ncall")
+
+    def test_unterminated_tag_is_text(self):
+        document = FormattedBody('<p>hi</p><a "oops <b>idiot</b>')
+        self.assertEqual(document.text, '\nhi\n<a "oops <b>idiot</b>')
+
+    def test_unterminated_tags_tokenize_in_linear_time(self):
+        # Used to backtrack quadratically, about 0.4s for 2000 repeats
+        start = time.perf_counter()
+        document = FormattedBody('<a "' * 50000)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(document.text, '<a "' * 50000)
+
+
+if __name__ == "__main__":
+    unittest.main()
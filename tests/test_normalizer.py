@@ -0,0 +1,22 @@
+import time
+import unittest
+
+from config.modules.normalizer import normalize
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_leetspeak_next_to_letters(self):
+        self.assertEqual(normalize("sh1t and $h!t!")[0], "shit and shit!")
+        self.assertEqual(normalize("call 911 or 2024")[0], "call 911 or 2024")
+
+    def test_long_leet_runs_normalize_in_linear_time(self):
+        # Used to backtrack quadratically, about 4s for 16000 "$"
+        for text in ("$" * 50000, "a" + "1" * 50000, "1" * 50000 + "a"):
+            with self.subTest(text=text[:3]):
+                start = time.perf_counter()
+                normalize(text)
+                self.assertLess(time.perf_counter() - start, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
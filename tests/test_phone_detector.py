@@ -0,0 +1,50 @@
+import unittest
+
+from config.modules.phone_detector import find_phone_spans
+
+
+def phones(text):
+    return [text[start:end] for start, end in find_phone_spans(text)]
+
+
+class FindPhoneSpansTest(unittest.TestCase):
+    def test_phone_numbers(self):
+        for text in (
+            "9876543210",
+            "+91 98765 43210",
+            "(987) 654-3210",
+            "987.654.3210",
+            "1.800.555.1234",
+            "+1.234.567.8901",
+            "+1 (234) 567-8900",
+            "+44(20) 7946 0958",
+            "95 95 95",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(phones(f"call {text} now"), [text])
+
+    def test_extension(self):
+        self.assertEqual(phones("call 987-654-3210 ext 12"), ["987-654-3210 ext 12"])
+
+    def test_false_positives(self):
+        for text in (
+            "server at 192.168.1.100",
+            "connect to 10.200.100.250:8448",
+            "ping 255.255.255.255 and 8.8.8.8",
+            "version 1.2.3",
+            "order #12345",
+            "on 2024-01-15",
+            "at 2024-01-15 10:30",
+            "at 2024.01.15 14:05",
+            "at 15-01-2024 10:30",
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(phones(text), [])
+
+    def test_dotted_digits_that_are_not_ipv4(self):
+        # Octets above 255 can't be an address
+        self.assertEqual(phones("call 91.987.654.321"), ["91.987.654.321"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from config.modules.result_cache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_tuple_members_count_towards_max_bytes(self):
+        cache = ResultCache(max_entries=1000, max_bytes=64 * 1024)
+        for i in range(100):
+            text = str(i) * 4096
+            cache.set(f"$event{i}", (text, text.upper()))
+        self.assertLessEqual(cache.size_bytes, 64 * 1024)
+        self.assertGreater(cache.evictions, 0)
+        self.assertLess(len(cache), 100)
+        # The most recent entries are kept
+        self.assertIn("$event99", cache)
+        self.assertNotIn("$event0", cache)
+
+    def test_oversized_entry_is_not_stored(self):
+        cache = ResultCache(max_bytes=1024)
+        cache.set("key", ("x" * 2048, "y"))
+        self.assertNotIn("key", cache)
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_lru_eviction_by_entries(self):
+        cache = ResultCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
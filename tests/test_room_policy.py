@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from config.modules.room_policy import DEFAULT_POLICY, POLICY_EVENT_TYPE, RoomPolicies
+
+
+class FakeApi:
+    def __init__(self, admins=()):
+        self.admins = set(admins)
+
+    async def is_user_admin(self, user_id):
+        return user_id in self.admins
+
+
+def policy_state(sender, content, event_id="$policy"):
+    event = SimpleNamespace(event_id=event_id, sender=sender, content=content)
+    return {(POLICY_EVENT_TYPE, ""): event}
+
+
+class RoomPoliciesTest(unittest.TestCase):
+    def resolve(self, policies, room_id, state):
+        return asyncio.run(policies.resolve(room_id, state))
+
+    def test_room_creator_cannot_exempt_their_room(self):
+        policies = RoomPolicies(FakeApi(admins={"@admin:example.com"}))
+        state = policy_state("@mallory:example.com", {"enabled": False, "api": False})
+        self.assertEqual(self.resolve(policies, "!mallory:example.com", state), DEFAULT_POLICY)
+
+    def test_admin_policy_is_honored(self):
+        policies = RoomPolicies(FakeApi(admins={"@admin:example.com"}))
+        state = policy_state("@admin:example.com", {"enabled": False})
+        self.assertFalse(self.resolve(policies, "!bots:example.com", state).enabled)
+
+    def test_trusted_sender_policy_is_honored(self):
+        policies = RoomPolicies(FakeApi(), trusted_senders=["@moderator:example.com"])
+        state = policy_state("@moderator:example.com", {"api": False})
+        self.assertFalse(self.resolve(policies, "!room:example.com", state).api)
+
+    def test_exempt_rooms(self):
+        policies = RoomPolicies(FakeApi(), exempt_rooms=["!notices:example.com"])
+        self.assertFalse(self.resolve(policies, "!notices:example.com", None).enabled)
+        self.assertEqual(self.resolve(policies, "!other:example.com", None), DEFAULT_POLICY)
+
+
+if __name__ == "__main__":
+    unittest.main()
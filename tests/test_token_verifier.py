@@ -0,0 +1,178 @@
+import time
+import unittest
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from twisted.internet import defer, task
+
+from config.modules.result_cache import ResultCache
+from config.modules.token_verifier import (
+    ExpiredTokenError,
+    FirebaseTokenVerifier,
+    TokenVerificationError,
+    load_public_keys,
+)
+
+PROJECT_ID = "test-project"
+
+
+def generate_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode('ascii')
+    return key, public_pem
+
+
+class FakeApi:
+    def run_as_background_process(self, desc, func, *args, **kwargs):
+        return defer.ensureDeferred(func(*args, **kwargs))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+class FirebaseTokenVerifierTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.keys = {kid: generate_key() for kid in ("one", "two", "three")}
+
+    def setUp(self):
+        self.reactor = task.Clock()
+        self.clock = FakeClock()
+        self.fetches = 0
+        # The key set the next fetch returns
+        self.published = {"one": self.keys["one"][1]}
+        self.verifier = FirebaseTokenVerifier(
+            FakeApi(),
+            PROJECT_ID,
+            min_refresh_interval=60,
+            fetch_timeout=5,
+            clock=self.clock,
+            reactor=self.reactor,
+        )
+        self.verifier.cache = ResultCache(ttl=0, clock=self.clock)
+        self.verifier._fetch_keys = self.fake_fetch
+        self.verifier.start()
+        self.assertEqual(self.fetches, 1)
+
+    def tearDown(self):
+        self.verifier.stop()
+
+    async def fake_fetch(self):
+        self.fetches += 1
+        self.verifier._last_refresh = self.clock()
+        self.verifier._keys = load_public_keys(self.published)
+
+    def mint(self, kid="one", **claims):
+        now = int(time.time())
+        payload = {
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+            "aud": PROJECT_ID,
+            "sub": "user-1",
+            "iat": now,
+            "auth_time": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.keys[kid][0], algorithm="RS256", headers={"kid": kid})
+
+    def verify(self, token):
+        d = defer.ensureDeferred(self.verifier.verify(token))
+        self.assertTrue(d.called, "verify() is waiting on a key fetch")
+        failures = []
+        d.addErrback(failures.append)
+        if failures:
+            failures[0].raiseException()
+        return d.result
+
+    def test_valid_token(self):
+        claims = self.verify(self.mint())
+        self.assertEqual(claims["sub"], "user-1")
+
+    def test_claim_validation(self):
+        now = int(time.time())
+        for claims in (
+            {"aud": "other-project"},
+            {"iss": "https://securetoken.google.com/other-project"},
+            {"iat": now + 3600},
+            {"sub": ""},
+            {"auth_time": now + 3600},
+        ):
+            with self.subTest(claims=claims):
+                with self.assertRaises(TokenVerificationError):
+                    self.verify(self.mint(**claims))
+
+    def test_expired_token(self):
+        now = int(time.time())
+        with self.assertRaises(ExpiredTokenError):
+            self.verify(self.mint(iat=now - 7200, exp=now - 3600))
+
+    def test_unknown_kid_refreshes_keys(self):
+        self.published["two"] = self.keys["two"][1]
+        self.clock.now += 61
+        self.assertEqual(self.verify(self.mint(kid="two"))["sub"], "user-1")
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.clock.now += 61
+        for _ in range(3):
+            with self.assertRaises(TokenVerificationError):
+                self.verify(self.mint(kid="three"))
+        self.assertEqual(self.fetches, 2)
+
+        # Published meanwhile, but not fetched again until the interval has passed
+        self.published["three"] = self.keys["three"][1]
+        with self.assertRaises(TokenVerificationError):
+            self.verify(self.mint(kid="three"))
+        self.clock.now += 61
+        self.verify(self.mint(kid="three"))
+        self.assertEqual(self.fetches, 3)
+
+    def test_verified_claims_are_cached_until_exp(self):
+        token = self.mint()
+        decodes = []
+        decode = self.verifier._decode
+        self.verifier._decode = lambda *args: decodes.append(args) or decode(*args)
+
+        self.verify(token)
+        self.clock.now += 3500
+        self.verify(token)
+        self.assertEqual(len(decodes), 1)
+
+        # Past exp by the verifier's clock, the token is checked again
+        self.clock.now += 101
+        self.verify(token)
+        self.assertEqual(len(decodes), 2)
+        self.assertEqual(self.verifier.cache.expirations, 1)
+
+    def test_key_fetch_is_bounded(self):
+        async def hanging_fetch():
+            self.fetches += 1
+            await defer.Deferred()
+
+        self.verifier._fetch_keys = hanging_fetch
+        self.clock.now += 61
+        d = defer.ensureDeferred(self.verifier.verify(self.mint(kid="two")))
+        self.assertFalse(d.called)
+
+        self.reactor.advance(5)
+        self.assertTrue(d.called)
+        failures = []
+        d.addErrback(failures.append)
+        self.assertEqual(len(failures), 1)
+        failures[0].trap(TokenVerificationError)
+        self.assertIn("unknown key", str(failures[0].value))
+        # A later refresh is not stuck behind the abandoned one
+        self.assertIsNone(self.verifier._waiters)
+
+
+if __name__ == "__main__":
+    unittest.main()